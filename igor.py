@@ -5,6 +5,9 @@ import ast
 
 import media.mbr as mbr
 import media.gpt as gpt
+import media.image as image
+import media.cache as cache
+import media.iostats as iostats
 import part.refs.vol as vol
 import part.refs.entry_block as reb
 import part.refs.tree_control as rtc
@@ -12,8 +15,17 @@ import part.refs.allocator as ralloc
 import part.refs.object_tree as rot
 import part.refs.attribute as rattr
 from util.hexdump import hexdump
-from util.filetree import filetree, dump_filetree
+from util.filetree import (open_filetree, dump_filetree, dump_filetree_entries, iter_filetree,
+                           file_dataruns, resolve, ROOT_NODEID)
 import util.carving as carving
+import util.block_index as block_index
+import util.navigation as navigation
+import util.allocation as allocation
+import util.discovery as discovery
+import util.partitions as partitions
+import util.parallel as parallel
+import util.profiling as profiling
+from util.jsonl import JsonlWriter
 from util.func_parser import FuncArgumentParser, FuncArgumentParserError, FuncArgumentParserHelp
 from util.table import print_table
 
@@ -24,6 +36,19 @@ def _datarun_arg(s):
     except:
         raise argparse.ArgumentTypeError('Datarun entry must be <entryblock_identifier>,<number>.')
 
+def _jobs_arg(s):
+    try:
+        jobs = int(s, 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Number of jobs must be an integer.')
+    if jobs < 0:
+        raise argparse.ArgumentTypeError('Number of jobs must be positive (0 for all the CPUs).')
+    # 0 uses all the CPUs
+    return jobs or parallel.cpu_count()
+
+def _decode_name(name):
+    return name.decode('utf-16le') if name else None
+
 class PyReFSShell(cmd.Cmd):
     intro = None
     #     intro = '''Hello master! Welcome home.
@@ -36,6 +61,29 @@ class PyReFSShell(cmd.Cmd):
     part = None
     parts = None
     blocks = None
+    # blocks found in all the partitions by the --all-partitions mode of
+    # find_entryblocks, by partition index
+    all_blocks = None
+    # part of the partition the blocks were found in: allocation.SCAN_ALL when
+    # scanned or loaded from the index, the other scan modes or 'metadata'
+    # when found by navigate
+    blocks_scope = allocation.SCAN_ALL
+    # allocation map of the partition, read when first needed
+    allocation = None
+    # sector, cluster and metadata block sizes of the partition (vol.geometry)
+    geometry = None
+    use_index = True
+    # None for the default of the backend (see cache.default_capacity)
+    cache_capacity = None
+    cache_readahead = 0
+    io = None
+    io_summary = False
+    io_last = None
+    io_commands = None
+    _io_before = None
+    # JsonlWriter the commands results are written to instead of being
+    # printed (batch mode with the jsonl format)
+    out = None
 
     def __init__(self, **args):
         cmd.Cmd.__init__(self, args)
@@ -59,6 +107,24 @@ class PyReFSShell(cmd.Cmd):
         file_argparser.add_argument('-F', '--folders', action='store_true',
                 default=False,
                 help='find folders in provided dump (only considered if -i defined)')
+        file_argparser.add_argument('-j', '--jobs', action='store',
+                type=_jobs_arg, default=1,
+                help='number of processes used to find the blocks, 0 for all the CPUs ' +
+                     '(only considered if -i defined)')
+        file_argparser.add_argument('-m', '--metadata', action='store_true',
+                default=False,
+                help='find the blocks by following the volume metadata instead ' +
+                     'of scanning the partition (only considered if -i defined)')
+        file_argparser.add_argument('-D', '--discover', action='store_true',
+                default=False,
+                help='look for ReFS volume records in the whole dump instead of ' +
+                     'reading its partition table')
+        file_argparser.add_argument('-n', '--no-index', action='store_true',
+                default=False, dest='no_index',
+                help='do not load nor save the blocks index kept next to the dump')
+        file_argparser.add_argument('-b', '--backend', action='store',
+                choices=sorted(image.BACKENDS), default=image.DEFAULT_BACKEND,
+                help='method used to read the dump (default: {})'.format(image.DEFAULT_BACKEND))
         vol_argparser = FuncArgumentParser(
                 prog='vol',
                 description='Dump the volume record information from the current ReFS partition.')
@@ -80,14 +146,49 @@ class PyReFSShell(cmd.Cmd):
         feb_argparser.add_argument('-F', '--folders', action='store_true',
                 default=False, dest='folders',
                 help='Collect information on the number of folders in the entryblocks.')
+        feb_argparser.add_argument('-j', '--jobs', action='store',
+                type=_jobs_arg, default=1,
+                help='Number of processes used to scan the partition, 0 for all the CPUs ' +
+                     '(default: 1).')
+        feb_argparser.add_argument('-s', '--scan', action='store',
+                choices=allocation.SCAN_MODES, default=allocation.SCAN_ALL,
+                help='Clusters of the partition to scan, according to its allocator ' +
+                     '(experimental, the allocator layout is a heuristic; default: {}).'.format(
+                         allocation.SCAN_ALL))
+        feb_argparser.add_argument('-a', '--all-partitions', action='store_true',
+                default=False, dest='all_partitions',
+                help='Find the entryblocks of all the partitions, each partition being' +
+                     ' scanned by its own process (the whole partitions are scanned).')
+        nav_argparser = FuncArgumentParser(
+                prog='navigate',
+                description='Find the entryblocks in use in the current partition' +
+                            ' by following the tree control to the object tree,' +
+                            ' without scanning the partition. If requested number' +
+                            ' of files and folders information will be also collected.')
+        nav_argparser.add_argument('-f', '--files', action='store_true',
+                default=False, dest='files',
+                help='Collect information on the number of files in the entryblocks.')
+        nav_argparser.add_argument('-F', '--folders', action='store_true',
+                default=False, dest='folders',
+                help='Collect information on the number of folders in the entryblocks.')
         fp_argparser = FuncArgumentParser(
                 prog='find_pattern',
-                description='Find a data pattern in all the blocks of the current partition.' +
+                description='Find data patterns in all the blocks of the current partition.' +
+                            ' All the patterns are looked for in a single pass.' +
                             ' Special characters (including spaces, carriage return, etc.)' +
                             ' are not allowed in the pattern, think of escaping them.')
         fp_argparser.add_argument('pattern', action='store',
-                type=str,
+                type=str, nargs='+',
                 help='Pattern to find in the current partition blocks.')
+        fp_argparser.add_argument('-j', '--jobs', action='store',
+                type=_jobs_arg, default=1,
+                help='Number of processes used to scan the partition, 0 for all the CPUs ' +
+                     '(default: 1).')
+        fp_argparser.add_argument('-s', '--scan', action='store',
+                choices=allocation.SCAN_MODES, default=allocation.SCAN_ALL,
+                help='Clusters of the partition to scan, according to its allocator ' +
+                     '(experimental, the allocator layout is a heuristic; default: {}).'.format(
+                         allocation.SCAN_ALL))
         lfiles_argparser = FuncArgumentParser(
                 prog='list_filenames',
                 description='List the found filenames from the list of ' +
@@ -134,6 +235,14 @@ class PyReFSShell(cmd.Cmd):
         alloc_argparser.add_argument('entryblock_identifier', action='store',
                 type=lambda x: int(x, 0),
                 help='entryblock identifier of the Allocator to dump')
+        amap_argparser = FuncArgumentParser(
+                prog='allocation',
+                description='Decode the allocator of the current partition into' +
+                            ' its allocation map, and show its allocated and free clusters' +
+                            ' (experimental, the allocator layout is a heuristic).')
+        amap_argparser.add_argument('-l', '--list', action='store_true',
+                default=False,
+                help='List the runs of allocated and free clusters.')
         attr_argparser = FuncArgumentParser(
                 prog='attribute',
                 description='Parse the given dump offset (in bytes) as an ' +
@@ -160,14 +269,31 @@ class PyReFSShell(cmd.Cmd):
         ldr_argparser = FuncArgumentParser(
                 prog='list_dataruns',
                 description='Retrieve list of all the files dataruns.')
+        ldr_argparser.add_argument('-a', '--all-partitions', action='store_true',
+                default=False, dest='all_partitions',
+                help='List the dataruns of the files of all the partitions, each' +
+                     ' partition being analyzed by its own process.')
         ft_argparser = FuncArgumentParser(
                 prog='filetree',
                 description='Extract the file tree structure from the given ' +
                             'node (use node 0x600 by default).')
         ft_argparser.add_argument('node_id', action='store',
-                type=lambda x: int(x, 0), nargs='?', default=0x600,
+                type=lambda x: int(x, 0), nargs='?', default=ROOT_NODEID,
                 help='node identifier of the node to extract the file tree ' +
                      'structure from')
+        ft_argparser.add_argument('-a', '--all-partitions', action='store_true',
+                default=False, dest='all_partitions',
+                help='Extract the file tree of all the partitions, each partition' +
+                     ' being analyzed by its own process.')
+        resolve_argparser = FuncArgumentParser(
+                prog='resolve',
+                description='Find the file or folder at the given path, ' +
+                            'only reading the folders on the path.')
+        resolve_argparser.add_argument('path', action='store',
+                help='path of the file or folder (e.g. /Users/x/report.docx)')
+        resolve_argparser.add_argument('-n', '--node-id', action='store',
+                type=lambda x: int(x, 0), default=ROOT_NODEID, dest='node_id',
+                help='node identifier of the folder the path starts from')
         hd_argparser = FuncArgumentParser(
                 prog='hexdump',
                 description='Hexdump the number of bytes at the provided ' +
@@ -185,6 +311,48 @@ class PyReFSShell(cmd.Cmd):
         hb_argparser.add_argument('entryblock_id', action='store',
                 type=lambda x: int(x, 0),
                 help='entryblock identifier to hexdump')
+        cache_argparser = FuncArgumentParser(
+                prog='cache',
+                description='Show the statistics of the blocks cache, ' +
+                            'resize or flush it.')
+        cache_argparser.add_argument('-s', '--size', action='store',
+                type=int, default=None,
+                help='capacity of the cache in MiB (0 disables the cache, default: ' +
+                     '64, 0 with the mmap backend)')
+        cache_argparser.add_argument('-r', '--readahead', action='store',
+                type=int, default=None,
+                help='number of blocks read ahead on a cache miss')
+        cache_argparser.add_argument('-f', '--flush', action='store_true',
+                default=False,
+                help='drop all the cached blocks and reset the statistics')
+        iostats_argparser = FuncArgumentParser(
+                prog='iostats',
+                description='Show the reads done on the dump by the last ' +
+                            'command and by each command since the start.')
+        iostats_argparser.add_argument('-a', '--auto', action='store',
+                choices=['on', 'off'], default=None,
+                help='print a one line summary of the reads after each command')
+        iostats_argparser.add_argument('-r', '--reset', action='store_true',
+                default=False,
+                help='reset the counters of the commands')
+        profile_argparser = FuncArgumentParser(
+                prog='profile',
+                description='Run the provided command under cProfile and ' +
+                            'show where the time was spent, by module and ' +
+                            'by function.')
+        profile_argparser.add_argument('-n', '--limit', action='store',
+                type=int, default=20,
+                help='number of functions to show (default: 20, 0 for all)')
+        profile_argparser.add_argument('-o', '--output', action='store',
+                default=None,
+                help='file onto which the pstats of the run will be saved')
+        profile_argparser.add_argument('-c', '--collapsed', action='store',
+                default=None,
+                help='file onto which the collapsed stacks of the run will be ' +
+                     'saved, for flamegraph tools')
+        profile_argparser.add_argument('command', action='store',
+                nargs=argparse.REMAINDER,
+                help='command to profile, with its arguments')
         bye_argparser = FuncArgumentParser(
                 prog='bye',
                 description='Exit the program. Are you sure?')
@@ -205,6 +373,7 @@ class PyReFSShell(cmd.Cmd):
                       vol_argparser.prog: vol_argparser,
                       part_argparser.prog: part_argparser,
                       feb_argparser.prog: feb_argparser,
+                      nav_argparser.prog: nav_argparser,
                       fp_argparser.prog: fp_argparser,
                       lfiles_argparser.prog: lfiles_argparser,
                       lfolders_argparser.prog: lfolders_argparser,
@@ -213,12 +382,17 @@ class PyReFSShell(cmd.Cmd):
                       tce_argparser.prog: tce_argparser,
                       ot_argparser.prog: ot_argparser,
                       alloc_argparser.prog: alloc_argparser,
+                      amap_argparser.prog: amap_argparser,
                       attr_argparser.prog: attr_argparser,
                       ds_argparser.prog: ds_argparser,
                       ldr_argparser.prog: ldr_argparser,
                       ft_argparser.prog: ft_argparser,
+                      resolve_argparser.prog: resolve_argparser,
                       hd_argparser.prog: hd_argparser,
                       hb_argparser.prog: hb_argparser,
+                      cache_argparser.prog: cache_argparser,
+                      iostats_argparser.prog: iostats_argparser,
+                      profile_argparser.prog: profile_argparser,
                       bye_argparser.prog: bye_argparser,
                       record_argparser.prog: record_argparser,
                       playback_argparser.prog: playback_argparser
@@ -258,33 +432,30 @@ You can also initialize the list of entryblocks of the partition.'''
         self.dump_filename = args.dump
         print('Master I will try to follow your wishes by loading `{}`.'.format(self.dump_filename))
         try:
-            self.dump_file = open(self.dump_filename, 'rb')
+            self.io = iostats.AccountedImage(
+                    image.open_image(self.dump_filename, args.backend))
+            capacity = self.cache_capacity
+            if capacity is None:
+                capacity = cache.default_capacity(self.io)
+            self.dump_file = cache.CachedImage(self.io, capacity, self.cache_readahead)
+            if self.io.backend == 'gzip':
+                print('Master, the dump is gzip compressed, I will read it through its index of seek points.')
         except:
             print('I tried hard Master, but I couldn\'t open the requested file.')
             print('Are you sure it exists?')
             return
-        mbr_data = mbr.readMBR(self.dump_file)
-        gpt_part = None
-        for part_index, part in mbr_data:
-            if part['ptype'] == mbr.MBR_PARTTYPE_GPT:
-                gpt_part = part
-                break
-        if not gpt_part:
-            print('ARGH Master. I couldn\'t find a GPT volume in the dump' +
-                  ' you provided me. Please, try with another file.')
-            self.dump_filename = None
-            self.dump_file.close()
-            self.dump_file = None
-            return
-        gpt_data = gpt.readGPT(self.dump_file, gpt_part['start'])
-        parts = [ p for p in gpt_data['parts']
-                  if p['type'] == gpt.GUID_PART_TYPE_W_BASIC_DATA_PART
-                  and vol.is_refs_part(self.dump_file, p['first_lba']) ]
+        parts = []
+        if not args.discover:
+            parts = self._gpt_refs_parts()
+            if not parts:
+                print('Master I will look for ReFS volume records in the whole dump.' +
+                      ' This may take a while.')
+        if not parts:
+            parts = discovery.find_volumes(self.dump_file, jobs=args.jobs)
         if not parts:
             print('ARGH Master. I couldn\'t find a ReFS' +
                   ' partition in the dump file you provided.' +
-                  ' Please, try with another file.',
-                  gpt.GUID_TRANSLATION[gpt.GUID_PART_TYPE_W_BASIC_DATA_PART])
+                  ' Please, try with another file.')
             self.dump_filename = None
             self.dump_file.close()
             self.dump_file = None
@@ -294,9 +465,13 @@ You can also initialize the list of entryblocks of the partition.'''
                ' partitions and switch between them with the \'part\' command.').format(
                    len(parts), parts[0]['index']))
         for part in parts:
-            gpt.print_gpt_part(part)
+            self._print_part(part)
         self.parts = parts
         self.part = parts[0]
+        self.all_blocks = {}
+        self.use_index = not args.no_index
+        self._read_geometry()
+        self._load_index()
         self.prompt = '\n{} part {} - first lba: {} last lba: {}\n> '.format(
                 self.dump_filename,
                 self.part['index'],
@@ -308,9 +483,58 @@ You can also initialize the list of entryblocks of the partition.'''
                 f_args = '-f'
             if args.folders:
                 f_args = f_args + ' -F' if f_args != '' else '-F'
+            if args.metadata:
+                self.do_navigate(f_args)
+                return
+            f_args = f_args + ' -j {}'.format(args.jobs)
             self.do_find_entryblocks(f_args)
         return
 
+    def _gpt_refs_parts(self):
+        '''ReFS partitions of the GPT of the dump.'''
+        mbr_data = mbr.readMBR(self.dump_file) or []
+        gpt_part = None
+        for part_index, part in mbr_data:
+            if part['ptype'] == mbr.MBR_PARTTYPE_GPT:
+                gpt_part = part
+                break
+        if not gpt_part:
+            print('ARGH Master. I couldn\'t find a GPT volume in the dump' +
+                  ' you provided me.')
+            return []
+        gpt_data = gpt.readGPT(self.dump_file, gpt_part['start'])
+        parts = [ p for p in gpt_data.get('parts', [])
+                  if p['type'] == gpt.GUID_PART_TYPE_W_BASIC_DATA_PART
+                  and vol.is_refs_part(self.dump_file, p['first_lba']) ]
+        if not parts:
+            print('ARGH Master. I couldn\'t find a ReFS partition in the GPT of' +
+                  ' the dump you provided me.')
+        return parts
+
+    def _read_geometry(self):
+        self.geometry = vol.geometry(self.dump_file, self.part['first_lba'])
+        if self.geometry['block_size'] != vol.REFS_V1_BLOCK_SIZE:
+            print('Master this volume uses metadata blocks of {} (clusters of {}).'.format(
+                iostats.format_size(self.geometry['block_size']),
+                iostats.format_size(self.geometry['cluster_size'])))
+
+    def _load_index(self):
+        self.blocks = None
+        self.blocks_scope = allocation.SCAN_ALL
+        self.allocation = None
+        if self.part['index'] in self.all_blocks:
+            self.blocks = self.all_blocks[self.part['index']]
+            return
+        if not self.use_index:
+            return
+        self.blocks = block_index.load_index(self.dump_file, self.dump_filename,
+                                             self.part['first_lba'],
+                                             self.part['last_lba'],
+                                             self.geometry['block_size'])
+        if self.blocks is not None:
+            print('Master I loaded {} blocks from the index of the partition.'.format(
+                len(self.blocks)))
+
     def do_vol(self, arg):
         'Dump the volume record information from the current ReFS partition.'
         cargs = self._check_func_args('vol', arg)
@@ -320,7 +544,10 @@ You can also initialize the list of entryblocks of the partition.'''
         _vol = vol.fsstat(self.dump_file,
                           self.part['first_lba'],
                           self.part['last_lba'])
-        vol.dump_fsstat(_vol)
+        if self.out:
+            self._emit('volume', _vol)
+        else:
+            vol.dump_fsstat(_vol)
         return
 
     def do_part(self, arg):
@@ -334,7 +561,7 @@ You can also initialize the list of entryblocks of the partition.'''
             print('Master you have {} partition{} available, here they are.'.format(
                 len(self.parts), 's' if len(self.parts) > 1 else ''))
             for p in self.parts:
-                gpt.print_gpt_part(self.part)
+                self._print_part(p)
             return
         if args.partidx not in [ p['index'] for p in self.parts ]:
             print('Master I don\'t have the partition index {} you provided.'.format(
@@ -344,14 +571,27 @@ You can also initialize the list of entryblocks of the partition.'''
             print('Nothing done, as we are already using partition {}.'.format(
                 args.partidx))
             return
-        self.part = self.parts[args.partidx]
+        self.part = [ p for p in self.parts if p['index'] == args.partidx ][0]
         print('Switched to partition {}, enjoy Master.'.format(arg))
+        self._read_geometry()
+        self._load_index()
         self.prompt = '\n{} part {} - first lba: {} last lba: {}\n> '.format(
                 self.dump_filename,
                 self.part['index'],
                 self.part['first_lba'],
                 self.part['last_lba'])
-        gpt.print_gpt_part(self.part)
+        self._print_part(self.part)
+
+    def _emit(self, record_type, record):
+        self.out.write(record_type, record)
+
+    def _print_part(self, part):
+        if self.out:
+            self._emit('partition', part)
+        elif part.get('discovered'):
+            discovery.print_volume(part)
+        else:
+            gpt.print_gpt_part(part)
 
     def do_find_entryblocks(self, arg):
         '''Extract and show all the entryblocks used in the current partition.
@@ -367,20 +607,170 @@ found per entryblock.'''
             return
         offset = self.part['first_lba']
         end_offset = self.part['last_lba']
-        if self.blocks == None:
+        keys = []
+        if args.files:
+            keys.append('fnas')
+        if args.folders:
+            keys.append('folderids')
+        if args.all_partitions:
+            self._find_all_entryblocks(keys)
+            return
+        scope = args.scan
+        ranges = None
+        if self.blocks is None or self.blocks_scope != scope:
+            ranges = self._scan_ranges(scope)
+            if ranges is None:
+                scope = allocation.SCAN_ALL
+        indexed = self.blocks is not None and self.blocks_scope == allocation.SCAN_ALL
+        if self.blocks == None or self.blocks_scope != scope:
             print(('Looking for blocks between lba {} and lba {}.' +
                    ' This may take a while Master. A coffee?').format(
                        offset,
                        end_offset))
-            self.blocks = carving.find_blocks(self.dump_file, offset, end_offset)
+            if ranges is not None:
+                print('Master I will only look at the {} clusters ({}).'.format(
+                    scope, iostats.format_size(sum(y - x for x, y in ranges))))
+            # the attributes are looked for while finding the blocks
+            self.blocks = carving.find_blocks(self.dump_file, offset, end_offset,
+                                              self.geometry['block_size'],
+                                              jobs=args.jobs, keys=keys, ranges=ranges)
+            self.blocks_scope = scope
+            scan_keys = keys
+        else:
+            # hit lists loaded from the index or found before are not looked for again
+            scan_keys = [ k for k in keys if not self.blocks.has_hits(k) ]
+            if scan_keys:
+                carving.blocks_with_attributes(self.dump_file, self.blocks, scan_keys,
+                                               self.geometry['block_size'], jobs=args.jobs)
         print('Master I found {} blocks.'.format(len(self.blocks)))
+        found = {k: [ b for b in self.blocks if b[k] ] for k in keys}
+        # the index only keeps the blocks of the whole partition
+        if (self.use_index and self.blocks_scope == allocation.SCAN_ALL and
+                (scan_keys or not indexed)):
+            block_index.save_index(self.dump_file, self.dump_filename, self.blocks,
+                                   offset, end_offset, self.geometry['block_size'])
         if args.files:
-            blocks = carving.blocks_with_filename_attributes(self.dump_file, self.blocks)
-            print('Master I found {} blocks with the filename attribute.'.format(len(blocks)))
+            print('Master I found {} blocks with the filename attribute.'.format(len(found['fnas'])))
         if args.folders:
-            blocks = carving.blocks_with_folder_attributes(self.dump_file, self.blocks)
-            print('Master I found {} blocks with the filename folder attribute.'.format(len(blocks)))
-        carving.print_blocks(self.blocks)
+            print('Master I found {} blocks with the filename folder attribute.'.format(
+                len(found['folderids'])))
+        if self.out:
+            for block in self.blocks:
+                self._emit('block', block.to_dict())
+        else:
+            carving.print_blocks(self.blocks)
+
+    def _partition_tasks(self, scanned_only=False):
+        '''(partition, block size, blocks) of all the partitions for the
+util.partitions functions, with the blocks already found in them if any
+(only the ones found in the whole partition if scanned_only).'''
+        tasks = []
+        for p in self.parts:
+            block_size = vol.geometry(self.dump_file, p['first_lba'])['block_size']
+            blocks = None
+            if p['index'] == self.part['index']:
+                if not scanned_only or self.blocks_scope == allocation.SCAN_ALL:
+                    blocks = self.blocks
+            elif p['index'] in self.all_blocks:
+                blocks = self.all_blocks[p['index']]
+            elif self.use_index:
+                blocks = block_index.load_index(self.dump_file, self.dump_filename,
+                                                p['first_lba'], p['last_lba'], block_size)
+            tasks.append((p, block_size, blocks))
+        return tasks
+
+    def _find_all_entryblocks(self, keys):
+        print(('Looking for blocks in the {} partitions, each one in its own process.' +
+               ' This may take a while Master. A coffee?').format(len(self.parts)))
+        tasks = self._partition_tasks(scanned_only=True)
+        results = partitions.find_blocks(self.dump_file, tasks, keys)
+        for p, block_size, blocks in tasks:
+            found = results[p['index']]
+            self.all_blocks[p['index']] = found
+            if p['index'] == self.part['index']:
+                self.blocks = found
+                self.blocks_scope = allocation.SCAN_ALL
+            if self.use_index and (blocks is None or
+                                   any(not blocks.has_hits(k) for k in keys)):
+                block_index.save_index(self.dump_file, self.dump_filename, found,
+                                       p['first_lba'], p['last_lba'], block_size)
+            if self.out:
+                for block in found:
+                    record = block.to_dict()
+                    record['partition'] = p['index']
+                    self._emit('block', record)
+                continue
+            print('Master I found {} blocks in partition {}.'.format(len(found), p['index']))
+            if 'fnas' in keys:
+                print('Master I found {} blocks with the filename attribute.'.format(
+                    len([ b for b in found if b['fnas'] ])))
+            if 'folderids' in keys:
+                print('Master I found {} blocks with the filename folder attribute.'.format(
+                    len([ b for b in found if b['folderids'] ])))
+            carving.print_blocks(found)
+
+    def do_navigate(self, arg):
+        '''Find the entryblocks in use in the current partition from its metadata:
+the tree control leads to the object tree, which gives the entryblocks of every
+node. This is much faster than 'find_entryblocks' as the partition is not
+scanned, but the stale copies of the blocks are not found.'''
+        cargs = self._check_func_args('navigate', arg)
+        if cargs['return']:
+            return
+        args = cargs['args']
+        if not self.dump_file:
+            print('Master you have not defined a dump to analyze.')
+            print('Please provide a dump file.')
+            return
+        keys = []
+        if args.files:
+            keys.append('fnas')
+        if args.folders:
+            keys.append('folderids')
+        blocks = navigation.find_blocks(self.dump_file, self.part['first_lba'],
+                                        self.part['last_lba'], self.geometry['block_size'],
+                                        keys=keys)
+        if blocks is None:
+            print('Master I couldn\'t follow the tree control to the object tree.')
+            print('Please Master use \'find_entryblocks\' to scan the partition instead.')
+            return
+        self.blocks = blocks
+        self.blocks_scope = 'metadata'
+        nodes = len(set(self.blocks.columns['nodeid']))
+        found = {k: [ b for b in self.blocks if b[k] ] for k in keys}
+        if self.out:
+            record = {'blocks': len(self.blocks), 'nodes': nodes}
+            for k in keys:
+                record[k] = len(found[k])
+            self._emit('navigation', record)
+            return
+        print('Master I found {} blocks of {} nodes following the object tree.'.format(
+            len(self.blocks), nodes))
+        if args.files:
+            print('Master I found {} blocks with the filename attribute.'.format(len(found['fnas'])))
+        if args.folders:
+            print('Master I found {} blocks with the filename folder attribute.'.format(
+                len(found['folderids'])))
+
+    def _allocation_map(self):
+        if self.allocation is None:
+            self.allocation = allocation.read_allocation_map(self.dump_file,
+                                                             self.part['first_lba'],
+                                                             self.part['last_lba'],
+                                                             self.geometry['block_size'],
+                                                             self.geometry['cluster_size'])
+        return self.allocation
+
+    def _scan_ranges(self, mode):
+        '''Byte ranges of the current partition to scan in the given mode, None
+to scan all of it.'''
+        if mode == allocation.SCAN_ALL:
+            return None
+        amap = self._allocation_map()
+        if amap is None:
+            print('Master I couldn\'t find a consistent allocator in the partition, I will scan all of it.')
+            return None
+        return allocation.scan_ranges(amap, self.part['first_lba'], self.part['last_lba'], mode)
 
     def do_find_pattern(self, arg):
         '''Find a data pattern in all the blocks of the current partition.
@@ -390,20 +780,31 @@ the pattern, think of escaping them.'''
         if cargs['return']:
             return
         args = cargs['args']
-        _pattern = ast.literal_eval('"{}"'.format(args.pattern))
         offset = self.part['first_lba']
         end_offset = self.part['last_lba']
-        pattern = [ ord(x) for x in _pattern ]
-        print('Master I will be analyzing your pattern \'{}\' ({}) but it may take a while.'.format(
-            args.pattern, [ '{:#x}'.format(x) for x in pattern ]))
+        patterns = {}
+        for arg_pattern in args.pattern:
+            _pattern = ast.literal_eval('"{}"'.format(arg_pattern))
+            pattern = [ ord(x) for x in _pattern ]
+            print('Master I will be analyzing your pattern \'{}\' ({}) but it may take a while.'.format(
+                arg_pattern, [ '{:#x}'.format(x) for x in pattern ]))
+            patterns[arg_pattern] = pattern
+        ranges = self._scan_ranges(args.scan)
         print('Do you want a cup of tea?')
-        blocks = carving.find_data_blocks_with_pattern(self.dump_file, pattern, offset, end_offset)
+        blocks = carving.find_data_blocks_with_patterns(self.dump_file, patterns,
+                                                        offset, end_offset,
+                                                        self.geometry['block_size'],
+                                                        jobs=args.jobs, ranges=ranges)
         print('Master I found {} blocks with your wiseful pattern.'.format(len(blocks)))
         # print table of found blocks
-        columns = [ {'key': 'addr', 'header': 'Address', 'align': '<', 'format': '#x'},
+        columns = [ {'key': 'pattern', 'header': 'Pattern', 'align': '<'},
+                    {'key': 'addr', 'header': 'Address', 'align': '<', 'format': '#x'},
                     {'key': 'lba_offset', 'header': 'LBA offset', 'align': '<', 'format': '#x'},
                     {'key': 'block_offset', 'header': 'Block offset', 'align': '<', 'format': '#x'} ]
-        if blocks:
+        if self.out:
+            for block in blocks:
+                self._emit('pattern', block)
+        elif blocks:
             print_table(columns, blocks)
 
     def do_list_filenames(self, arg):
@@ -419,13 +820,24 @@ the pattern, think of escaping them.'''
         listed = 0
         for block in self.blocks:
             if block['fnas']:
+                # one read per block, the attributes are decoded from memory
+                block_data = image.read_block(self.dump_file, block['offset'],
+                                              self.geometry['block_size'])
                 for fid in block['fnas']:
-                    attr = rattr.read_attribute(self.dump_file, fid)
+                    attr = rattr.read_attribute(block_data, fid, ('filename',))
                     try:
                         filename = attr['filename'].decode('utf-16le')
                     except:
                         filename = attr['filename']
                     listed = listed + 1
+                    if self.out:
+                        self._emit('filename', {'offset': block['offset'],
+                                                'entryblock': block['entryblock'],
+                                                'nodeid': block['nodeid'],
+                                                'childid': block['childid'],
+                                                'attribute_offset': attr['_absolute_offset'],
+                                                'filename': filename})
+                        continue
                     print('{:#010x} {:#06x} {:#06x} {:#06x} {:#010x} {}'.format(
                         block['offset'], block['entryblock'],
                         block['nodeid'], block['childid'], attr['_absolute_offset'], filename))
@@ -446,13 +858,24 @@ the pattern, think of escaping them.'''
         listed = 0
         for block in self.blocks:
             if block['folderids']:
+                # one read per block, the attributes are decoded from memory
+                block_data = image.read_block(self.dump_file, block['offset'],
+                                              self.geometry['block_size'])
                 for fid in block['folderids']:
-                    attr = rattr.read_attribute(self.dump_file, fid)
+                    attr = rattr.read_attribute(block_data, fid, ('foldername',))
                     try:
                         foldername = attr['foldername'].decode('utf-16le')
                     except:
                         foldername = attr['foldername']
                     listed = listed + 1
+                    if self.out:
+                        self._emit('folder', {'offset': block['offset'],
+                                              'entryblock': block['entryblock'],
+                                              'nodeid': block['nodeid'],
+                                              'childid': block['childid'],
+                                              'attribute_offset': attr['_absolute_offset'],
+                                              'foldername': foldername})
+                        continue
                     print('{:#010x} {:#06x} {:#06x} {:#06x} {:#010x} {}'.format(
                         block['offset'], block['entryblock'],
                         block['nodeid'], block['childid'], attr['_absolute_offset'], foldername))
@@ -468,8 +891,10 @@ the pattern, think of escaping them.'''
         args = cargs['args']
         offset = args.dump_offset
         size = args.size
-        self.dump_file.seek(offset, 0)
-        data = self.dump_file.read(size)
+        data = self.dump_file.pread(offset, size)
+        if self.out:
+            self._emit('data', {'offset': offset, 'data': data})
+            return
         hexdump(data, offset)
 
     def do_hexblock(self, arg):
@@ -483,13 +908,15 @@ the pattern, think of escaping them.'''
             print('Master, first you need to look for the blocks.')
             print('Please Master use \'find_entryblocks\' first or use \'hexdump\'.')
             return
-        blks = [ b for b in self.blocks if b['entryblock'] == ebid ]
+        blks = self.blocks.with_entryblock(ebid)
         if not blks:
             print('Master, are you sure such an entryblock exist?')
             return
         blk = blks[0]
-        self.dump_file.seek(blk['offset'], 0)
-        data = self.dump_file.read(16 * 1024)
+        data = self.dump_file.pread(blk['offset'], self.geometry['block_size'])
+        if self.out:
+            self._emit('data', {'offset': blk['offset'], 'data': data})
+            return
         hexdump(data, blk['offset'])
 
     def do_entryblock(self, arg):
@@ -503,12 +930,15 @@ the pattern, think of escaping them.'''
             print('Master, first you need to look for the blocks.')
             print('Please Master use \'find_entryblocks\' first.')
             return
-        blocks = [ b for b in self.blocks if b['entryblock'] == ebid ]
+        blocks = self.blocks.with_entryblock(ebid)
         if len(blocks) != 1:
             print('Master, I couldn\'t find the block you asked for.')
             return
         block = blocks[0]
-        eb = reb.read_entryblock(self.dump_file, block['offset'])
+        eb = reb.read_entryblock(self.dump_file, block['offset'], self.geometry['block_size'])
+        if self.out:
+            self._emit('entryblock', eb)
+            return
         reb.dump_entryblock(eb)
 
     def do_tree_control(self, arg):
@@ -524,12 +954,15 @@ identifier.'''
             print('Master, first you need to look for the blocks.')
             print('Please Master use \'find_entryblocks\' first.')
             return
-        blocks = [ b for b in self.blocks if b['entryblock'] == ebid ]
+        blocks = self.blocks.with_entryblock(ebid)
         if len(blocks) != 1:
             print('Master, I couldn\'t find the block you asked for.')
             return
         block = blocks[0]
-        tc = rtc.read_tree_control(self.dump_file, block['offset'])
+        tc = rtc.read_tree_control(self.dump_file, block['offset'], self.geometry['block_size'])
+        if self.out:
+            self._emit('tree_control', tc)
+            return
         rtc.dump_tree_control(tc)
 
     def do_tree_control_extension(self, arg):
@@ -543,12 +976,15 @@ identifier.'''
             print('Master, first you need to look for the blocks.')
             print('Please Master use \'find_entryblocks\' first.')
             return
-        blocks = [ b for b in self.blocks if b['entryblock'] == ebid ]
+        blocks = self.blocks.with_entryblock(ebid)
         if len(blocks) != 1:
             print('Master, I couldn\'t find the block you asked for.')
             return
         block = blocks[0]
-        tce = rtc.read_tree_control_ext(self.dump_file, block['offset'])
+        tce = rtc.read_tree_control_ext(self.dump_file, block['offset'], self.geometry['block_size'])
+        if self.out:
+            self._emit('tree_control_extension', tce)
+            return
         rtc.dump_tree_control_ext(tce)
 
     def do_object_tree(self, arg):
@@ -562,12 +998,15 @@ identifier.'''
             print('Master, first you need to look for the blocks.')
             print('Please Master use \'find_entryblocks\' first.')
             return
-        blocks = [ b for b in self.blocks if b['entryblock'] == ebid ]
+        blocks = self.blocks.with_entryblock(ebid)
         if len(blocks) != 1:
             print('Master, I couldn\'t find the block you asked for.')
             return
         block = blocks[0]
-        ot = rot.read_object_tree(self.dump_file, block['offset'])
+        ot = rot.read_object_tree(self.dump_file, block['offset'], self.geometry['block_size'])
+        if self.out:
+            self._emit('object_tree', ot)
+            return
         rot.dump_object_tree(ot)
 
     def do_allocator(self, arg):
@@ -581,14 +1020,62 @@ identifier.'''
             print('Master, first you need to look for the blocks.')
             print('Please Master use \'find_entryblocks\' first.')
             return
-        blocks = [ b for b in self.blocks if b['entryblock'] == ebid ]
+        blocks = self.blocks.with_entryblock(ebid)
         if len(blocks) != 1:
             print('Master, I couldn\'t find the block you asked for.')
             return
         block = blocks[0]
-        al = ralloc.read_allocator(self.dump_file, block['offset'])
+        al = ralloc.read_allocator(self.dump_file, block['offset'], self.geometry['block_size'])
+        if self.out:
+            self._emit('allocator', al)
+            return
         ralloc.dump_allocator(al)
 
+    def do_allocation(self, arg):
+        '''Decode the allocator of the current partition into its allocation map,
+and show its allocated and free clusters.
+The 'find_entryblocks' and 'find_pattern' commands use it to only scan the
+allocated or unallocated clusters.
+Experimental: the layout of the allocator records is a heuristic, the map is
+only used if all its records are consistent.'''
+        cargs = self._check_func_args('allocation', arg)
+        if cargs['return']:
+            return
+        args = cargs['args']
+        if not self.dump_file:
+            print('Master you have not defined a dump to analyze.')
+            print('Please provide a dump file.')
+            return
+        amap = self._allocation_map()
+        if amap is None:
+            print('Master I couldn\'t find a consistent allocator in the partition.')
+            return
+        allocated = allocation.allocated_clusters(amap)
+        free = amap['clusters'] - allocated
+        runs = []
+        if args.list:
+            runs = [ {'first_cluster': first, 'clusters': count,
+                      'state': 'allocated' if state else 'free'}
+                     for first, count, state in allocation.cluster_runs(amap) ]
+        if self.out:
+            self._emit('allocation', {'cluster_size': amap['cluster_size'],
+                                      'clusters': amap['clusters'],
+                                      'records': amap['records'],
+                                      'allocated': allocated,
+                                      'free': free})
+            for run in runs:
+                self._emit('allocation_run', run)
+            return
+        print('Master the allocator describes {} clusters of {} in {} records.'.format(
+            amap['clusters'], iostats.format_size(amap['cluster_size']), amap['records']))
+        print('{} clusters are allocated and {} are free ({:.1%} of the partition).'.format(
+            allocated, free, free / amap['clusters'] if amap['clusters'] else 0))
+        if runs:
+            columns = [ {'key': 'first_cluster', 'header': 'First cluster', 'align': '<', 'format': '#x'},
+                        {'key': 'clusters', 'header': 'Clusters', 'align': '>'},
+                        {'key': 'state', 'header': 'State', 'align': '<'} ]
+            print_table(columns, runs)
+
     def do_attribute(self, arg):
         'Parse the given dump offset (in bytes) as an Attribute.'
         cargs = self._check_func_args('attribute', arg)
@@ -597,6 +1084,9 @@ identifier.'''
         args = cargs['args']
         offset = args.dump_offset
         attr = rattr.read_attribute(self.dump_file, offset)
+        if self.out:
+            self._emit('attribute', attr)
+            return
         rattr.dump_attribute(attr)
 
     def do_datastream(self, arg):
@@ -612,13 +1102,12 @@ or using the `list_dataruns` command.'''
         dataruns = args.dataruns
         of = open(ofn, 'wb')
         for offset, length in dataruns:
-            offset = (offset * 1024 * 16) + (self.part['first_lba'] * 512)
-            length = length * 1024 * 16
+            offset = (offset * self.geometry['block_size']) + (self.part['first_lba'] * 512)
+            length = length * self.geometry['block_size']
             if length > size:
                 length = size
             size = size - length
-            self.dump_file.seek(offset, 0)
-            data = self.dump_file.read(length)
+            data = self.dump_file.pread(offset, length)
             of.write(data)
         of.close()
 
@@ -627,39 +1116,46 @@ or using the `list_dataruns` command.'''
         cargs = self._check_func_args('list_dataruns', arg)
         if cargs['return']:
             return
-        files = 0
-        drs = 0
-        for block in self.blocks:
-            if block['fnas']:
-                for fid in block['fnas']:
-                    files = files + 1
-                    attr = rattr.read_attribute(self.dump_file, fid)
-                    dataruns = []
-                    if attr['datarun'] and attr['datarun']['pointers_data']:
-                        for ptr in attr['datarun']['pointers_data']:
-                            if ptr['pointers_data']:
-                                datarun = [ (x['blockid'], x['num_blocks'])
-                                            for x in ptr['pointers_data'] ]
-                                dataruns.append((ptr['logical_size'], datarun))
-                                drs = drs + 1
-                    try:
-                        filename = attr['filename'].decode('utf-16le')
-                    except:
-                        filename = attr['filename']
-                    print('{:#010x} {:#06x} {:#06x} {:6} {}'.format(
-                        block['offset'], block['entryblock'],
-                        block['nodeid'], block['counter'], filename))
-                    for length, datarun in dataruns:
-                        print('  size: {:#x} datarun: '.format(length), end='')
-                        for run in datarun:
-                            blockid,num = run
-                            print(' {:#x},{}'.format(blockid,num), end='')
-                        print('')
+        args = cargs['args']
+        if args.all_partitions:
+            results = partitions.dataruns(self.dump_file, self._partition_tasks())
+            for index in sorted(results):
+                if not self.out:
+                    print('Partition {}:'.format(index))
+                files, drs = self._print_dataruns(results[index], index)
+                if not self.out:
+                    print('Master I listed {} data runs from {} files in partition {}.'.format(
+                        drs, files, index))
+            return
+        files, drs = self._print_dataruns(
+                file_dataruns(self.dump_file, self.blocks or (), self.geometry['block_size']))
         if files:
             print('Master I listed {} data runs from {} files.'.format(drs, files))
         else:
             print('Master I could not find any file, did you already execute \'find_entryblocks -f\'?')
 
+    def _print_dataruns(self, records, partition=None):
+        files = 0
+        drs = 0
+        for record in records:
+            files = files + 1
+            drs = drs + len(record['dataruns'])
+            if self.out:
+                if partition is not None:
+                    record['partition'] = partition
+                self._emit('dataruns', record)
+                continue
+            print('{:#010x} {:#06x} {:#06x} {:6} {}'.format(
+                record['offset'], record['entryblock'],
+                record['nodeid'], record['counter'], record['filename']))
+            for datarun in record['dataruns']:
+                print('  size: {:#x} datarun: '.format(datarun['size']), end='')
+                for run in datarun['runs']:
+                    blockid,num = run
+                    print(' {:#x},{}'.format(blockid,num), end='')
+                print('')
+        return files, drs
+
     def do_filetree(self, arg):
         'Extract the file tree structure from the given node (use node 0x600 by default).'
         cargs = self._check_func_args('filetree', arg)
@@ -667,13 +1163,243 @@ or using the `list_dataruns` command.'''
             return
         args = cargs['args']
         nodeid = args.node_id
+        if args.all_partitions:
+            trees = partitions.filetrees(self.dump_file, self._partition_tasks(), nodeid)
+            for index in sorted(trees):
+                if self.out:
+                    self._emit_filetree(trees[index], index)
+                else:
+                    print('Partition {}:'.format(index))
+                    dump_filetree_entries(trees[index])
+            return
+        block_list = None
+        if self.blocks:
+            block_list = self.blocks
+        offset = self.part['first_lba']
+        end_offset = self.part['last_lba']
+        tree = open_filetree(self.dump_file, offset, end_offset, nodeid, block_list,
+                             self.geometry['block_size'])
+        if self.out:
+            self._emit_filetree(iter_filetree(tree))
+        else:
+            dump_filetree(tree)
+
+    def _emit_filetree(self, entries, partition=None):
+        # one record per directory and per file, with their path from the
+        # first directory (and the partition index in the all partitions mode)
+        path = []
+        tag = {} if partition is None else {'partition': partition}
+        for level, name, node in entries:
+            del path[level:]
+            path.append('' if level == 0 else name)
+            if not node:
+                continue
+            directory = '/'.join(path) or '/'
+            self._emit('directory', dict({'path': directory,
+                                          'name': _decode_name(node['name']),
+                                          'nodeid': node['nodeid']}, **tag))
+            for f in node['files']:
+                self._emit('file', dict({'path': '/'.join(path + [_decode_name(f['name'])]),
+                                         'blockid': f['blockid']}, **tag))
+
+    def do_resolve(self, arg):
+        'Find the file or folder at the given path, only reading the folders on the path.'
+        cargs = self._check_func_args('resolve', arg)
+        if cargs['return']:
+            return
+        args = cargs['args']
         block_list = None
         if self.blocks:
             block_list = self.blocks
         offset = self.part['first_lba']
         end_offset = self.part['last_lba']
-        tree = filetree(self.dump_file, offset, end_offset, nodeid, block_list)
-        dump_filetree(tree)
+        tree = open_filetree(self.dump_file, offset, end_offset, args.node_id, block_list,
+                             self.geometry['block_size'])
+        found = resolve(tree, args.path)
+        if self.out:
+            if found is None:
+                self._emit('not_found', {'path': args.path})
+            elif 'files' in found:
+                self._emit('directory', {'path': args.path,
+                                         'name': _decode_name(found['name']),
+                                         'nodeid': found['nodeid'],
+                                         'folders': [ {'name': _decode_name(f['name']),
+                                                       'nodeid': f['nodeid']}
+                                                      for f in found['folders'] ],
+                                         'files': [ {'name': _decode_name(f['name']),
+                                                     'blockid': f['blockid']}
+                                                    for f in found['files'] ]})
+            else:
+                self._emit('file', {'path': args.path, 'blockid': found['blockid']})
+            return
+        if found is None:
+            print('Master, I couldn\'t find `{}`.'.format(args.path))
+        elif 'files' in found:
+            print('D {} ({}) {:#x}'.format(args.path,
+                found['name'].decode('utf-16le') if found['name'] else '<unknown>',
+                found['nodeid']))
+            for f in found['folders']:
+                print('D . {} {:#x}'.format(f['name'].decode('utf-16le'), f['nodeid']))
+            for f in found['files']:
+                print('F . {} {:#x}'.format(
+                    f['name'].decode('utf-16le') if f['name'] else '<unknown>',
+                    f['blockid']))
+        else:
+            print('F {} {:#x}'.format(args.path, found['blockid']))
+
+    def do_cache(self, arg):
+        '''Show the statistics of the blocks cache ('cache'), resize it
+('cache -s <MiB>'), change its readahead ('cache -r <blocks>') or flush it
+('cache -f').'''
+        cargs = self._check_func_args('cache', arg)
+        if cargs['return']:
+            return
+        args = cargs['args']
+        if args.size is not None:
+            self.cache_capacity = max(0, args.size) * 1024 * 1024
+        if args.readahead is not None:
+            self.cache_readahead = max(0, args.readahead)
+        if not self.dump_file:
+            print('Master, the cache will be used with the next dump you load.')
+            return
+        if self.cache_capacity is not None:
+            self.dump_file.resize(self.cache_capacity)
+        self.dump_file.readahead = self.cache_readahead
+        if args.flush:
+            self.dump_file.flush()
+            self.dump_file.reset_stats()
+            print('Master, the cache has been flushed.')
+        stats = self.dump_file.stats()
+        if self.out:
+            self._emit('cache', stats)
+            return
+        accesses = stats['hits'] + stats['misses']
+        print('Capacity: {} MiB ({} blocks of {} bytes)'.format(
+            stats['capacity'] // (1024 * 1024),
+            stats['capacity'] // stats['block_size'],
+            stats['block_size']))
+        print('Cached blocks: {}'.format(stats['blocks']))
+        print('Readahead: {} blocks'.format(stats['readahead']))
+        print('Hits: {} ({:.1%})'.format(stats['hits'],
+                                         stats['hits'] / accesses if accesses else 0))
+        print('Misses: {}'.format(stats['misses']))
+        print('Evictions: {}'.format(stats['evictions']))
+        print('Blocks read ahead: {}'.format(stats['readahead_blocks']))
+        print('Reads bypassing the cache: {}'.format(stats['bypassed']))
+
+    def do_iostats(self, arg):
+        '''Show the reads done on the dump by the last command and by each
+command ('iostats'), print a summary after each command ('iostats -a on') or
+reset the counters ('iostats -r').'''
+        cargs = self._check_func_args('iostats', arg)
+        if cargs['return']:
+            return
+        args = cargs['args']
+        if args.auto is not None:
+            self.io_summary = args.auto == 'on'
+            print('Master, I will {}tell you about the reads after each command.'.format(
+                '' if self.io_summary else 'no longer '))
+            return
+        if args.reset:
+            self.io_last = None
+            self.io_commands = None
+            print('Master, the I/O counters have been reset.')
+            return
+        if not self.io_commands:
+            print('Master, no command read the dump yet.')
+            return
+        line, stats = self.io_last
+        if self.out:
+            self._emit('iostats', dict(stats, command=line))
+            for command, stats in sorted(self.io_commands.items()):
+                self._emit('iostats_command', dict(stats, command=command))
+            return
+        print('Last command: {}'.format(line))
+        print(iostats.summary(stats))
+        rows = [ {'size': size, 'reads': n} for size, n in iostats.histogram_rows(stats) ]
+        if rows:
+            print_table([ {'key': 'size', 'header': 'Read size', 'align': '<'},
+                          {'key': 'reads', 'header': 'Reads', 'align': '>'} ], rows)
+        print('')
+        columns = [ {'key': 'command', 'header': 'Command', 'align': '<'},
+                    {'key': 'calls', 'header': 'Calls', 'align': '>'},
+                    {'key': 'reads', 'header': 'Reads', 'align': '>'},
+                    {'key': 'seeks', 'header': 'Seeks', 'align': '>'},
+                    {'key': 'bytes', 'header': 'Bytes read', 'align': '>',
+                     'transform': iostats.format_size},
+                    {'key': 'time', 'header': 'I/O time (s)', 'align': '>', 'format': '.3f'} ]
+        print_table(columns, [ dict(stats, command=command)
+                               for command, stats in sorted(self.io_commands.items()) ])
+
+    def _account_command(self, line):
+        io, before = self._io_before
+        if self.io is None:
+            return
+        if io is not self.io:
+            # the command loaded a new dump
+            before = iostats.empty_stats()
+        stats = iostats.diff(self.io.stats(), before)
+        command = line.split()[0]
+        if self.io_commands is None:
+            self.io_commands = {}
+        if command not in self.io_commands:
+            self.io_commands[command] = dict(iostats.empty_stats(), calls=0)
+        total = iostats.add(self.io_commands[command], stats)
+        total['calls'] = total['calls'] + 1
+        self.io_last = (line, stats)
+        if self.io_summary:
+            print('I/O: {}'.format(iostats.summary(stats)))
+
+    def do_profile(self, arg):
+        '''Run the provided command under cProfile and show the time spent in
+each module and the functions with the biggest cumulative time.'''
+        cargs = self._check_func_args('profile', arg)
+        if cargs['return']:
+            return
+        args = cargs['args']
+        if not args.command:
+            print('Master, which command do you want me to profile?')
+            return
+        if args.command[0] == 'profile':
+            print('Master, I cannot profile myself while profiling.')
+            return
+        line = ' '.join(args.command)
+        stop, stats = profiling.profile_call(self.onecmd, line)
+        if self.out:
+            self._emit('profile', {'command': line, 'time': stats.total_tt})
+            for module in profiling.modules(stats):
+                self._emit('profile_module', module)
+            for function in profiling.top_functions(stats, args.limit):
+                self._emit('profile_function', function)
+        else:
+            print('')
+            print('Master, `{}` took {:.3f}s.'.format(line, stats.total_tt))
+            print('Time per module:')
+            print_table([ {'key': 'module', 'header': 'Module', 'align': '<'},
+                          {'key': 'calls', 'header': 'Calls', 'align': '>'},
+                          {'key': 'tottime', 'header': 'Time (s)', 'align': '>', 'format': '.3f'},
+                          {'key': 'percent', 'header': '%', 'align': '>', 'format': '.1%'} ],
+                        profiling.modules(stats))
+            print('Top functions by cumulative time:')
+            print_table([ {'key': 'cumtime', 'header': 'Cumulative (s)', 'align': '>', 'format': '.3f'},
+                          {'key': 'tottime', 'header': 'Own (s)', 'align': '>', 'format': '.3f'},
+                          {'key': 'calls', 'header': 'Calls', 'align': '>'},
+                          {'key': 'module', 'header': 'Module', 'align': '<'},
+                          {'key': 'function', 'header': 'Function', 'align': '<'} ],
+                        profiling.top_functions(stats, args.limit))
+        if args.output:
+            try:
+                stats.dump_stats(args.output)
+                print('Master, the profile was saved to `{}`.'.format(args.output))
+            except OSError:
+                print('Master I couldn\'t save the profile to `{}`.'.format(args.output))
+        if args.collapsed:
+            try:
+                profiling.write_collapsed(stats, args.collapsed)
+                print('Master, the collapsed stacks were saved to `{}`.'.format(args.collapsed))
+            except OSError:
+                print('Master I couldn\'t save the collapsed stacks to `{}`.'.format(args.collapsed))
+        return stop
 
     def do_bye(self, arg):
         'Exit the program. Are you sure?'
@@ -721,8 +1447,37 @@ Saved file can be used afterwards for replay with the \'playback\' command.'''
     def precmd(self, line):
         if self.rec_file and 'playback' not in line:
             print(line, file=self.rec_file)
+        self._io_before = (self.io, self.io.stats() if self.io else None)
+        if self.out and line.split():
+            self._emit('command', {'command': line.strip()})
         return line
 
+    def postcmd(self, stop, line):
+        if not stop and line.split() and line.split()[0] != 'iostats':
+            self._account_command(line.strip())
+        if self.out:
+            self.out.flush()
+        return stop
+
+    def run_batch(self, input_file):
+        '''Execute the commands of the input file ('-' for the standard input)
+without prompting, blank lines are skipped.'''
+        if input_file == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(input_file) as f:
+                lines = f.read().splitlines()
+        self.cmdqueue.extend(lines)
+        stop = None
+        while self.cmdqueue and not stop:
+            line = self.cmdqueue.pop(0)
+            if not line.strip():
+                continue
+            line = self.precmd(line)
+            stop = self.onecmd(line)
+            stop = self.postcmd(stop, line)
+        self.close()
+
     def close(self):
         if self.rec_file:
             self.rec_file.close()
@@ -732,9 +1487,25 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='ReFS carving on provided dump.')
     parser.add_argument('-d', '--dump', action='store', required=False, type=str,
                         help='ReFS dump to analyze')
+    parser.add_argument('-b', '--batch', action='store', required=False, type=str,
+                        help='execute the commands of the given file (\'-\' for the ' +
+                             'standard input) and exit')
+    parser.add_argument('-f', '--format', action='store', choices=['text', 'jsonl'],
+                        default='text',
+                        help='output of the commands in batch mode, jsonl writes one ' +
+                             'JSON record per line on the standard output and the ' +
+                             'messages on the standard error (default: text)')
     args = parser.parse_args()
 
-    if args.dump:
+    if args.batch:
+        rshell = PyReFSShell()
+        if args.format == 'jsonl':
+            rshell.out = JsonlWriter(sys.stdout)
+            sys.stdout = sys.stderr
+        if args.dump:
+            rshell.onecmd('file ' + args.dump)
+        rshell.run_batch(args.batch)
+    elif args.dump:
         rshell = PyReFSShell()
         rshell.onecmd('file ' + args.dump)
         rshell.cmdloop()
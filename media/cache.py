@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+from media.image import DumpImage
+
+CACHE_BLOCK_SIZE = 16 * 1024
+# default capacity, in bytes
+CACHE_CAPACITY = 64 * 1024 * 1024
+# reads bigger than this (e.g. partition scans) bypass the cache instead of
+# flushing it
+CACHE_BYPASS_SIZE = 1024 * 1024
+# backends whose reads are already served from the page cache without any
+# copy, the cache is disabled by default for them
+UNCACHED_BACKENDS = ('mmap',)
+
+def default_capacity(dump):
+    """Capacity of the cache of dump when none is requested."""
+    return 0 if dump.backend in UNCACHED_BACKENDS else CACHE_CAPACITY
+
+class CachedImage(DumpImage):
+    """LRU cache of the blocks of a dump.
+
+    capacity is given in bytes and rounded down to a number of blocks, on a
+    miss readahead more blocks following the missing ones are read (in the
+    same read) and cached. The cached blocks are memoryview slices of the
+    reads, which are returned without being copied."""
+
+    def __init__(self, dump, capacity=CACHE_CAPACITY, readahead=0,
+                 block_size=CACHE_BLOCK_SIZE):
+        DumpImage.__init__(self)
+        self.dump = dump
+        self.path = dump.path
+        self.backend = dump.backend
+        self.reopenable = dump.reopenable
+        self.block_size = block_size
+        self.readahead = readahead
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self.resize(capacity)
+        self.reset_stats()
+
+    @property
+    def size(self):
+        return self.dump.size
+
+    @property
+    def capacity(self):
+        return self._capacity * self.block_size
+
+    def resize(self, capacity):
+        with self._lock:
+            self._capacity = max(0, capacity // self.block_size)
+            self._evict()
+
+    def flush(self):
+        with self._lock:
+            self._blocks.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.readahead_blocks = 0
+        self.bypassed = 0
+
+    def stats(self):
+        return {'capacity': self.capacity,
+                'block_size': self.block_size,
+                'blocks': len(self._blocks),
+                'readahead': self.readahead,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'readahead_blocks': self.readahead_blocks,
+                'bypassed': self.bypassed}
+
+    def _evict(self):
+        while len(self._blocks) > self._capacity:
+            self._blocks.popitem(last=False)
+            self.evictions = self.evictions + 1
+
+    def _load(self, first, last):
+        """Read blocks first to last (included) and the readahead ones."""
+        end = last + 1 + self.readahead
+        data = memoryview(self.dump.pread(first * self.block_size,
+                                          (end - first) * self.block_size))
+        for n in range(first, end):
+            if n in self._blocks:
+                continue
+            pos = (n - first) * self.block_size
+            block = data[pos:pos + self.block_size]
+            if not len(block):
+                break
+            self._blocks[n] = block
+            if n > last:
+                self.readahead_blocks = self.readahead_blocks + 1
+        return data
+
+    def _block(self, n):
+        block = self._blocks.get(n)
+        if block is not None:
+            self.hits = self.hits + 1
+            self._blocks.move_to_end(n)
+        return block
+
+    def pread(self, offset, size):
+        if size > CACHE_BYPASS_SIZE or not self._capacity or offset < 0:
+            self.bypassed = self.bypassed + 1
+            return self.dump.pread(offset, size)
+        first = offset // self.block_size
+        last = (offset + max(size, 1) - 1) // self.block_size
+        with self._lock:
+            blocks = []
+            n = first
+            while n <= last:
+                block = self._block(n)
+                if block is None:
+                    # read all the consecutive missing blocks at once
+                    m = n
+                    while m < last and (m + 1) not in self._blocks:
+                        m = m + 1
+                    self.misses = self.misses + m - n + 1
+                    data = self._load(n, m)
+                    blocks.append(data[:(m - n + 1) * self.block_size])
+                    n = m + 1
+                else:
+                    blocks.append(block)
+                    n = n + 1
+            self._evict()
+        start = offset - first * self.block_size
+        if len(blocks) == 1:
+            return blocks[0][start:start + size]
+        return b''.join(blocks)[start:start + size]
+
+    def close(self):
+        self.flush()
+        self.dump.close()
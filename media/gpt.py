@@ -1,5 +1,7 @@
 from struct import unpack, Struct
 from binascii import hexlify
+from media.image import pread
+from util.schema import Schema, field, skip
 
 SECTOR_SIZE = 512
 GPT_HEADER_OFFSET = 0
@@ -14,9 +16,6 @@ GPT_HEADER_SIGNATURE = b'EFI PART'
 20 L
 24 header LBA, Q
 '''
-GPT_HEADER_FORMAT = Struct('<8sLLLLQQQQ16sQLLL')
-GPT_PART_FORMAT = Struct('<16s16sQQQ72s')
-
 GUID_LE_FORMAT = Struct('<LHH')
 GUID_BG_FORMAT = Struct('>HHL')
 GUID_UNUSED_PART_STRING = '00000000-0000-0000-0000-000000000000'
@@ -35,53 +34,50 @@ def guid_string(guid):
             _guid_bg[0], _guid_bg[1], _guid_bg[2])
     return res
 
-def _gpt_init(header):
-    gpt = {'signature': header[0],
-           'revision': header[1],
-           'header_size': header[2],
-           'header_crc': header[3],
-           'cur_lba': header[5],
-           'bkp_lba': header[6],
-           'first_lba': header[7],
-           'last_lba': header[8],
-           'disk_guid': guid_string(header[9]),
-           'part_lba': header[10],
-           'npart': header[11],
-           'part_size': header[12],
-           'part_crc': header[13]
-           }
-    return gpt
+def _part_type(guid):
+    return '{} ({})'.format(GUID_TRANSLATION[guid], guid)
+
+GPT_HEADER = Schema('GPT header', [
+    field('signature', '8s', 'Signature', lambda x: x.decode('utf-8')),
+    field('revision', 'L', 'Revision'),
+    field('header_size', 'L', 'Header size'),
+    field('header_crc', 'L', 'Header CRC'),
+    skip('L'),
+    field('cur_lba', 'Q', 'Current LBA'),
+    field('bkp_lba', 'Q', 'Backup LBA'),
+    field('first_lba', 'Q', 'First LBA'),
+    field('last_lba', 'Q', 'Last LBA'),
+    field('disk_guid', '16s', 'Disk GUID', convert=guid_string),
+    field('part_lba', 'Q', 'Partitions LBA'),
+    field('npart', 'L', 'Number of partitions'),
+    field('part_size', 'L', 'Partition size'),
+    field('part_crc', 'L', 'Partition CRC')])
+GPT_PART = Schema('GPT partition entry', [
+    field('type', '16s', 'Type (GUID type)', _part_type, guid_string),
+    field('guid', '16s', 'GUID', convert=guid_string),
+    field('first_lba', 'Q', 'First LBA'),
+    field('last_lba', 'Q', 'Last LBA'),
+    field('attr', 'Q', 'Attributes'),
+    field('name', '72s', 'Name', convert=lambda x: x.decode('utf-16le'))])
+GPT_HEADER_FORMAT = GPT_HEADER.struct
+GPT_PART_FORMAT = GPT_PART.struct
 
 def _gpt_add_partitions(gpt, part_list):
     gpt['parts'] = part_list
 
-def _gpt_part_init(entry, index):
-    part = {'index': index,
-            'type': guid_string(entry[0]),
-            'guid': guid_string(entry[1]),
-            'first_lba': entry[2],
-            'last_lba': entry[3],
-            'attr': entry[4],
-            'name': entry[5].decode('utf-16le')}
-    return part
-
 def _read_gpt_partitions(stream, part_lba, num_part, part_size):
     parts = []
     for pi in range(num_part):
         part_offset = (part_lba * SECTOR_SIZE) + (pi * part_size)
-        stream.seek(part_offset, 0)
-        part_block = stream.read(part_size)
-        part = GPT_PART_FORMAT.unpack_from(part_block, 0)
-        part = _gpt_part_init(part, pi)
+        part_block = pread(stream, part_offset, part_size)
+        part = GPT_PART.decode(part_block, 0, {'index': pi})
         if part['type'] != GUID_UNUSED_PART_STRING:
             parts.append(part)
     return parts
 
 def readGPT(stream, offset=1):
-    stream.seek(offset * SECTOR_SIZE, 0)
-    _header = stream.read(GPT_HEADER_SIZE)
-    header = GPT_HEADER_FORMAT.unpack_from(_header, GPT_HEADER_OFFSET)
-    gpt = _gpt_init(header)
+    _header = pread(stream, offset * SECTOR_SIZE, GPT_HEADER_SIZE)
+    gpt = GPT_HEADER.decode(_header, GPT_HEADER_OFFSET)
     if gpt['signature'] != GPT_HEADER_SIGNATURE:
         print('no gpt header magic found')
         return {}
@@ -92,29 +88,11 @@ def readGPT(stream, offset=1):
 
 def print_gpt_part(part, prefix=''):
     print('{}Partition {}:'.format(prefix, part['index']))
-    print('{}  Type (GUID type): {} ({})'.format(prefix,
-                                                 GUID_TRANSLATION[part['type']], part['type']))
-    print('{}  GUID: {}'.format(prefix, part['guid']))
-    print('{}  First LBA: {}'.format(prefix, part['first_lba']))
-    print('{}  Last LBA: {}'.format(prefix, part['last_lba']))
-    print('{}  Attributes: {}'.format(prefix, part['attr']))
-    print('{}  Name: {}'.format(prefix, part['name']))
+    GPT_PART.dump(part, prefix + '  ')
 
 def print_gpt(gpt):
     print('GPT media')
-    print('Signature: {}'.format(gpt['signature'].decode('utf-8')))
-    print('Revision: {}'.format(gpt['revision']))
-    print('Header size: {}'.format(gpt['header_size']))
-    print('Header CRC: {}'.format(gpt['header_crc']))
-    print('Current LBA: {}'.format(gpt['cur_lba']))
-    print('Backup LBA: {}'.format(gpt['bkp_lba']))
-    print('First LBA: {}'.format(gpt['first_lba']))
-    print('Last LBA: {}'.format(gpt['last_lba']))
-    print('Disk GUID: {}'.format(gpt['disk_guid']))
-    print('Partitions LBA: {}'.format(gpt['part_lba']))
-    print('Number of partitions: {}'.format(gpt['npart']))
-    print('Partition size: {}'.format(gpt['part_size']))
-    print('Partition CRC: {}'.format(gpt['part_crc']))
+    GPT_HEADER.dump(gpt)
     print('Partition list:')
     for part in gpt['parts']:
         print_gpt_part(part, '  ')
@@ -0,0 +1,365 @@
+import ctypes
+import ctypes.util
+import os
+import threading
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from struct import Struct, error as StructError
+from media.image import DumpImage, PreadImage
+from util.sidecar import CACHE_DIR, sidecar_paths, load_sidecar, save_sidecar
+
+GZIP_MAGIC = b'\x1f\x8b'
+# uncompressed bytes between two seek points, and number of decompressed spans
+# kept in memory
+GZIP_SPAN = 1024 * 1024
+GZIP_CACHE_SPANS = 8
+GZIP_CHUNK_SIZE = 64 * 1024
+WINDOW_SIZE = 32 * 1024
+
+INDEX_MAGIC = b'PYREFSGZ'
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.pyrefs-gzindex'
+INDEX_CACHE_DIR = CACHE_DIR
+# magic, version, compressed size, compressed mtime (ns), uncompressed size,
+# span, number of points
+INDEX_HEADER_FORMAT = Struct('<8sHQQQQL')
+# compressed offset, uncompressed offset, bits, length of the (compressed)
+# window or NO_WINDOW for the start of a gzip member
+INDEX_POINT_FORMAT = Struct('<QQBL')
+NO_WINDOW = 0xffffffff
+
+Z_OK = 0
+Z_STREAM_END = 1
+Z_BUF_ERROR = -5
+Z_BLOCK = 5
+
+class GzipIndexError(Exception): pass
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [('next_in', ctypes.c_void_p),
+                ('avail_in', ctypes.c_uint),
+                ('total_in', ctypes.c_ulong),
+                ('next_out', ctypes.c_void_p),
+                ('avail_out', ctypes.c_uint),
+                ('total_out', ctypes.c_ulong),
+                ('msg', ctypes.c_char_p),
+                ('state', ctypes.c_void_p),
+                ('zalloc', ctypes.c_void_p),
+                ('zfree', ctypes.c_void_p),
+                ('opaque', ctypes.c_void_p),
+                ('data_type', ctypes.c_int),
+                ('adler', ctypes.c_ulong),
+                ('reserved', ctypes.c_ulong)]
+
+_libz = None
+
+def _load_libz():
+    """Return the zlib library, to find the deflate blocks boundaries which the
+    zlib module does not give, or None if it cannot be loaded."""
+    global _libz
+    if _libz is None:
+        _libz = False
+        name = ctypes.util.find_library('z') or ctypes.util.find_library('zlib1')
+        try:
+            lib = ctypes.CDLL(name)
+            lib.zlibVersion.restype = ctypes.c_char_p
+            lib.inflateInit2_.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_int,
+                                          ctypes.c_char_p, ctypes.c_int]
+            lib.inflate.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_int]
+            lib.inflateReset.argtypes = [ctypes.POINTER(_ZStream)]
+            lib.inflateEnd.argtypes = [ctypes.POINTER(_ZStream)]
+            _libz = lib
+        except (OSError, TypeError, AttributeError):
+            pass
+    return _libz or None
+
+def is_gzip(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(2) == GZIP_MAGIC
+    except OSError:
+        return False
+
+def _point(c_off, u_off, bits=0, window=None, state=None):
+    """Seek point: decompression can restart at the c_off compressed byte
+    (less bits bits) giving the u_off uncompressed byte, window being the 32
+    KiB of data before it (None at the start of a gzip member). state is a
+    copy of the decompressor for the points which can not be saved."""
+    return {'in': c_off, 'out': u_off, 'bits': bits, 'window': window, 'state': state}
+
+def _build_points_libz(lib, dump, span):
+    """Seek points at the first deflate block boundary every span bytes, and
+    at the start of every gzip member (as zran.c of the zlib sources)."""
+    strm = _ZStream()
+    if lib.inflateInit2_(ctypes.byref(strm), 47, lib.zlibVersion(),
+                         ctypes.sizeof(strm)) != Z_OK:
+        raise GzipIndexError('cannot initialize zlib')
+    window = ctypes.create_string_buffer(WINDOW_SIZE)
+    points = [_point(0, 0)]
+    totin = totout = last = 0
+    pos = 0
+    member_start = True
+    try:
+        while True:
+            chunk = dump.pread(pos, GZIP_CHUNK_SIZE)
+            if not chunk:
+                break
+            pos = pos + len(chunk)
+            buf = ctypes.create_string_buffer(chunk, len(chunk))
+            strm.next_in = ctypes.addressof(buf)
+            strm.avail_in = len(chunk)
+            while strm.avail_in:
+                if strm.avail_out == 0:
+                    strm.next_out = ctypes.addressof(window)
+                    strm.avail_out = WINDOW_SIZE
+                totin = totin + strm.avail_in
+                totout = totout + strm.avail_out
+                ret = lib.inflate(ctypes.byref(strm), Z_BLOCK)
+                totin = totin - strm.avail_in
+                totout = totout - strm.avail_out
+                if ret == Z_STREAM_END:
+                    # another member may follow
+                    lib.inflateReset(ctypes.byref(strm))
+                    points.append(_point(totin, totout))
+                    last = totout
+                    member_start = True
+                    continue
+                if ret not in (Z_OK, Z_BUF_ERROR):
+                    if member_start and len(points) > 1:
+                        # garbage (e.g. padding) after the last member
+                        strm.avail_in = 0
+                        pos = dump.size
+                        break
+                    raise GzipIndexError('corrupted gzip data at {:#x}'.format(totin))
+                if totout != points[-1]['out']:
+                    member_start = False
+                if (strm.data_type & 128 and not strm.data_type & 64 and
+                    totout - last > span):
+                    left = strm.avail_out
+                    data = window.raw
+                    data = data[WINDOW_SIZE - left:] + data[:WINDOW_SIZE - left]
+                    data = data[-min(totout, WINDOW_SIZE):]
+                    points.append(_point(totin, totout, strm.data_type & 7, data))
+                    last = totout
+    finally:
+        lib.inflateEnd(ctypes.byref(strm))
+    if points[-1]['window'] is None and points[-1]['out'] == totout and len(points) > 1:
+        # end of the last member
+        points.pop()
+    return points, totout
+
+def _build_points_copy(dump, span):
+    """Seek points keeping copies of the decompressor, when zlib cannot be
+    loaded to find the deflate blocks boundaries. They cannot be saved."""
+    points = [_point(0, 0)]
+    d = zlib.decompressobj(31)
+    totout = last = 0
+    pos = 0
+    data = b''
+    while True:
+        if not data:
+            data = dump.pread(pos, GZIP_CHUNK_SIZE)
+            pos = pos + len(data)
+            if not data:
+                break
+        out = d.decompress(data, GZIP_CHUNK_SIZE)
+        totout = totout + len(out)
+        data = d.unconsumed_tail
+        if d.eof:
+            rest = d.unused_data
+            if not rest:
+                rest = dump.pread(pos, GZIP_CHUNK_SIZE)
+                pos = pos + len(rest)
+            if not rest.startswith(GZIP_MAGIC):
+                break
+            d = zlib.decompressobj(31)
+            points.append(_point(pos - len(rest), totout))
+            last = totout
+            data = rest
+        elif not data and totout - last > span:
+            points.append(_point(pos, totout, state=d.copy()))
+            last = totout
+    return points, totout
+
+def index_paths(path):
+    return sidecar_paths(path, os.path.basename(path) + INDEX_SUFFIX)
+
+def _encode_index(st, size, span, points):
+    chunks = [INDEX_HEADER_FORMAT.pack(INDEX_MAGIC, INDEX_VERSION, st.st_size,
+                                       st.st_mtime_ns, size, span, len(points))]
+    windows = []
+    for p in points:
+        window = b'' if p['window'] is None else zlib.compress(p['window'], 1)
+        windows.append(window)
+        chunks.append(INDEX_POINT_FORMAT.pack(p['in'], p['out'], p['bits'],
+                                              NO_WINDOW if p['window'] is None else len(window)))
+    return b''.join(chunks + windows)
+
+def _decode_index(st, data):
+    """Return the (points, uncompressed size) index stored in data, or None
+    if it is stale (other or modified dump) or damaged (truncated...)."""
+    if len(data) < INDEX_HEADER_FORMAT.size:
+        return None
+    magic, version, gz_size, mtime, size, span, count = INDEX_HEADER_FORMAT.unpack_from(data, 0)
+    if (magic, version, gz_size, mtime) != (INDEX_MAGIC, INDEX_VERSION, st.st_size, st.st_mtime_ns):
+        return None
+    pos = INDEX_HEADER_FORMAT.size
+    window_pos = pos + count * INDEX_POINT_FORMAT.size
+    if len(data) < window_pos:
+        return None
+    points = []
+    try:
+        for i in range(count):
+            c_off, u_off, bits, length = INDEX_POINT_FORMAT.unpack_from(data, pos + i * INDEX_POINT_FORMAT.size)
+            window = None
+            if length != NO_WINDOW:
+                window = zlib.decompress(data[window_pos:window_pos + length])
+                window_pos = window_pos + length
+            points.append(_point(c_off, u_off, bits, window))
+    except (StructError, zlib.error):
+        return None
+    if window_pos != len(data):
+        return None
+    return points, size
+
+def load_index(path, st):
+    return load_sidecar(index_paths(path), lambda data: _decode_index(st, data))
+
+def save_index(path, st, size, span, points):
+    return save_sidecar(index_paths(path), _encode_index(st, size, span, points))
+
+class GzipImage(DumpImage):
+    """Random access to a gzip compressed dump.
+
+    The first time a dump is opened it is decompressed once to build an
+    index of seek points (every span uncompressed bytes), which is saved next
+    to it (or in INDEX_CACHE_DIR). Reads then only decompress the spans they
+    need, from the nearest seek point, the last spans being kept in memory.
+    Without the zlib library the seek points cannot be saved, the image is
+    then not reopenable (see DumpImage)."""
+
+    backend = 'gzip'
+
+    def __init__(self, path, span=GZIP_SPAN, cache_spans=GZIP_CACHE_SPANS):
+        DumpImage.__init__(self)
+        self.path = path
+        self._file = PreadImage(path)
+        self._lock = threading.Lock()
+        self._spans = OrderedDict()
+        self.cache_spans = cache_spans
+        try:
+            self._open_index(span)
+        except:
+            self._file.close()
+            raise
+        self._outs = [ p['out'] for p in self.points ]
+
+    def _open_index(self, span):
+        st = os.stat(self.path)
+        index = load_index(self.path, st)
+        if index is not None:
+            self.points, self._size = index
+            return
+        lib = _load_libz()
+        if lib is None:
+            # the points hold copies of the decompressor, every process
+            # opening the dump would decompress all of it again
+            self.points, self._size = _build_points_copy(self._file, span)
+            self.reopenable = False
+            return
+        self.points, self._size = _build_points_libz(lib, self._file, span)
+        save_index(self.path, st, self._size, span, self.points)
+
+    @property
+    def size(self):
+        return self._size
+
+    def _compressed(self, pos, shift):
+        """Compressed chunks from pos, shifted right by shift bits."""
+        while True:
+            if not shift:
+                chunk = self._file.pread(pos, GZIP_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+            else:
+                chunk = self._file.pread(pos, GZIP_CHUNK_SIZE + 1)
+                if not chunk:
+                    return
+                value = int.from_bytes(chunk, 'little') >> shift
+                if len(chunk) > GZIP_CHUNK_SIZE:
+                    yield value.to_bytes(len(chunk), 'little')[:GZIP_CHUNK_SIZE]
+                else:
+                    yield value.to_bytes(len(chunk), 'little')
+                    return
+            pos = pos + GZIP_CHUNK_SIZE
+
+    def _decompress_span(self, i):
+        point = self.points[i]
+        end = self._outs[i + 1] if i + 1 < len(self.points) else self._size
+        length = end - point['out']
+        shift = 0
+        pos = point['in']
+        if point['state'] is not None:
+            d = point['state'].copy()
+        elif point['window'] is None:
+            d = zlib.decompressobj(31)
+        else:
+            d = zlib.decompressobj(-15, zdict=point['window']) if point['window'] \
+                else zlib.decompressobj(-15)
+            if point['bits']:
+                # the block starts in the last bits of the previous byte
+                pos = pos - 1
+                shift = 8 - point['bits']
+        chunks = self._compressed(pos, shift)
+        out = []
+        n = 0
+        while n < length:
+            if d.unconsumed_tail:
+                data = d.unconsumed_tail
+            elif d.eof:
+                break
+            else:
+                data = next(chunks, None)
+                if data is None:
+                    break
+            piece = d.decompress(data, length - n)
+            out.append(piece)
+            n = n + len(piece)
+        return b''.join(out)
+
+    def _span(self, i):
+        with self._lock:
+            data = self._spans.get(i)
+            if data is not None:
+                self._spans.move_to_end(i)
+                return data
+        data = self._decompress_span(i)
+        with self._lock:
+            self._spans[i] = data
+            while len(self._spans) > self.cache_spans:
+                self._spans.popitem(last=False)
+        return data
+
+    def pread(self, offset, size):
+        if offset < 0:
+            raise ValueError('negative offset {}'.format(offset))
+        end = min(offset + size, self._size)
+        chunks = []
+        while offset < end:
+            i = bisect_right(self._outs, offset) - 1
+            data = self._span(i)
+            start = offset - self._outs[i]
+            piece = data[start:start + end - offset]
+            if not piece:
+                break
+            chunks.append(piece)
+            offset = offset + len(piece)
+        if len(chunks) == 1:
+            return chunks[0]
+        return b''.join(chunks)
+
+    def close(self):
+        self._file.close()
+        self._spans.clear()
@@ -0,0 +1,309 @@
+import mmap
+import os
+import re
+import threading
+from bisect import bisect_right
+
+DEFAULT_BACKEND = 'mmap'
+# numbered extension of the segments of split raw images (dump.001, dump.002...)
+SEGMENT_EXTENSION = re.compile(r'^(.*)\.(\d{3,})$')
+
+class DumpImage:
+    """Random access to the bytes of a dump.
+
+    Readers only rely on pread(offset, size), which must not depend on any
+    shared file position. seek/read/tell are provided so that code written
+    for file objects keeps working, but they share a position and are not
+    thread-safe."""
+
+    path = None
+    backend = None
+    # False when opening the dump again is as slow as reading all of it
+    # (gzip dumps whose seek points cannot be saved), util.parallel then
+    # keeps the work in the calling process
+    reopenable = True
+
+    def __init__(self):
+        self._pos = 0
+
+    def pread(self, offset, size):
+        raise NotImplementedError
+
+    @property
+    def size(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset = self._pos + offset
+        elif whence == 2:
+            offset = self.size + offset
+        if offset < 0:
+            raise ValueError('negative seek position {}'.format(offset))
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(0, self.size - self._pos)
+        data = self.pread(self._pos, size)
+        self._pos = self._pos + len(data)
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FileImage(DumpImage):
+    """Adapter for file objects, reads are serialized with a lock."""
+
+    backend = 'file'
+
+    def __init__(self, stream):
+        DumpImage.__init__(self)
+        self._stream = stream
+        self._lock = threading.Lock()
+        self.path = getattr(stream, 'name', None)
+
+    def pread(self, offset, size):
+        with self._lock:
+            self._stream.seek(offset, 0)
+            return self._stream.read(size)
+
+    @property
+    def size(self):
+        with self._lock:
+            return self._stream.seek(0, 2)
+
+    def close(self):
+        self._stream.close()
+
+class PreadImage(DumpImage):
+    """os.pread based backend, safe to share between threads."""
+
+    backend = 'pread'
+
+    def __init__(self, path):
+        DumpImage.__init__(self)
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        if not hasattr(os, 'pread'):
+            # e.g. Windows, fall back to a locked seek and read
+            self._file = FileImage(os.fdopen(self._fd, 'rb'))
+            self.pread = self._file.pread
+
+    def pread(self, offset, size):
+        return os.pread(self._fd, size, offset)
+
+    @property
+    def size(self):
+        return os.fstat(self._fd).st_size
+
+    def close(self):
+        if self._fd is not None:
+            if hasattr(self, '_file'):
+                self._file.close()
+            else:
+                os.close(self._fd)
+            self._fd = None
+
+class MmapImage(DumpImage):
+    """mmap based backend, pread returns zero-copy memoryview slices."""
+
+    backend = 'mmap'
+
+    def __init__(self, path):
+        DumpImage.__init__(self)
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+    def pread(self, offset, size):
+        if offset < 0:
+            raise ValueError('negative offset {}'.format(offset))
+        return self._view[offset:offset + size]
+
+    @property
+    def size(self):
+        return len(self._mmap)
+
+    def close(self):
+        if self._mmap is None:
+            return
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # slices are still referenced somewhere, the mapping is released
+            # once they are garbage collected
+            pass
+        self._mmap = None
+
+class BufferImage(DumpImage):
+    """Bytes already read from base_offset of a dump, typically a whole
+    entryblock, so that the structures it contains are decoded from memory.
+    Reads outside of the buffer are forwarded to dump, or truncated at the
+    end of the buffer if there is no dump."""
+
+    backend = 'buffer'
+
+    def __init__(self, buffer, base_offset=0, dump=None):
+        DumpImage.__init__(self)
+        self.buffer = buffer
+        self.base_offset = base_offset
+        self.dump = dump
+        self.path = getattr(dump, 'path', None)
+        self.reopenable = getattr(dump, 'reopenable', True)
+
+    def covers(self, offset, size):
+        start = offset - self.base_offset
+        return start >= 0 and start + size <= len(self.buffer)
+
+    def pread(self, offset, size):
+        if self.dump is not None and not self.covers(offset, size):
+            return pread(self.dump, offset, size)
+        return _buffer_pread(self.buffer, self.base_offset, offset, size)
+
+    @property
+    def size(self):
+        if self.dump is not None:
+            return self.dump.size
+        return self.base_offset + len(self.buffer)
+
+class SplitImage(DumpImage):
+    """Split raw image, the segments (DumpImages) being concatenated. Offsets
+    are mapped to the segments by bisection over their start offsets, reads
+    contained in one segment are forwarded as is (zero-copy with mmap)."""
+
+    backend = 'split'
+
+    def __init__(self, segments, path=None):
+        DumpImage.__init__(self)
+        self.segments = segments
+        self.path = path
+        if segments:
+            self.backend = segments[0].backend
+        self.reopenable = all(x.reopenable for x in segments)
+        self._starts = []
+        end = 0
+        for segment in segments:
+            self._starts.append(end)
+            end = end + segment.size
+        self._size = end
+
+    @property
+    def size(self):
+        return self._size
+
+    def pread(self, offset, size):
+        if offset < 0:
+            raise ValueError('negative offset {}'.format(offset))
+        end = min(offset + size, self._size)
+        if offset >= end:
+            return b''
+        i = bisect_right(self._starts, offset) - 1
+        start = self._starts[i]
+        if end <= start + self.segments[i].size:
+            return self.segments[i].pread(offset - start, end - offset)
+        chunks = []
+        while offset < end:
+            start = self._starts[i]
+            length = min(end, start + self.segments[i].size) - offset
+            chunks.append(self.segments[i].pread(offset - start, length))
+            offset = offset + length
+            i = i + 1
+        return b''.join(chunks)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+def split_segments(path):
+    """Return the paths of the segments of the split raw image path belongs
+    to (path.001, path.002... numbered from 000 or 001 up to the first missing
+    one), or [path] if it is not a segment."""
+    match = SEGMENT_EXTENSION.match(path)
+    if not match:
+        return [path]
+    base, number = match.groups()
+    name = '{}.{:0' + str(len(number)) + 'd}'
+    first = 0 if os.path.isfile(name.format(base, 0)) else 1
+    segments = []
+    while os.path.isfile(name.format(base, first + len(segments))):
+        segments.append(name.format(base, first + len(segments)))
+    if path not in segments:
+        return [path]
+    return segments
+
+def _open_file(path, backend):
+    # imported here as media.gzip_image builds on this module
+    import media.gzip_image as gzip_image
+    if gzip_image.is_gzip(path):
+        return gzip_image.GzipImage(path)
+    if backend == 'mmap':
+        try:
+            return MmapImage(path)
+        except (ValueError, OSError):
+            # empty files and some special files cannot be mapped
+            return PreadImage(path)
+    return BACKENDS[backend](path)
+
+BACKENDS = {'pread': PreadImage,
+            'mmap': MmapImage}
+
+def open_image(path, backend=DEFAULT_BACKEND):
+    """Open the dump at path, with all its segments if it is part of a split
+    raw image."""
+    segments = split_segments(path)
+    if len(segments) == 1:
+        return _open_file(path, backend)
+    images = []
+    try:
+        for segment in segments:
+            images.append(_open_file(segment, backend))
+    except:
+        for x in images:
+            x.close()
+        raise
+    return SplitImage(images, path)
+
+def as_image(dump):
+    if isinstance(dump, DumpImage):
+        return dump
+    return FileImage(dump)
+
+def _buffer_pread(buffer, base_offset, offset, size):
+    start = offset - base_offset
+    if start < 0:
+        raise ValueError('offset {:#x} is before the buffer read at {:#x}'.format(
+            offset, base_offset))
+    return buffer[start:start + size]
+
+def pread(dump, offset, size):
+    """Read size bytes at offset from a DumpImage, a seekable file object or a
+    (buffer, base_offset) pair, base_offset being the dump offset of buffer."""
+    if isinstance(dump, DumpImage):
+        return dump.pread(offset, size)
+    if isinstance(dump, tuple):
+        return _buffer_pread(dump[0], dump[1], offset, size)
+    dump.seek(offset, 0)
+    return dump.read(size)
+
+def read_block(dump, offset, size):
+    """Read size bytes at offset at once, and return a BufferImage to decode
+    the structures they contain from. Nothing is read if dump already holds
+    them in memory."""
+    if isinstance(dump, BufferImage) and dump.covers(offset, size):
+        return dump
+    if isinstance(dump, tuple):
+        return BufferImage(dump[0], dump[1])
+    return BufferImage(pread(dump, offset, size), offset, as_image(dump))
@@ -0,0 +1,134 @@
+import threading
+import time
+from media.image import DumpImage
+
+# read sizes are counted in power of two buckets, the last one also counting
+# all the bigger reads
+HISTOGRAM_BUCKETS = 25
+STATS_KEYS = ('reads', 'seeks', 'bytes', 'time')
+
+class AccountedImage(DumpImage):
+    """Count the reads done on a dump: number of reads, seeks (reads not
+    starting where the previous one ended), bytes read, read sizes histogram
+    and time spent in the reads.
+
+    With the mmap backend the data is only read from the disk when it is
+    accessed, after pread returned, so the time is only meaningful with the
+    pread backend."""
+
+    def __init__(self, dump):
+        DumpImage.__init__(self)
+        self.dump = dump
+        self.path = dump.path
+        self.backend = dump.backend
+        self.reopenable = dump.reopenable
+        self._lock = threading.Lock()
+        self._next = None
+        self.reset_stats()
+
+    @property
+    def size(self):
+        return self.dump.size
+
+    def reset_stats(self):
+        with self._lock:
+            self.reads = 0
+            self.seeks = 0
+            self.bytes = 0
+            self.time = 0.0
+            self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def stats(self):
+        with self._lock:
+            return {'reads': self.reads,
+                    'seeks': self.seeks,
+                    'bytes': self.bytes,
+                    'time': self.time,
+                    'histogram': list(self.histogram)}
+
+    def add_stats(self, stats):
+        """Add the stats of another AccountedImage (e.g. the one of a worker
+        process reading the same dump)."""
+        with self._lock:
+            self.reads = self.reads + stats['reads']
+            self.seeks = self.seeks + stats['seeks']
+            self.bytes = self.bytes + stats['bytes']
+            self.time = self.time + stats['time']
+            for i, n in enumerate(stats['histogram']):
+                self.histogram[i] = self.histogram[i] + n
+
+    def pread(self, offset, size):
+        start = time.perf_counter()
+        data = self.dump.pread(offset, size)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.reads = self.reads + 1
+            if offset != self._next:
+                self.seeks = self.seeks + 1
+            self._next = offset + len(data)
+            self.bytes = self.bytes + len(data)
+            self.time = self.time + elapsed
+            bucket = min(size_bucket(size), HISTOGRAM_BUCKETS - 1)
+            self.histogram[bucket] = self.histogram[bucket] + 1
+        return data
+
+    def close(self):
+        self.dump.close()
+
+def size_bucket(size):
+    """Index of the histogram bucket of reads of size bytes, bucket i counts
+    the reads of 2**(i-1) + 1 to 2**i bytes."""
+    return max(0, size - 1).bit_length()
+
+def find_accounting(dump):
+    """Return the AccountedImage dump reads go through, if any."""
+    while dump is not None:
+        if isinstance(dump, AccountedImage):
+            return dump
+        dump = getattr(dump, 'dump', None)
+    return None
+
+def diff(after, before):
+    """Stats of the reads done between the before and after snapshots."""
+    out = { key: after[key] - before[key] for key in STATS_KEYS }
+    out['histogram'] = [ a - b for a, b in zip(after['histogram'], before['histogram']) ]
+    return out
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            break
+        size = size / 1024
+    if size == int(size):
+        return '{} {}'.format(int(size), unit)
+    return '{:.1f} {}'.format(size, unit)
+
+def summary(stats):
+    """One line summary of stats."""
+    return '{} reads, {} seeks, {} read, {:.3f}s in I/O'.format(
+        stats['reads'], stats['seeks'], format_size(stats['bytes']), stats['time'])
+
+def histogram_rows(stats):
+    """(read sizes, number of reads) of the non empty histogram buckets."""
+    rows = []
+    last = HISTOGRAM_BUCKETS - 1
+    for i, n in enumerate(stats['histogram']):
+        if not n:
+            continue
+        if i == last:
+            label = '> {}'.format(format_size(2 ** (i - 1)))
+        else:
+            label = '<= {}'.format(format_size(2 ** i))
+        rows.append((label, n))
+    return rows
+
+def empty_stats():
+    return {'reads': 0, 'seeks': 0, 'bytes': 0, 'time': 0.0,
+            'histogram': [0] * HISTOGRAM_BUCKETS}
+
+def add(total, stats):
+    """Add stats to total, in place."""
+    for key in STATS_KEYS:
+        total[key] = total[key] + stats[key]
+    total['histogram'] = [ a + b for a, b in zip(total['histogram'], stats['histogram']) ]
+    return total
@@ -1,5 +1,7 @@
-from struct import unpack, Struct
+from struct import Struct
 from media.gpt import readGPT
+from media.image import pread
+from util.schema import Schema, field, skip
 
 SECTOR_SIZE = 512
 MBR_SIZE = SECTOR_SIZE
@@ -26,11 +28,18 @@ offset,size,name, interpretation
 12  ulong     size             size in sectors
 '''
 #https://docs.python.org/3/library/struct.html
-MBR_PART_FORMAT = Struct('<B3sB3sLL') #'<' means little endian
+MBR_PART = Schema('MBR partition entry', [
+    field('bflag', 'B'),
+    skip('3s'),
+    field('ptype', 'B'),
+    skip('3s'),
+    field('start', 'L'),
+    field('size', 'L')]) # little endian
+MBR_PART_FORMAT = MBR_PART.struct
 MBR_TERMINATOR_FORMAT = Struct('>H')
 
 def readMBR(stream):
-    data = stream.read(MBR_SIZE)
+    data = pread(stream, 0, MBR_SIZE)
     mbr = []
     terminator, = MBR_TERMINATOR_FORMAT.unpack_from(data, MBR_TERMINATOR_OFFSET)
     if terminator != MBR_TERMINATOR:
@@ -38,11 +47,9 @@ def readMBR(stream):
         return None #we should raise an Exception. https://docs.python.org/fr/3.5/tutorial/errors.html
     else:
         for p in range(MBR_PART_TABLE_SIZE):
-            # by convention, _ is the variable name for ignored values in Python
-            mbr_entry = MBR_PART_FORMAT.unpack_from(data, MBR_PART_TABLE_OFFSET + (p * MBR_PART_ENTRY_SIZE))
-            bflag, _, ptype, _, start, size = mbr_entry
-            if ptype != 0:
-                mbr.append( (p, { 'bflag':bflag, 'ptype':ptype, 'start':start, 'size':size } ) )
+            mbr_entry = MBR_PART.decode(data, MBR_PART_TABLE_OFFSET + (p * MBR_PART_ENTRY_SIZE))
+            if mbr_entry['ptype'] != 0:
+                mbr.append( (p, mbr_entry ) )
             # else:
             #     print('Ignored entry')
     # print(mbr)    
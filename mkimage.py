@@ -0,0 +1,32 @@
+import argparse
+import util.synth as synth
+
+def mkimage():
+    parser = argparse.ArgumentParser(description='Generate a synthetic ReFS 1.1 image.')
+    parser.add_argument('dump', action='store', help='image to create')
+    parser.add_argument('size', action='store', type=synth.parse_size,
+            help='size of the image (e.g. 100M, 10G)')
+    parser.add_argument('-d', '--directories', action='store', type=int,
+            default=10, help='number of directories (root included)')
+    parser.add_argument('-f', '--files', action='store', type=int,
+            default=10, help='number of files per directory')
+    parser.add_argument('--fragmentation', action='store', type=int,
+            default=1, help='number of dataruns per file')
+    parser.add_argument('--stale', action='store', type=int,
+            default=0, help='number of stale copies of each directory node')
+    parser.add_argument('--max-file-size', action='store', type=synth.parse_size,
+            default=64 * 1024, help='maximum size of the files')
+    parser.add_argument('--seed', action='store', type=int, default=0,
+            help='seed of the random generator')
+    parser.add_argument('--no-fill', action='store_false', dest='fill',
+            help='do not tag the data blocks of the files')
+    args = parser.parse_args()
+    layout = synth.generate(args.dump, args.size, args.directories, args.files,
+                            args.fragmentation, args.stale, args.max_file_size,
+                            args.seed, args.fill)
+    print('ReFS partition from LBA {} to {}, object tree at entryblock {:#x}, {} directories'.format(
+          layout['first_lba'], layout['last_lba'], layout['object_tree'],
+          len(layout['nodes'])))
+
+if __name__ == '__main__':
+    mkimage()
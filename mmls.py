@@ -1,6 +1,7 @@
 import argparse
 import media.mbr as mbr
 import media.gpt as gpt
+import util.discovery as discovery
 
 def mmls():
     parser = argparse.ArgumentParser(description='Read MBR from provided dump.')
@@ -10,11 +11,14 @@ def mmls():
     mbr_data = mbr.readMBR(args.dump)
     # we make the supposition that if it is a GPT media then only one
     # partition is declared in the MBR
-    if len(mbr_data) == 1 and mbr_data[0][1]['ptype'] == mbr.MBR_PARTTYPE_GPT:
+    if mbr_data and len(mbr_data) == 1 and mbr_data[0][1]['ptype'] == mbr.MBR_PARTTYPE_GPT:
         gpt_data = gpt.readGPT(args.dump, mbr_data[0][1]['start'])
         gpt.print_gpt(gpt_data)
-    else:
-        print(mbr_data)
+        return
+    print(mbr_data)
+    # no partition table to rely on, look for the ReFS volume records
+    for volume in discovery.find_volumes(args.dump):
+        discovery.print_volume(volume)
 
 if __name__ == '__main__':
     mmls()
@@ -1,37 +1,80 @@
-from struct import Struct
+from media.image import pread, read_block
+from part.refs.entry_block import ENTRYBLOCK_SIZE, EB_HEADER
+from part.refs.object_tree import OT_HEADER_1, OT_HEADER_2
+from util.schema import Schema, field, skip, read_array, HEX_DEC
 
-AL_HEADER_FORMAT = Struct('<QQ8sQ16sL28sL20sLLLLLLQ')
+# entryblock, node descriptor and node header, as for the object tree
+AL_HEADER = Schema('allocator header', OT_HEADER_1.fields + (skip('20s'),) + OT_HEADER_2.fields)
+AL_HEADER_FORMAT = AL_HEADER.struct
+# allocator records use the generic record header (see ATTR_HEADER_FORMAT),
+# their key gives the range of clusters they describe and their value the
+# allocation bitmap of the range, one bit per cluster (set if allocated).
+# This layout is a heuristic, not confirmed on a real volume yet: the records
+# are checked (see util.allocation.check_records) before being trusted
+AL_RECORD_HEADER = Schema('allocator record header', [
+    field('size', 'L'),
+    field('key_offset', 'H'),
+    field('key_length', 'H'),
+    skip('H'),
+    field('value_offset', 'H'),
+    field('value_length', 'H'),
+    skip('H')])
+AL_RECORD_KEY = Schema('allocator record key', [
+    field('first_cluster', 'Q', 'first cluster', HEX_DEC),
+    field('num_clusters', 'Q', 'number of clusters')])
+AL_RECORD_VALUE = Schema('allocator record value', [
+    field('free_clusters?', 'L', 'free clusters(?)'),
+    field('bitmap_length', 'L')])
+AL_POINTER_SIZE = 4
+AL_RECORD_KEY_FORMAT = AL_RECORD_KEY.struct
+AL_RECORD_VALUE_FORMAT = AL_RECORD_VALUE.struct
+# node identifier of the allocator, reached through the tree control extension
+ALLOCATOR_NODE_ID = 0x20
 
-def read_allocator(dump, offset):
-    dump.seek(offset, 0)
-    data = dump.read(AL_HEADER_FORMAT.size)
-    fields = AL_HEADER_FORMAT.unpack_from(data, 0)
-    al = {'absolute_offset': offset,
-          'eb_number': fields[0],
-          'counter': fields[1],
-          'node_id': fields[3],
-          'node_desc_length': fields[5],
-          'num_records_in_node': fields[7],
-          'node_header_length': fields[9],
-          'offset_next_free_rec': fields[10],
-          'free_space': fields[11],
-          'node_header_unknown': fields[12],
-          'offset_first_ptr': fields[13],
-          'num_ptrs_in_node': fields[14],
-          'offset_end_node': fields[15]}
-    al['_structure_size'] = AL_HEADER_FORMAT.size
+def read_allocator(dump, offset, block_size=ENTRYBLOCK_SIZE):
+    dump = read_block(dump, offset, block_size)
+    al = AL_HEADER.read(dump, offset, {'absolute_offset': offset})
+    al['_structure_size'] = AL_HEADER.size
+    al['node_header_offset'] = EB_HEADER.size + al['node_desc_length']
+    al['records'] = _read_allocator_records(dump, offset, al, block_size)
     return al
 
+def _read_allocator_records(dump, offset, al, block_size):
+    # the header of blocks which are not allocators gives pointers out of the
+    # block, their records are ignored
+    node_header = offset + al['node_header_offset']
+    pointers_end = (al['node_header_offset'] + al['offset_first_ptr'] +
+                    al['num_ptrs_in_node'] * AL_POINTER_SIZE)
+    if pointers_end > block_size:
+        return []
+    records = []
+    for ptr in read_array(dump, node_header + al['offset_first_ptr'], al['num_ptrs_in_node']):
+        rec_offset = node_header + ptr
+        if rec_offset - offset + AL_RECORD_HEADER.size > block_size:
+            continue
+        header = AL_RECORD_HEADER.read(dump, rec_offset)
+        if (header['key_length'] < AL_RECORD_KEY.size or
+                header['value_length'] < AL_RECORD_VALUE.size or
+                rec_offset - offset + header['size'] > block_size):
+            continue
+        rec = AL_RECORD_KEY.read(dump, rec_offset + header['key_offset'],
+                                 {'_record_offset': rec_offset - offset})
+        value = AL_RECORD_VALUE.read(dump, rec_offset + header['value_offset'])
+        rec['free_clusters?'] = value['free_clusters?']
+        bitmap_length = min(value['bitmap_length'], header['value_length'] - AL_RECORD_VALUE.size)
+        bitmap = pread(dump, rec_offset + header['value_offset'] + AL_RECORD_VALUE.size,
+                       bitmap_length)
+        rec['bitmap'] = bytes(bitmap)
+        records.append(rec)
+    return records
+
 def dump_allocator(al):
     print('Allocator {:#x} ({size},{size:#x}):'.format(al['absolute_offset'], size=al['_structure_size']))
-    print('- entryblock number: {:#x}'.format(al['eb_number']))
-    print('- counter: {}'.format(al['counter']))
-    print('- node id: {:#x}'.format(al['node_id']))
-    print('- node descriptor length: {val:#x} ({val})'.format(val=al['node_desc_length']))
-    print('- number of records in node: {}'.format(al['num_records_in_node']))
-    print('- offset to next free record: {val:#x} ({val})'.format(val=al['offset_next_free_rec']))
-    print('- free space in node: {val:#x} ({val})'.format(val=al['free_space']))
-    print('- <node header unknown>: {val:#x} ({val})'.format(val=al['node_header_unknown']))
-    print('- offset to first pointer: {val:#x} ({val})'.format(val=al['offset_first_ptr']))
-    print('- number of pointers in this node: {}'.format(al['num_ptrs_in_node']))
-    print('- offset to end of node: {val:#x} ({val})'.format(val=al['offset_end_node']))
+    AL_HEADER.dump(al, '- ')
+    if al['records']:
+        print('- records:')
+        for i, rec in enumerate(al['records']):
+            print('  - record {}: <{:#x}>'.format(i, rec['_record_offset']))
+            AL_RECORD_KEY.dump(rec, '    - ')
+            AL_RECORD_VALUE.dump(rec, '    - ')
+            print('    - bitmap length: {}'.format(len(rec['bitmap'])))
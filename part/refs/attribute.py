@@ -1,5 +1,7 @@
 from util.time import bytes2time
 from struct import Struct
+from media.image import pread, read_block
+from util.schema import Schema, field, skip, read_array, HEX, HEX_DEC
 
 ATTR_SIZE_OFFSET = 0
 ATTR_SIZE_SIZE = 4
@@ -7,87 +9,89 @@ ATTR_SIZE_FORMAT = Struct('<L')
 ATTR_TYPE_OFFSET = 0x10
 ATTR_TYPE_SIZE = 4
 ATTR_TYPE_FORMAT = Struct('<L')
-
-ATTR_FN_METADATA_FORMAT = Struct('<LH34sQQQQB7sQQQQQ')
+# attributes never span more than an entryblock
+ATTR_MAX_READ_SIZE = 16 * 1024
+
+def _wants(projection, *keys):
+    """True if one of keys is in the projection (the fields wanted, None for
+    all of them) given to the readers. The readers stop decoding once no
+    field of the following parts of the attribute is wanted."""
+    return projection is None or any(key in projection for key in keys)
+
+def _time(value):
+    return '{} ({:#x})'.format(bytes2time(value), value)
+
+def _utf16(value):
+    return value.decode('utf-16le')
+
+def _timestamps():
+    return [field('created', 'Q', 'created', _time),
+            field('modified', 'Q', 'modified', _time),
+            field('metadata_modified', 'Q', 'metadata modified', _time),
+            field('last_accessed', 'Q', 'last accessed', _time)]
+
+ATTR_FN_METADATA = Schema('filename attribute metadata', [
+    field('size', 'L', 'size', HEX_DEC),
+    field('offset_to_val?', 'H', 'offset to first value(?)', HEX_DEC),
+    skip('34s')] + _timestamps() + [
+    field('flags', 'B', 'flags', HEX),
+    skip('7s'),
+    field('parentid', 'Q', 'parent node id', HEX),
+    field('childid', 'Q', 'child node id', HEX),
+    field('unknown', 'Q', 'unknown field', HEX),
+    field('logical_size', 'Q', 'logical size', HEX_DEC),
+    field('physical_size', 'Q', 'physical size', HEX_DEC)])
+ATTR_FN_METADATA_FORMAT = ATTR_FN_METADATA.struct
 
 def read_filename_attribute_metadata(dump, offset):
-    dump.seek(offset, 0)
-    data = dump.read(ATTR_FN_METADATA_FORMAT.size)
-    fields = ATTR_FN_METADATA_FORMAT.unpack_from(data, 0)
-    attr = {'_absolute_offset': offset,
-            'size': fields[0],
-            'offset_to_val?': fields[1],
-            'created': fields[3],
-            'modified': fields[4],
-            'metadata_modified': fields[5],
-            'last_accessed': fields[6],
-            'flags': fields[7],
-            'parentid': fields[9],
-            'childid': fields[10],
-            'unknown': fields[11],
-            'logical_size': fields[12],
-            'physical_size': fields[13]}
-    return attr
+    return ATTR_FN_METADATA.read(dump, offset, {'_absolute_offset': offset})
 
 def _dump_filename_attribute_metadata(attr, prefix=''):
-    print('{}- size: {val:#x} ({val})'.format(prefix, val=attr['size']))
-    print('{}- offset to first value(?): {val:#x} ({val})'.format(prefix, val=attr['offset_to_val?']))
-    print('{}- created: {} ({:#x})'.format(prefix, bytes2time(attr['created']), attr['created']))
-    print('{}- modified: {} ({:#x})'.format(prefix, bytes2time(attr['modified']), attr['modified']))
-    print('{}- metadata modified: {} ({:#x})'.format(prefix, bytes2time(attr['metadata_modified']),
-                                                     attr['metadata_modified']))
-    print('{}- last accessed: {} ({:#x})'.format(prefix, bytes2time(attr['last_accessed']),
-                                                 attr['last_accessed']))
-    print('{}- flags: {:#x}'.format(prefix, attr['flags']))
-    print('{}- parent node id: {:#x}'.format(prefix, attr['parentid']))
-    print('{}- child node id: {:#x}'.format(prefix, attr['childid']))
-    print('{}- unknown field: {:#x}'.format(prefix, attr['unknown']))
-    print('{}- logical size: {val:#x} ({val})'.format(prefix, val=attr['logical_size']))
-    print('{}- physical size: {val:#x} ({val})'.format(prefix, val=attr['physical_size']))
-
-ATTR_FN_DATARUN_ENTRY_HEADER_FORMAT = Struct('<LHHHHLLLL')
-ATTR_FN_DATARUN_ENTRY_BODY_FORMAT = Struct('<L48sQQ')
-ATTR_FN_DATARUN_ENTRY_BODY_LIST_FORMAT = Struct('<LLL4sLLL')
-ATTR_FN_DATARUN_ENTRY_BODY_LIST_ENTRY_FORMAT = Struct('<L20sQQ')
+    ATTR_FN_METADATA.dump(attr, prefix + '- ')
+
+ATTR_FN_DATARUN_ENTRY_HEADER = Schema('datarun entry header', [
+    field('size', 'L', 'size', HEX_DEC),
+    field('unknown0', 'H', 'unknown field 0', HEX_DEC),
+    field('unknown1', 'H', 'unknown field 1', HEX_DEC),
+    field('unknown2', 'H', 'unknown field 2', HEX_DEC),
+    field('header_size', 'H', 'header size', HEX_DEC),
+    field('header_body_size', 'L', 'body size (info in header)', HEX_DEC),
+    field('body_size_copy', 'L', 'body size (copy)', HEX_DEC),
+    field('unknown3', 'L', 'unknown field 3', HEX_DEC),
+    field('attributeid?', 'L', 'attribute type identifier', '{val:#010x}')])
+# NOTE: This is wrong in the thesis, logical comes before physical
+ATTR_FN_DATARUN_ENTRY_BODY = Schema('datarun entry body', [
+    field('body_size', 'L', 'body size', HEX_DEC),
+    skip('48s'),
+    field('physical_size', 'Q', 'physical size', HEX_DEC),
+    field('logical_size', 'Q', 'logical size', HEX_DEC)])
+ATTR_FN_DATARUN_ENTRY_BODY_LIST = Schema('datarun entry body list', [
+    field('body_list_size', 'L', 'body list size', HEX_DEC),
+    field('body_list_offset_next_record', 'L', 'body list offset to next record', HEX_DEC),
+    field('body_list_free_space', 'L', 'body list free space', HEX_DEC),
+    skip('4s'),
+    field('offset_pointers', 'L', 'offset to pointers', HEX_DEC),
+    field('num_pointers', 'L', 'number of pointers'),
+    field('body_list_end_struct', 'L', 'body list end of structure', HEX_DEC)])
+ATTR_FN_DATARUN_ENTRY_BODY_LIST_ENTRY = Schema('datarun entry body list entry', [
+    field('size', 'L', 'entry size', HEX_DEC),
+    skip('20s'),
+    field('num_blocks', 'Q', 'number of blocks/clusters'),
+    field('blockid', 'Q', 'block identifier', HEX)])
+ATTR_FN_DATARUN_ENTRY_HEADER_FORMAT = ATTR_FN_DATARUN_ENTRY_HEADER.struct
+ATTR_FN_DATARUN_ENTRY_BODY_FORMAT = ATTR_FN_DATARUN_ENTRY_BODY.struct
+ATTR_FN_DATARUN_ENTRY_BODY_LIST_FORMAT = ATTR_FN_DATARUN_ENTRY_BODY_LIST.struct
+ATTR_FN_DATARUN_ENTRY_BODY_LIST_ENTRY_FORMAT = ATTR_FN_DATARUN_ENTRY_BODY_LIST_ENTRY.struct
 
 def read_filename_attribute_datarun_entry(dump, offset):
-    dump.seek(offset, 0)
-    data = dump.read(ATTR_FN_DATARUN_ENTRY_HEADER_FORMAT.size)
-    fields = ATTR_FN_DATARUN_ENTRY_HEADER_FORMAT.unpack_from(data, 0)
-    attr = {'_absolute_offset': offset,
-            'size': fields[0],
-            'unknown0': fields[1],
-            'unknown1': fields[2],
-            'unknown2': fields[3],
-            'header_size': fields[4],
-            'header_body_size': fields[5],
-            'body_size_copy': fields[6],
-            'unknown3': fields[7],
-            'attributeid?': fields[8]}
+    attr = ATTR_FN_DATARUN_ENTRY_HEADER.read(dump, offset, {'_absolute_offset': offset})
     attr['_body_offset'] = attr['header_size']
-    dump.seek(offset + attr['_body_offset'], 0)
-    data = dump.read(ATTR_FN_DATARUN_ENTRY_BODY_FORMAT.size)
-    fields = ATTR_FN_DATARUN_ENTRY_BODY_FORMAT.unpack_from(data, 0)
-    attr['body_size'] = fields[0]
-    # NOTE: This is wrong in the thesis, logical comes before physical
-    attr['physical_size'] = fields[2]
-    attr['logical_size'] = fields[3]
+    ATTR_FN_DATARUN_ENTRY_BODY.read(dump, offset + attr['_body_offset'], attr)
     attr['_body_list_offset'] = attr['_body_offset'] + attr['body_size']
-    dump.seek(offset + attr['_body_list_offset'], 0)
-    data = dump.read(ATTR_FN_DATARUN_ENTRY_BODY_LIST_FORMAT.size)
-    fields = ATTR_FN_DATARUN_ENTRY_BODY_LIST_FORMAT.unpack_from(data, 0)
-    attr['body_list_size'] = fields[0]
-    attr['body_list_offset_next_record'] = fields[1]
-    attr['body_list_free_space'] = fields[2]
-    attr['offset_pointers'] = fields[4]
-    attr['num_pointers'] = fields[5]
-    attr['body_list_end_struct'] = fields[6]
+    ATTR_FN_DATARUN_ENTRY_BODY_LIST.read(dump, offset + attr['_body_list_offset'], attr)
     if attr['num_pointers']:
-        pointers_format = Struct('<' + ('L' * attr['num_pointers']))
-        dump.seek(offset + attr['_body_list_offset'] + attr['offset_pointers'], 0)
-        data = dump.read(pointers_format.size)
-        fields = pointers_format.unpack_from(data, 0)
-        attr['pointers'] = fields
+        attr['pointers'] = read_array(dump, offset + attr['_body_list_offset'] +
+                                      attr['offset_pointers'], attr['num_pointers'])
         attr['pointers_data'] = []
     else:
         attr['pointers'] = None
@@ -96,37 +100,16 @@ def read_filename_attribute_datarun_entry(dump, offset):
     if attr['pointers']:
         for ptr in attr['pointers']:
             ptr_addr = offset + attr['_body_list_offset'] + ptr
-            dump.seek(ptr_addr, 0)
-            data = dump.read(ATTR_FN_DATARUN_ENTRY_BODY_LIST_ENTRY_FORMAT.size)
-            fields = ATTR_FN_DATARUN_ENTRY_BODY_LIST_ENTRY_FORMAT.unpack_from(data, 0)
-            entry = {'_absolute_offset': ptr_addr,
-                     'size': fields[0],
-                     'num_blocks': fields[2],
-                     'blockid': fields[3]}
+            entry = ATTR_FN_DATARUN_ENTRY_BODY_LIST_ENTRY.read(dump, ptr_addr,
+                                                               {'_absolute_offset': ptr_addr})
             attr['pointers_data'].append(entry)
     return attr
 
 def _dump_filename_attribute_datarun_entry(attr, prefix=''):
-    print('{}- size: {val:#x} ({val})'.format(prefix, val=attr['size']))
-    print('{}- unknown field 0: {val:#x} ({val})'.format(prefix, val=attr['unknown0']))
-    print('{}- unknown field 1: {val:#x} ({val})'.format(prefix, val=attr['unknown1']))
-    print('{}- unknown field 2: {val:#x} ({val})'.format(prefix, val=attr['unknown2']))
-    print('{}- header size: {val:#x} ({val})'.format(prefix, val=attr['header_size']))
-    print('{}- body size (info in header): {val:#x} ({val})'.format(prefix, val=attr['header_body_size']))
-    print('{}- body size (copy): {val:#x} ({val})'.format(prefix, val=attr['body_size_copy']))
-    print('{}- unknown field 3: {val:#x} ({val})'.format(prefix, val=attr['unknown3']))
-    print('{}- attribute type identifier: {:#010x}'.format(prefix, attr['attributeid?']))
-    print('{}- body size: {val:#x} ({val})'.format(prefix, val=attr['body_size']))
-    print('{}- logical size: {val:#x} ({val})'.format(prefix, val=attr['logical_size']))
-    print('{}- physical size: {val:#x} ({val})'.format(prefix, val=attr['physical_size']))
-    print('{}- body list size: {val:#x} ({val})'.format(prefix, val=attr['body_list_size']))
-    print('{}- body list offset to next record: {val:#x} ({val})'.format(prefix,
-        val=attr['body_list_offset_next_record']))
-    print('{}- body list free space: {val:#x} ({val})'.format(prefix, val=attr['body_list_free_space']))
-    print('{}- offset to pointers: {val:#x} ({val})'.format(prefix, val=attr['offset_pointers']))
-    print('{}- number of pointers: {}'.format(prefix, attr['num_pointers']))
-    print('{}- body list end of structure: {val:#x} ({val})'.format(prefix,
-        val=attr['body_list_end_struct']))
+    ATTR_FN_DATARUN_ENTRY_HEADER.dump(attr, prefix + '- ')
+    ATTR_FN_DATARUN_ENTRY_BODY.dump(attr, prefix + '- ', ('body_size', 'logical_size',
+                                                          'physical_size'))
+    ATTR_FN_DATARUN_ENTRY_BODY_LIST.dump(attr, prefix + '- ')
     if attr['pointers']:
         print('{}- pointers:'.format(prefix), end='')
         for ptr in attr['pointers']:
@@ -135,33 +118,26 @@ def _dump_filename_attribute_datarun_entry(attr, prefix=''):
         print('{}- pointers data:'.format(prefix))
         for ptr_i, ptr in enumerate(attr['pointers_data']):
             print('{}  - pointer {}: <{:#x}>'.format(prefix, ptr_i, ptr['_absolute_offset']))
-            print('{}    - entry size: {val:#x} ({val})'.format(prefix, val=ptr['size']))
-            print('{}    - number of blocks/clusters: {}'.format(prefix, ptr['num_blocks']))
-            print('{}    - block identifier: {:#x}'.format(prefix, ptr['blockid']))
+            ATTR_FN_DATARUN_ENTRY_BODY_LIST_ENTRY.dump(ptr, prefix + '    - ')
     else:
         print('{}- pointers: None'.format(prefix))
         print('{}- pointers data: None'.format(prefix))
 
-ATTR_FN_DATARUN_HEADER_FORMAT = Struct('<LLLLLLL')
+ATTR_FN_DATARUN_HEADER = Schema('datarun header', [
+    field('size', 'L', 'size', HEX_DEC),
+    field('offset_next_free_record', 'L', 'offset next free record', HEX),
+    field('free_space', 'L', 'free space', HEX_DEC),
+    field('unknown0', 'L', 'unknown value', HEX_DEC),
+    field('offset_first_pointer', 'L', 'offset to first pointer', HEX),
+    field('num_pointers', 'L', 'number of pointers'),
+    field('end_of_struct', 'L', 'end of structure', HEX_DEC)])
+ATTR_FN_DATARUN_HEADER_FORMAT = ATTR_FN_DATARUN_HEADER.struct
 
 def read_filename_attribute_datarun(dump, offset):
-    dump.seek(offset, 0)
-    data = dump.read(ATTR_FN_DATARUN_HEADER_FORMAT.size)
-    fields = ATTR_FN_DATARUN_HEADER_FORMAT.unpack_from(data, 0)
-    attr = {'_absolute_offset': offset,
-            'size': fields[0],
-            'offset_next_free_record': fields[1],
-            'free_space': fields[2],
-            'unknown0': fields[3],
-            'offset_first_pointer': fields[4],
-            'num_pointers': fields[5],
-            'end_of_struct': fields[6]}
+    attr = ATTR_FN_DATARUN_HEADER.read(dump, offset, {'_absolute_offset': offset})
     if attr['num_pointers']:
-        pointers_format = Struct('<' + ('L' * attr['num_pointers']))
-        dump.seek(offset + attr['offset_first_pointer'], 0)
-        data = dump.read(pointers_format.size)
-        fields = pointers_format.unpack_from(data, 0)
-        attr['pointers'] = fields
+        attr['pointers'] = read_array(dump, offset + attr['offset_first_pointer'],
+                                      attr['num_pointers'])
         attr['pointers_data'] = []
         for ptr in attr['pointers']:
             ptr_addr = offset + ptr
@@ -172,13 +148,7 @@ def read_filename_attribute_datarun(dump, offset):
     return attr
 
 def _dump_filename_attribute_datarun(attr, prefix=''):
-    print('{}- size: {val:#x} ({val})'.format(prefix, val=attr['size']))
-    print('{}- offset next free record: {:#x}'.format(prefix, attr['offset_next_free_record']))
-    print('{}- free space: {val:#x} ({val})'.format(prefix, val=attr['free_space']))
-    print('{}- unknown value: {val:#x} ({val})'.format(prefix, val=attr['unknown0']))
-    print('{}- offset to first pointer: {:#x}'.format(prefix, attr['offset_first_pointer']))
-    print('{}- number of pointers: {}'.format(prefix, attr['num_pointers']))
-    print('{}- end of structure: {val:#x} ({val})'.format(prefix, val=attr['end_of_struct']))
+    ATTR_FN_DATARUN_HEADER.dump(attr, prefix + '- ')
     if attr['pointers']:
         print('{}- pointers:'.format(prefix), end='')
         for ptr in attr['pointers']:
@@ -191,32 +161,35 @@ def _dump_filename_attribute_datarun(attr, prefix=''):
         print('{}- pointers: None'.format(prefix))
         print('{}- pointers data: None'.format(prefix))
 
-ATTR_FILENAME_HEADER_FORMAT = Struct('<LHHHHHHL')
+ATTR_FILENAME_HEADER = Schema('filename attribute header', [
+    field('size', 'L', 'size', HEX_DEC),
+    field('header_length', 'H', 'header length', HEX_DEC),
+    field('length', 'H', 'filename + attribute type length', HEX_DEC),
+    skip('H'),
+    field('next_struct_offset', 'H', 'next structure offset', HEX_DEC),
+    field('record_rem_data', 'H', 'record remaining data', HEX_DEC),
+    skip('H'),
+    field('type', 'L', 'record type', '{val:#x} (filename attribute)')])
+ATTR_FILENAME_HEADER_FORMAT = ATTR_FILENAME_HEADER.struct
 
 ATTR_TYPE_FILENAME = 0x00010030
 
-def read_filename_attribute(dump, offset):
-    dump.seek(offset, 0)
+def read_filename_attribute(dump, offset, projection=None):
     # TODO: the header should be read in two steps using header_length
-    data = dump.read(ATTR_FILENAME_HEADER_FORMAT.size)
-    fields = ATTR_FILENAME_HEADER_FORMAT.unpack_from(data, 0)
-    attr = {'_absolute_offset': offset,
-            'size': fields[0],
-            'header_length': fields[1],
-            'length': fields[2],
-            'next_struct_offset': fields[4],
-            'record_rem_data': fields[5],
-            'type': fields[7]}
+    attr = ATTR_FILENAME_HEADER.read(dump, offset, {'_absolute_offset': offset})
     f_size = attr['length'] - ATTR_TYPE_SIZE
     if f_size > 0:
-        dump.seek(offset + ATTR_TYPE_OFFSET + ATTR_TYPE_SIZE, 0)
-        fn = dump.read(f_size)
+        fn = bytes(pread(dump, offset + ATTR_TYPE_OFFSET + ATTR_TYPE_SIZE, f_size))
     else:
         fn = 'DEADBEEF'.encode('utf-16le')
     attr['filename'] = fn
+    if not _wants(projection, 'metadata', 'datarun'):
+        return attr
     attr['_offset_metadata'] = attr['next_struct_offset']
     attr['metadata'] = read_filename_attribute_metadata(dump, offset + attr['_offset_metadata'])
     attr['_offset_datarun'] = attr['_offset_metadata'] + attr['metadata']['size']
+    if not _wants(projection, 'datarun'):
+        return attr
     if attr['metadata']['physical_size'] == 0:
         attr['datarun'] = None
     else:
@@ -224,13 +197,8 @@ def read_filename_attribute(dump, offset):
     return attr
 
 def _dump_filename_attribute(attr, prefix=''):
-    print('{}- size: {val:#x} ({val})'.format(prefix, val=attr['size']))
-    print('{}- header length: {val:#x} ({val})'.format(prefix, val=attr['header_length']))
-    print('{}- filename + attribute type length: {val:#x} ({val})'.format(prefix, val=attr['length']))
-    print('{}- next structure offset: {val:#x} ({val})'.format(prefix, val=attr['next_struct_offset']))
-    print('{}- record remaining data: {val:#x} ({val})'.format(prefix, val=attr['record_rem_data']))
-    print('{}- record type: {:#x} (filename attribute)'.format(prefix, attr['type']))
-    print('{}- filename: {}'.format(prefix, attr['filename'].decode('utf-16le')))
+    ATTR_FILENAME_HEADER.dump(attr, prefix + '- ')
+    print('{}- filename: {}'.format(prefix, _utf16(attr['filename'])))
     print('{}- metadata: <{:#x}>'.format(prefix, attr['metadata']['_absolute_offset']))
     _dump_filename_attribute_metadata(attr['metadata'], prefix + '  ')
     if attr['datarun']:
@@ -239,188 +207,138 @@ def _dump_filename_attribute(attr, prefix=''):
     else:
         print('{}- datarun: None'.format(prefix))
 
-ATTR_FILENAME_FOLDER_HEADER_1_FORMAT = Struct('<LHHHHHH')
-ATTR_FILENAME_FOLDER_HEADER_2_FORMAT = Struct('<L')
-ATTR_FILENAME_FOLDER_BODY_FORMAT = Struct('<Q8sQQQQ')
+ATTR_FILENAME_FOLDER_HEADER_1 = Schema('filename folder attribute header', [
+    field('size', 'L', 'size', HEX_DEC),
+    field('offset_identifier', 'H', 'offset of identifier', HEX_DEC),
+    field('header_rem_data', 'H', 'header remaining bytes', HEX_DEC),
+    field('unknown0', 'H', 'unknown field 0', HEX),
+    field('header_length', 'H', 'header length', HEX_DEC),
+    field('record_rem_data', 'H', 'record remaining data', HEX_DEC),
+    field('unknown1', 'H', 'unknown field 1', HEX)])
+ATTR_FILENAME_FOLDER_HEADER_2 = Schema('filename folder attribute type', [
+    field('type', 'L', 'type', '{val:#x} (filename folder attribute)')])
+ATTR_FILENAME_FOLDER_BODY = Schema('filename folder attribute body', [
+    field('nodeid', 'Q', 'node identifier', HEX),
+    skip('8s')] + _timestamps())
+ATTR_FILENAME_FOLDER_HEADER_1_FORMAT = ATTR_FILENAME_FOLDER_HEADER_1.struct
+ATTR_FILENAME_FOLDER_HEADER_2_FORMAT = ATTR_FILENAME_FOLDER_HEADER_2.struct
+ATTR_FILENAME_FOLDER_BODY_FORMAT = ATTR_FILENAME_FOLDER_BODY.struct
 
 ATTR_TYPE_FILENAME_FOLDER   = 0x00020030
 
-def read_filename_folder_attribute(dump, offset):
-    dump.seek(offset, 0)
-    data = dump.read(ATTR_FILENAME_FOLDER_HEADER_1_FORMAT.size)
-    fields = ATTR_FILENAME_FOLDER_HEADER_1_FORMAT.unpack_from(data, 0)
-    attr = {'_absolute_offset': offset,
-            'size': fields[0],
-            'offset_identifier': fields[1],
-            'header_rem_data': fields[2],
-            'unknown0': fields[3],
-            'header_length': fields[4],
-            'record_rem_data': fields[5],
-            'unknown1': fields[6]}
-    dump.seek(offset + attr['offset_identifier'], 0)
-    data = dump.read(ATTR_FILENAME_FOLDER_HEADER_2_FORMAT.size)
-    fields = ATTR_FILENAME_FOLDER_HEADER_2_FORMAT.unpack_from(data, 0)
-    attr['type'] = fields[0]
+def read_filename_folder_attribute(dump, offset, projection=None):
+    attr = ATTR_FILENAME_FOLDER_HEADER_1.read(dump, offset, {'_absolute_offset': offset})
+    ATTR_FILENAME_FOLDER_HEADER_2.read(dump, offset + attr['offset_identifier'], attr)
     # f_size = attr['header_length'] - (attr['offset_identifier'] + ATTR_TYPE_SIZE)
     f_size = attr['header_rem_data'] - ATTR_TYPE_SIZE
     if f_size > 0:
-        dump.seek(offset + attr['offset_identifier'] + ATTR_TYPE_SIZE, 0)
-        fn = dump.read(f_size)
+        fn = bytes(pread(dump, offset + attr['offset_identifier'] + ATTR_TYPE_SIZE, f_size))
     else:
         fn = 'DEADBEEF'.encode('utf-16le')
     attr['foldername'] = fn
-    dump.seek(offset + attr['header_length'], 0)
-    data = dump.read(ATTR_FILENAME_FOLDER_BODY_FORMAT.size)
-    fields = ATTR_FILENAME_FOLDER_BODY_FORMAT.unpack_from(data, 0)
-    attr['nodeid'] = fields[0]
-    attr['created'] = fields[2]
-    attr['modified'] = fields[3]
-    attr['metadata_modified'] = fields[4]
-    attr['last_accessed'] = fields[5]
-    return attr
+    if not _wants(projection, 'nodeid', 'created', 'modified', 'metadata_modified', 'last_accessed'):
+        return attr
+    return ATTR_FILENAME_FOLDER_BODY.read(dump, offset + attr['header_length'], attr)
 
 def _dump_filename_folder_attribute(attr, prefix=''):
-    print('{}- size: {val:#x} ({val})'.format(prefix, val=attr['size']))
-    print('{}- offset of identifier: {val:#x} ({val})'.format(prefix, val=attr['offset_identifier']))
-    print('{}- header remaining bytes: {val:#x} ({val})'.format(prefix, val=attr['header_rem_data']))
-    print('{}- unknown field 0: {:#x}'.format(prefix, attr['unknown0']))
-    print('{}- header length: {val:#x} ({val})'.format(prefix, val=attr['header_length']))
-    print('{}- record remaining data: {val:#x} ({val})'.format(prefix, val=attr['record_rem_data']))
-    print('{}- unknown field 1: {:#x}'.format(prefix, attr['unknown1']))
-    print('{}- type: {:#x} (filename folder attribute)'.format(prefix, attr['type']))
-    print('{}- foldername: {}'.format(prefix, attr['foldername'].decode('utf-16le')))
-    print('{}- node identifier: {:#x}'.format(prefix, attr['nodeid']))
-    print('{}- created: {} ({:#x})'.format(prefix, bytes2time(attr['created']), attr['created']))
-    print('{}- modified: {} ({:#x})'.format(prefix, bytes2time(attr['modified']), attr['modified']))
-    print('{}- metadata modified: {} ({:#x})'.format(prefix, bytes2time(attr['metadata_modified']),
-                                                     attr['metadata_modified']))
-    print('{}- last accessed: {} ({:#x})'.format(prefix, bytes2time(attr['last_accessed']),
-                                                 attr['last_accessed']))
-
-ATTR_CHILD_HEADER_FORMAT = Struct('<LHH2sHH2sL4sL4sQ8sHH')
+    ATTR_FILENAME_FOLDER_HEADER_1.dump(attr, prefix + '- ')
+    ATTR_FILENAME_FOLDER_HEADER_2.dump(attr, prefix + '- ')
+    print('{}- foldername: {}'.format(prefix, _utf16(attr['foldername'])))
+    ATTR_FILENAME_FOLDER_BODY.dump(attr, prefix + '- ')
+
+ATTR_CHILD_HEADER = Schema('child attribute header', [
+    field('size', 'L', 'size', HEX_DEC),
+    field('offset_identifier', 'H', 'offset identifier', HEX_DEC),
+    field('header_rem_data', 'H', 'header remaining data', HEX_DEC),
+    skip('2s'),
+    field('header_length', 'H', 'header length', HEX_DEC),
+    field('record_rem_data', 'H', 'record remaining data', HEX_DEC),
+    skip('2s'),
+    field('type', 'L', 'record type', '{val:#x} (child attribute)'),
+    skip('4s'),
+    field('parentid', 'L', 'parent id', HEX),
+    skip('4s'),
+    field('childid', 'Q', 'child id', HEX),
+    skip('8s'),
+    field('000c', 'H', '0x000c', '{val:#06x}'),
+    field('length_name', 'H')])
+ATTR_CHILD_HEADER_FORMAT = ATTR_CHILD_HEADER.struct
 
 ATTR_TYPE_CHILD    = 0x80000020
 
 def read_child_attribute(dump, offset):
-    dump.seek(offset, 0)
-    data = dump.read(ATTR_CHILD_HEADER_FORMAT.size)
-    data_fields = ATTR_CHILD_HEADER_FORMAT.unpack_from(data, 0)
-    attr = {'_absolute_offset': offset,
-            'size': data_fields[0],
-            'offset_identifier': data_fields[1],
-            'header_rem_data': data_fields[2],
-            'header_length': data_fields[4],
-            'record_rem_data': data_fields[5],
-            'type': data_fields[7],
-            'parentid': data_fields[9],
-            'childid': data_fields[11],
-            '000c': data_fields[13],
-            'length_name': data_fields[14]}
-    fn = dump.read(attr['length_name'])
+    attr = ATTR_CHILD_HEADER.read(dump, offset, {'_absolute_offset': offset})
+    fn = bytes(pread(dump, offset + ATTR_CHILD_HEADER.size, attr['length_name']))
     attr['filename'] = fn
     return attr
 
 def _dump_child_attribute(attr, prefix=''):
-    print('{}- size: {val:#x} ({val})'.format(prefix, val=attr['size']))
-    print('{}- offset identifier: {val:#x} ({val})'.format(prefix, val=attr['offset_identifier']))
-    print('{}- header remaining data: {val:#x} ({val})'.format(prefix, val=attr['header_rem_data']))
-    print('{}- header length: {val:#x} ({val})'.format(prefix, val=attr['header_length']))
-    print('{}- record remaining data: {val:#x} ({val})'.format(prefix, val=attr['record_rem_data']))
-    print('{}- record type: {:#x} (child attribute)'.format(prefix, attr['type']))
-    print('{}- parent id: {:#x}'.format(prefix, attr['parentid']))
-    print('{}- child id: {:#x}'.format(prefix, attr['childid']))
-    print('{}- 0x000c: {:#06x}'.format(prefix, attr['000c']))
-    print('{}- filename: {}'.format(prefix, attr['filename'].decode('utf-16le')))
-
-ATTR_DIR_METADATA_HEADER_FORMAT = Struct('<LHHHHHH')
-ATTR_DIR_METADATA_HEADER_2_FORMAT = Struct('<L')
-ATTR_DIR_METADATA_BODY_FORMAT = Struct('<LH34sQQQQ8sQ')
-ATTR_DIR_METADATA_PSEC_FORMAT = Struct('<L12sLLL')
+    ATTR_CHILD_HEADER.dump(attr, prefix + '- ')
+    print('{}- filename: {}'.format(prefix, _utf16(attr['filename'])))
+
+ATTR_DIR_METADATA_HEADER = Schema('directory metadata attribute header', [
+    field('size', 'L', 'size', HEX_DEC),
+    field('offset_identifier', 'H', 'offset type identifier', HEX_DEC),
+    field('header_rem_data', 'H', 'header remaining bytes', HEX_DEC),
+    skip('H'),
+    field('header_length', 'H', 'header length/offset metadata', HEX_DEC),
+    field('record_rem_data', 'H', 'record remaining data', HEX_DEC),
+    skip('H')])
+ATTR_DIR_METADATA_HEADER_2 = Schema('directory metadata attribute type', [
+    field('type', 'L', 'type', '{val:#x} (directory metadata attribute)')])
+ATTR_DIR_METADATA_BODY = Schema('directory metadata attribute body', [
+    field('body_length', 'L', 'length', HEX_DEC),
+    field('offset_first_timestamp', 'H', 'offset_first_timestamp', HEX_DEC),
+    skip('34s')] + _timestamps() + [
+    skip('8s'),
+    field('nodeid', 'Q', 'node id', HEX)])
+ATTR_DIR_METADATA_PSEC = Schema('directory metadata pointers section', [
+    field('psec_length', 'L', 'length', HEX_DEC),
+    skip('12s'),
+    field('offset_first_pointer', 'L', 'offset to first pointer', HEX),
+    field('num_pointers', 'L', 'number of pointers'),
+    field('offset_end_pointers_area?', 'L', 'offset end pointers area(?)', HEX_DEC)])
+ATTR_DIR_METADATA_HEADER_FORMAT = ATTR_DIR_METADATA_HEADER.struct
+ATTR_DIR_METADATA_HEADER_2_FORMAT = ATTR_DIR_METADATA_HEADER_2.struct
+ATTR_DIR_METADATA_BODY_FORMAT = ATTR_DIR_METADATA_BODY.struct
+ATTR_DIR_METADATA_PSEC_FORMAT = ATTR_DIR_METADATA_PSEC.struct
 
 ATTR_TYPE_DIRECTORY_METADATA = 0x00000010
 
-def read_directory_metadata_attribute(dump, offset):
-    dump.seek(offset)
-    data = dump.read(ATTR_DIR_METADATA_HEADER_FORMAT.size)
-    fields = ATTR_DIR_METADATA_HEADER_FORMAT.unpack_from(data, 0)
-    attr = {'_absolute_offset': offset,
-            'size': fields[0],
-            'offset_identifier': fields[1],
-            'header_rem_data': fields[2],
-            'header_length': fields[4],
-            'record_rem_data': fields[5],
-            '_structure_size': fields[0]}
-    dump.seek(offset + attr['offset_identifier'])
-    data = dump.read(ATTR_DIR_METADATA_HEADER_2_FORMAT.size)
-    fields = ATTR_DIR_METADATA_HEADER_2_FORMAT.unpack_from(data, 0)
-    attr['type'] = fields[0]
-    dump.seek(offset + attr['header_length'])
-    data = dump.read(ATTR_DIR_METADATA_BODY_FORMAT.size)
-    fields = ATTR_DIR_METADATA_BODY_FORMAT.unpack_from(data, 0)
+def read_directory_metadata_attribute(dump, offset, projection=None):
+    attr = ATTR_DIR_METADATA_HEADER.read(dump, offset, {'_absolute_offset': offset})
+    attr['_structure_size'] = attr['size']
+    ATTR_DIR_METADATA_HEADER_2.read(dump, offset + attr['offset_identifier'], attr)
+    if not _wants(projection, 'created', 'modified', 'metadata_modified', 'last_accessed',
+                  'nodeid', 'pointers', 'pointers_data'):
+        return attr
     attr['_offset_body'] = attr['header_length']
-    attr['body_length'] = fields[0]
-    attr['offset_first_timestamp'] = fields[1]
-    attr['created'] = fields[3]
-    attr['modified'] = fields[4]
-    attr['metadata_modified'] = fields[5]
-    attr['last_accessed'] = fields[6]
-    attr['nodeid'] = fields[8]
+    ATTR_DIR_METADATA_BODY.read(dump, offset + attr['_offset_body'], attr)
+    if not _wants(projection, 'pointers', 'pointers_data'):
+        return attr
     attr['_offset_psec'] = attr['_offset_body'] + attr['body_length']
-    dump.seek(offset + attr['_offset_psec'], 0)
-    data = dump.read(ATTR_DIR_METADATA_PSEC_FORMAT.size)
-    fields = ATTR_DIR_METADATA_PSEC_FORMAT.unpack_from(data, 0)
-    attr['psec_length'] = fields[0]
-    attr['offset_first_pointer'] = fields[2]
-    attr['num_pointers'] = fields[3]
-    attr['offset_end_pointers_area?'] = fields[4]
+    ATTR_DIR_METADATA_PSEC.read(dump, offset + attr['_offset_psec'], attr)
     if attr['num_pointers']:
-        pointers_format = Struct('<' + ('L' * attr['num_pointers']))
-        dump.seek(offset + attr['_offset_psec'] + attr['offset_first_pointer'], 0)
-        data = dump.read(pointers_format.size)
-        fields = pointers_format.unpack_from(data, 0)
-        attr['pointers'] = fields
+        attr['pointers'] = read_array(dump, offset + attr['_offset_psec'] +
+                                      attr['offset_first_pointer'], attr['num_pointers'])
         attr['pointers_data'] = []
     else:
         attr['pointers'] = None
         attr['pointers_data'] = None
     attr['_offset_rec_area'] = attr['_offset_psec'] + attr['psec_length']
-    rec_offset = attr['_offset_rec_area']
-    for ptr in attr['pointers']:
+    for ptr in attr['pointers'] or ():
         ptr_addr = offset + attr['_offset_psec'] + ptr
         attr['pointers_data'].append(read_directory_metadata_subattribute(dump, ptr_addr))
     return attr
 
 def _dump_directory_metadata_attribute(attr, prefix=''):
-    print('{}- size: {val:#x} ({val})'.format(prefix, val=attr['size']))
-    print('{}- offset type identifier: {val:#x} ({val})'.format(prefix,
-                                                                val=attr['offset_identifier']))
-    print('{}- header remaining bytes: {val:#x} ({val})'.format(prefix,
-                                                                val=attr['header_rem_data']))
-    print('{}- header length/offset metadata: {val:#x} ({val})'.format(prefix,
-                                                                       val=attr['header_length']))
-    print('{}- record remaining data: {val:#x} ({val})'.format(prefix,
-                                                               val=attr['record_rem_data']))
-    print('{}- type: {:#x} (directory metadata attribute)'.format(prefix, attr['type']))
+    ATTR_DIR_METADATA_HEADER.dump(attr, prefix + '- ')
+    ATTR_DIR_METADATA_HEADER_2.dump(attr, prefix + '- ')
     print('{}- body: <{:#x}>'.format(prefix, attr['_absolute_offset'] + attr['_offset_body']))
-    print('{}  - length: {val:#x} ({val})'.format(prefix, val=attr['body_length']))
-    print('{}  - offset_first_timestamp: {val:#x} ({val})'.format(prefix,
-                                                                  val=attr['offset_first_timestamp']))
-    print('{}  - created: {} ({:#x})'.format(prefix, bytes2time(attr['created']), attr['created']))
-    print('{}  - modified: {} ({:#x})'.format(prefix, bytes2time(attr['modified']),
-                                                                      attr['modified']))
-    print('{}  - metadata modified: {} ({:#x})'.format(prefix,
-                                                       bytes2time(attr['metadata_modified']),
-                                                       attr['metadata_modified']))
-    print('{}  - last accessed: {} ({:#x})'.format(prefix, bytes2time(attr['last_accessed']),
-                                                   attr['last_accessed']))
-    print('{}  - node id: {:#x}'.format(prefix, attr['nodeid']))
+    ATTR_DIR_METADATA_BODY.dump(attr, prefix + '  - ')
     print('{}- pointers section: <{:#x}>'.format(prefix,
                                                  attr['_absolute_offset'] + attr['_offset_psec']))
-    print('{}  - length: {val:#x} ({val})'.format(prefix, val=attr['psec_length']))
-    print('{}  - offset to first pointer: {:#x}'.format(prefix, attr['offset_first_pointer']))
-    print('{}  - number of pointers: {}'.format(prefix, attr['num_pointers']))
-    print('{}  - offset end pointers area(?): {val:#x} ({val})'.format(prefix,
-        val=attr['offset_end_pointers_area?']))
+    ATTR_DIR_METADATA_PSEC.dump(attr, prefix + '  - ')
     print('{}  - pointers:'.format(prefix), end='')
     if attr['pointers']:
         for ptr in attr['pointers']:
@@ -434,117 +352,76 @@ def _dump_directory_metadata_attribute(attr, prefix=''):
         print(' None')
         print('{}  - pointers data: None'.format(prefix))
 
-DM_SUBATTR_SI30_HEADER_FORMAT = Struct('<LHHHHLLLL8s')
+def _dm_subattribute_header(type_name):
+    """Fields of the header of the subattributes of the directory metadata
+    attributes, type_name being printed after their type."""
+    return [field('size', 'L', 'size', HEX_DEC),
+            field('unknown0', 'H', 'unknown field 0', HEX_DEC),
+            field('header_rem_data', 'H', 'header remaining bytes', HEX_DEC),
+            skip('H'),
+            field('header_length', 'H', 'header length', HEX_DEC),
+            field('record_rem_data', 'L', 'record remaining data', HEX_DEC),
+            field('record_rem_data_copy', 'L', 'record remaining data (copy?)', HEX_DEC),
+            field('unknown1', 'L', 'unknown field 1', HEX_DEC),
+            field('type', 'L', 'type', '{val:#x} (' + type_name + ')')]
+
+DM_SUBATTR_SI30_HEADER = Schema('$I30 subattribute header',
+                                _dm_subattribute_header('$I30 type') + [
+    field('$I30', '8s', '$I30 string', _utf16)])
+DM_SUBATTR_SI30_HEADER_FORMAT = DM_SUBATTR_SI30_HEADER.struct
 
 DM_SUBATTR_TYPE_SI30 = 0x00000090
 
 def read_dm_si30_subattribute(dump, offset):
-    dump.seek(offset)
-    data = dump.read(DM_SUBATTR_SI30_HEADER_FORMAT.size)
-    fields = DM_SUBATTR_SI30_HEADER_FORMAT.unpack_from(data, 0)
-    attr = {'_absolute_offset': offset,
-            'size': fields[0],
-            'unknown0': fields[1],
-            'header_rem_data': fields[2],
-            'header_length': fields[4],
-            'record_rem_data': fields[5],
-            'record_rem_data_copy': fields[6],
-            'unknown1': fields[7],
-            'type': fields[8],
-            '$I30': fields[9],
-            '_structure_size': fields[0]}
-    dump.seek(offset + attr['header_length'])
+    attr = DM_SUBATTR_SI30_HEADER.read(dump, offset, {'_absolute_offset': offset})
+    attr['_structure_size'] = attr['size']
     # TODO: find what is at the end of the $I30
     return attr
 
 def _dump_dm_si30_subattribute(attr, prefix=''):
-    print('{}- size: {val:#x} ({val})'.format(prefix, val=attr['size']))
-    print('{}- unknown field 0: {val:#x} ({val})'.format(prefix, val=attr['unknown0']))
-    print('{}- header remaining bytes: {val:#x} ({val})'.format(prefix, val=attr['header_rem_data']))
-    print('{}- header length: {val:#x} ({val})'.format(prefix, val=attr['header_length']))
-    print('{}- record remaining data: {val:#x} ({val})'.format(prefix, val=attr['record_rem_data']))
-    print('{}- record remaining data (copy?): {val:#x} ({val})'.format(prefix,
-                                                                       val=attr['record_rem_data_copy']))
-    print('{}- unknown field 1: {val:#x} ({val})'.format(prefix, val=attr['unknown1']))
-    print('{}- type: {:#x} ($I30 type)'.format(prefix, attr['type']))
-    print('{}- $I30 string: {}'.format(prefix, attr['$I30'].decode('utf-16le')))
-
-DM_SUBATTR_FOLDER_HEADER_FORMAT = Struct('<LHHHHHH')
-DM_SUBATTR_FOLDER_HEADER_2_FORMAT = Struct('<L')
-DM_SUBATTR_FOLDER_HEADER_FORMAT = Struct('<LHHHHLLLL8s')
-
-DM_SUBATTR_FOLDER_BODY_FORMAT = Struct('<LLHHQQQQQQ24sH')
+    DM_SUBATTR_SI30_HEADER.dump(attr, prefix + '- ')
+
+DM_SUBATTR_FOLDER_HEADER = Schema('folder subattribute header',
+                                  _dm_subattribute_header('directory metadata folder type') + [
+    skip('8s')])
+DM_SUBATTR_FOLDER_BODY = Schema('folder subattribute body', [
+    skip('L'),
+    skip('L'),
+    skip('H'),
+    skip('H'),
+    field('parentid', 'Q', 'parent node id', HEX),
+    skip('Q')] + _timestamps() + [
+    skip('24s'),
+    field('name_size', 'H', 'folder name size', HEX_DEC)])
+DM_SUBATTR_FOLDER_HEADER_FORMAT = DM_SUBATTR_FOLDER_HEADER.struct
+DM_SUBATTR_FOLDER_BODY_FORMAT = DM_SUBATTR_FOLDER_BODY.struct
 
 DM_SUBATTR_TYPE_FOLDER = 0x00000038
 
 def read_dm_folder_subattribute(dump, offset):
-    dump.seek(offset)
-    data = dump.read(DM_SUBATTR_FOLDER_HEADER_FORMAT.size)
-    fields = DM_SUBATTR_FOLDER_HEADER_FORMAT.unpack_from(data, 0)
-    attr = {'_absolute_offset': offset,
-            'size': fields[0],
-            'unknown0': fields[1],
-            'header_rem_data': fields[2],
-            'header_length': fields[4],
-            'record_rem_data': fields[5],
-            'record_rem_data_copy': fields[6],
-            'unknown1': fields[7],
-            'type': fields[8],
-            '_structure_size': fields[0]}
-    dump.seek(offset + attr['header_length'])
-    data = dump.read(DM_SUBATTR_FOLDER_BODY_FORMAT.size)
-    fields = DM_SUBATTR_FOLDER_BODY_FORMAT.unpack_from(data, 0)
-    attr['parentid'] = fields[4]
-    attr['created'] = fields[6]
-    attr['modified'] = fields[7]
-    attr['metadata_modified'] = fields[8]
-    attr['last_accessed'] = fields[9]
-    attr['name_size'] = fields[11]
-    dump.seek(offset + attr['header_length'] + 0x5e)
-    data = dump.read(attr['name_size'] * 2)
-    attr['name'] = data
+    attr = DM_SUBATTR_FOLDER_HEADER.read(dump, offset, {'_absolute_offset': offset})
+    attr['_structure_size'] = attr['size']
+    DM_SUBATTR_FOLDER_BODY.read(dump, offset + attr['header_length'], attr)
+    data = pread(dump, offset + attr['header_length'] + 0x5e, attr['name_size'] * 2)
+    attr['name'] = bytes(data)
     return attr
 
 def _dump_dm_folder_subattribute(attr, prefix=''):
-    print('{}- size: {val:#x} ({val})'.format(prefix, val=attr['size']))
-    print('{}- unknown field 0: {val:#x} ({val})'.format(prefix, val=attr['unknown0']))
-    print('{}- header remaining bytes: {val:#x} ({val})'.format(prefix, val=attr['header_rem_data']))
-    print('{}- header length: {val:#x} ({val})'.format(prefix, val=attr['header_length']))
-    print('{}- record remaining data: {val:#x} ({val})'.format(prefix, val=attr['record_rem_data']))
-    print('{}- record remaining data (copy?): {val:#x} ({val})'.format(prefix,
-                                                                       val=attr['record_rem_data_copy']))
-    print('{}- unknown field 1: {val:#x} ({val})'.format(prefix, val=attr['unknown1']))
-    print('{}- type: {:#x} (directory metadata folder type)'.format(prefix, attr['type']))
-    print('{}- parent node id: {:#x}'.format(prefix, attr['parentid']))
-    print('{}- created: {} ({:#x})'.format(prefix, bytes2time(attr['created']), attr['created']))
-    print('{}- modified: {} ({:#x})'.format(prefix, bytes2time(attr['modified']), attr['modified']))
-    print('{}- metadata modified: {} ({:#x})'.format(prefix, bytes2time(attr['metadata_modified']),
-                                                     attr['metadata_modified']))
-    print('{}- last accessed: {} ({:#x})'.format(prefix, bytes2time(attr['last_accessed']),
-                                                 attr['last_accessed']))
-    print('{}- folder name size: {val:#x} ({val})'.format(prefix, val=attr['name_size']))
-    print('{}- folder name: {}'.format(prefix, attr['name'].decode('utf-16le')))
-
-DM_SUBATTR_HEADER_FORMAT = Struct('<LHHHHLLLLL')
+    DM_SUBATTR_FOLDER_HEADER.dump(attr, prefix + '- ')
+    DM_SUBATTR_FOLDER_BODY.dump(attr, prefix + '- ')
+    print('{}- folder name: {}'.format(prefix, _utf16(attr['name'])))
+
+DM_SUBATTR_HEADER = Schema('directory metadata subattribute header',
+                           _dm_subattribute_header('unknown type') + [
+    skip('L')])
+DM_SUBATTR_HEADER_FORMAT = DM_SUBATTR_HEADER.struct
 
 def read_directory_metadata_subattribute(dump, offset):
-    dump.seek(offset, 0)
-    data = dump.read(DM_SUBATTR_HEADER_FORMAT.size)
-    header = DM_SUBATTR_HEADER_FORMAT.unpack_from(data, 0)
-    if header[8] == DM_SUBATTR_TYPE_SI30:
+    attr = DM_SUBATTR_HEADER.read(dump, offset, {'_absolute_offset': offset})
+    if attr['type'] == DM_SUBATTR_TYPE_SI30:
         attr = read_dm_si30_subattribute(dump, offset)
-    elif header[8] == DM_SUBATTR_TYPE_FOLDER:
+    elif attr['type'] == DM_SUBATTR_TYPE_FOLDER:
         attr = read_dm_folder_subattribute(dump, offset)
-    else:
-        attr = {'_absolute_offset': offset,
-                'size': header[0],
-                'unknown0': header[1],
-                'header_rem_data': header[2],
-                'header_length': header[4],
-                'record_rem_data': header[5],
-                'record_rem_data_copy': header[6],
-                'unknown1': header[7],
-                'type': header[8]}
     return attr
 
 def _dump_directory_metadata_subattribute(attr, prefix=''):
@@ -553,44 +430,40 @@ def _dump_directory_metadata_subattribute(attr, prefix=''):
     elif attr['type'] == DM_SUBATTR_TYPE_FOLDER:
         _dump_dm_folder_subattribute(attr, prefix)
     else:
-        print('{}- size: {val:#x} ({val})'.format(prefix, val=attr['size']))
-        print('{}- unknown field 0: {val:#x} ({val})'.format(prefix, val=attr['unknown0']))
-        print('{}- header remaining bytes: {val:#x} ({val})'.format(prefix,
-                                                                    val=attr['header_rem_data']))
-        print('{}- header length: {val:#x} ({val})'.format(prefix, val=attr['header_length']))
-        print('{}- record remaining data: {val:#x} ({val})'.format(prefix,
-                                                                    val=attr['record_rem_data']))
-        print('{}- record remaining data (copy?): {val:#x} ({val})'.format(prefix,
-                                                                    val=attr['record_rem_data_copy']))
-        print('{}- unknown field 1: {val:#x} ({val})'.format(prefix, val=attr['unknown1']))
-        print('{}- type: {:#x} (unknown type)'.format(prefix, attr['type']))
-
-ATTR_HEADER_FORMAT = Struct('<LHHHHHH')
-ATTR_HEADER_2_FORMAT = Struct('<L')
-
-def read_attribute(dump, offset):
-    dump.seek(offset, 0)
-    data = dump.read(ATTR_HEADER_FORMAT.size)
-    header1 = ATTR_HEADER_FORMAT.unpack_from(data, 0)
-    dump.seek(offset + header1[1], 0)
-    data = dump.read(ATTR_HEADER_2_FORMAT.size)
-    header2 = ATTR_HEADER_2_FORMAT.unpack_from(data, 0)
-    if header2[0] == ATTR_TYPE_FILENAME:
-        attr = read_filename_attribute(dump, offset)
-    elif header2[0] == ATTR_TYPE_FILENAME_FOLDER:
-        attr = read_filename_folder_attribute(dump, offset)
-    elif header2[0] == ATTR_TYPE_CHILD:
+        DM_SUBATTR_HEADER.dump(attr, prefix + '- ')
+
+ATTR_HEADER = Schema('attribute header', [
+    field('size', 'L', 'size', HEX_DEC),
+    field('offset_identifier', 'H', 'offset type identifier', HEX_DEC),
+    field('header_rem_data', 'H', 'header remaining bytes', HEX_DEC),
+    skip('H'),
+    field('header_length', 'H', 'header length', HEX_DEC),
+    field('record_rem_data', 'H', 'record remaining data', HEX_DEC),
+    skip('H')])
+ATTR_HEADER_2 = Schema('attribute type', [
+    field('type', 'L', 'type', '{val:#x} (unknown type)')])
+ATTR_HEADER_FORMAT = ATTR_HEADER.struct
+ATTR_HEADER_2_FORMAT = ATTR_HEADER_2.struct
+
+def read_attribute(dump, offset, projection=None):
+    """Read the attribute at offset according to its type. If projection
+    (set of fields) is given, the attribute is only decoded up to the
+    fields it holds: e.g. {'filename'} skips the metadata and the dataruns of
+    the filename attributes."""
+    attr = ATTR_HEADER.read(dump, offset, {'_absolute_offset': offset})
+    # decode the attribute from memory, unless it already is in memory
+    # (e.g. read as part of its entryblock)
+    dump = read_block(dump, offset, min(max(attr['size'], ATTR_HEADER.size),
+                                        ATTR_MAX_READ_SIZE))
+    ATTR_HEADER_2.read(dump, offset + attr['offset_identifier'], attr)
+    if attr['type'] == ATTR_TYPE_FILENAME:
+        attr = read_filename_attribute(dump, offset, projection)
+    elif attr['type'] == ATTR_TYPE_FILENAME_FOLDER:
+        attr = read_filename_folder_attribute(dump, offset, projection)
+    elif attr['type'] == ATTR_TYPE_CHILD:
         attr = read_child_attribute(dump, offset)
-    elif header2[0] == ATTR_TYPE_DIRECTORY_METADATA:
-        attr = read_directory_metadata_attribute(dump, offset)
-    else:
-        attr = {'_absolute_offset': offset,
-                'size': header1[0],
-                'offset_identifier': header1[1],
-                'header_rem_data': header1[2],
-                'header_length': header1[4],
-                'record_rem_data': header1[5],
-                'type': header2[0]}
+    elif attr['type'] == ATTR_TYPE_DIRECTORY_METADATA:
+        attr = read_directory_metadata_attribute(dump, offset, projection)
     return attr
 
 def dump_attribute(attr, prefix=''):
@@ -603,12 +476,5 @@ def dump_attribute(attr, prefix=''):
     elif attr['type'] == ATTR_TYPE_DIRECTORY_METADATA:
         _dump_directory_metadata_attribute(attr, prefix)
     else:
-        print('{}- size: {val:#x} ({val})'.format(prefix, val=attr['size']))
-        print('{}- offset type identifier: {val:#x} ({val})'.format(prefix,
-                                                                    val=attr['offset_identifier']))
-        print('{}- header remaining bytes: {val:#x} ({val})'.format(prefix,
-                                                                    val=attr['header_rem_data']))
-        print('{}- header length: {val:#x} ({val})'.format(prefix, val=attr['header_length']))
-        print('{}- record remaining data: {val:#x} ({val})'.format(prefix,
-                                                                    val=attr['record_rem_data']))
-        print('{}- type: {:#x} (unknown type)'.format(prefix, attr['type']))
+        ATTR_HEADER.dump(attr, prefix + '- ')
+        ATTR_HEADER_2.dump(attr, prefix + '- ')
@@ -1,5 +1,6 @@
-from struct import Struct
 import part.refs.attribute as rattr
+from media.image import pread, read_block
+from util.schema import Schema, field, skip, read_array, HEX, HEX_DEC
 
 SECTOR_SIZE = 512
 ENTRYBLOCK_SIZE = 16 * 1024
@@ -13,140 +14,251 @@ EB_OWN_OFFSET_SIZE = 4
 EB_LENGTH_OWN_OFFSET_SIZE = 4
 EB_NUM_POINTERS_EXTENT_SIZE = 4
 
-EB_HEADER_FORMAT = Struct('<QQ8sQ16s')
-EB_NODE_DESC_FORMAT = Struct('<L20sH6sL')
-EB_NODE_HEADER_FORMAT = Struct('<LLLLLLQ')
+EB_HEADER = Schema('entryblock header', [
+    field('eb_number', 'Q', 'entryblock number', HEX),
+    field('counter', 'Q', 'counter'),
+    skip('8s'),
+    field('node_id', 'Q', 'node id', HEX),
+    skip('16s')])
+EB_NODE_DESC = Schema('node descriptor', [
+    field('node_desc_length', 'L', 'node descriptor length', HEX_DEC),
+    skip('20s'),
+    field('num_extents', 'H', 'number of extents'),
+    skip('6s'),
+    field('num_records', 'L', 'number of records')])
+# the offsets to the first pointer and to the end of the node are printed
+# with the entryblock offsets they point to
+EB_NODE_HEADER = Schema('node header', [
+    field('header_length', 'L', 'node header length', HEX_DEC),
+    field('offset_free_record', 'L', 'offset to next free record', HEX_DEC),
+    field('free_space', 'L', 'free space in node', HEX_DEC),
+    field('header_unknown', 'L', 'node header unknown', HEX_DEC),
+    field('offset_first_pointer', 'L'),
+    field('num_pointers', 'L', 'number of pointers in node'),
+    field('offset_end_node', 'Q')])
 
-EB_EXTENT_TABLE_FORMAT = Struct('<LLLLLLLL')
+EB_EXTENT_TABLE = Schema('extent table', [
+    field('extent_table_length', 'L', 'extent table length', HEX_DEC),
+    field('extent_table_unknown0', 'L', 'extent table unknown 0', HEX_DEC),
+    field('extent_table_unknown1', 'L', 'extent table unknown 1', HEX_DEC),
+    field('extent_table_unknown2', 'L', 'extent table unknown 2', HEX_DEC),
+    field('offset_first_extent_pointer', 'L', 'offset to first extent pointer', HEX_DEC),
+    field('num_extent_pointers', 'L', 'number of extent pointers'),
+    field('offset_end_of_extent_pointers', 'L', 'offset en of extent pointers', HEX_DEC),
+    field('extent_table_unknown3', 'L', 'extent table unknown 3', HEX_DEC)])
 
-def is_entryblock(dump, offset, vbr_offset, block_size = 16 * 1024):
-    dump.seek(offset, 0)
-    data = dump.read(EB_HEADER_FORMAT.size)
-    eb_num = EB_HEADER_FORMAT.unpack_from(data, 0)
-    return (offset - vbr_offset) / block_size == eb_num[0]
+EB_HEADER_FORMAT = EB_HEADER.struct
+EB_NODE_DESC_FORMAT = EB_NODE_DESC.struct
+EB_NODE_HEADER_FORMAT = EB_NODE_HEADER.struct
+EB_EXTENT_TABLE_FORMAT = EB_EXTENT_TABLE.struct
+
+def is_entryblock_number(eb_num, offset, vbr_offset, block_size = 16 * 1024):
+    return (offset - vbr_offset) / block_size == eb_num
     # return eb_num != 0
 
-def read_entryblock(dump, offset):
-    dump.seek(offset, 0)
-    data = dump.read(EB_HEADER_FORMAT.size)
-    fields = EB_HEADER_FORMAT.unpack_from(data, 0)
-    eb = {'_absolute_offset': offset,
-          'eb_number': fields[0],
-          'counter': fields[1],
-          'node_id': fields[3]}
-    eb['_structure_size'] = EB_HEADER_FORMAT.size
-    data = dump.read(EB_NODE_DESC_FORMAT.size)
-    fields = EB_NODE_DESC_FORMAT.unpack_from(data, 0)
-    eb['node_desc_length'] = fields[0]
-    if eb['node_desc_length'] != 0x08:
-        eb['num_extents'] = fields[2]
-        eb['num_records'] = fields[4]
-    eb['_structure_size'] = (eb['_structure_size'] +
-                             eb['node_desc_length'])
-    eb['_contains_records'] = False
-    eb['_contains_extents'] = False
-    if (eb['node_desc_length'] == 0x08 or
-            eb['num_extents'] == 0):
-        eb['_contains_records'] = True
-        eb['node_header_offset'] = eb['_structure_size']
-        dump.seek(offset + eb['_structure_size'], 0)
-        data = dump.read(EB_NODE_HEADER_FORMAT.size)
-        fields = EB_NODE_HEADER_FORMAT.unpack_from(data, 0)
-        eb['header_length'] = fields[0]
-        eb['offset_free_record'] = fields[1]
-        eb['free_space'] = fields[2]
-        eb['header_unknown'] = fields[3]
-        eb['offset_first_pointer'] = fields[4]
-        eb['num_pointers'] = fields[5]
-        eb['offset_end_node'] = fields[6]
-        if eb['num_pointers']:
-            pointers_format = Struct('<' + ('L' * eb['num_pointers']))
-            dump.seek(offset + eb['node_header_offset'] + eb['offset_first_pointer'], 0)
-            data = dump.read(pointers_format.size)
-            fields = pointers_format.unpack_from(data, 0)
-            eb['pointers'] = fields
-            eb['pointers_data'] = []
-            for ptr in eb['pointers']:
-                ptr_addr = offset + eb['node_header_offset'] + ptr
-                attr = rattr.read_attribute(dump, ptr_addr)
-                eb['pointers_data'].append(attr)
-                eb['_structure_size'] = eb['_structure_size'] + attr['size']
+def is_entryblock(dump, offset, vbr_offset, block_size = 16 * 1024):
+    eb_num = EB_HEADER.read(dump, offset)['eb_number']
+    return is_entryblock_number(eb_num, offset, vbr_offset, block_size)
+
+def has_extents(dump, offset):
+    """Same test as read_entryblock, without decoding the records."""
+    desc = EB_NODE_DESC.read(dump, offset + EB_HEADER.size)
+    return desc['node_desc_length'] != 0x08 and desc['num_extents'] != 0
+
+# keys of the entryblock decoded when first accessed
+_LAZY = object()
+
+class EntryBlock:
+    """Entryblock returned by read_entryblock. The header, the node descriptor
+    and the node header or extent table are decoded at once, the pointers and
+    their attributes, the extents and the structure size only when first
+    accessed (and then kept). Can be used as the dictionary read_entryblock
+    returned before. block_size is the metadata block size of the volume
+    (see part.refs.vol.geometry), 16 KiB on ReFS 1.x."""
+
+    __slots__ = ('_dump', '_fields')
+
+    def __init__(self, dump, offset, block_size=ENTRYBLOCK_SIZE):
+        # the entryblock is read at once, its attributes and extents are then
+        # decoded from memory
+        dump = read_block(dump, offset, block_size)
+        self._dump = dump
+        eb = EB_HEADER.read(dump, offset, {'_absolute_offset': offset})
+        eb['_structure_size'] = _LAZY
+        self._fields = eb
+        # a node descriptor of 8 bytes has no extents and records numbers
+        desc = EB_NODE_DESC.read(dump, offset + EB_HEADER.size)
+        eb['node_desc_length'] = desc['node_desc_length']
+        if eb['node_desc_length'] != 0x08:
+            eb['num_extents'] = desc['num_extents']
+            eb['num_records'] = desc['num_records']
+        eb['_contains_records'] = False
+        eb['_contains_extents'] = False
+        structure_offset = EB_HEADER.size + eb['node_desc_length']
+        if (eb['node_desc_length'] == 0x08 or
+                eb['num_extents'] == 0):
+            eb['_contains_records'] = True
+            eb['node_header_offset'] = structure_offset
+            EB_NODE_HEADER.read(dump, offset + structure_offset, eb)
+            if eb['num_pointers']:
+                eb['pointers'] = _LAZY
+                eb['pointers_data'] = _LAZY
+            else:
+                eb['pointers'] = None
+                eb['pointers_data'] = None
         else:
-            eb['pointers'] = None
-            eb['pointers_data'] = None
-        eb['_structure_size'] = (eb['_structure_size'] +
-                                 eb['header_length'])
-    elif (eb['node_desc_length'] != 0x08 and eb['num_extents'] != 0):
-        eb['_contains_extents'] = True
-        eb['extent_table_offset'] = eb['_structure_size']
-        dump.seek(offset + eb['_structure_size'], 0)
-        data = dump.read(EB_EXTENT_TABLE_FORMAT.size)
-        fields = EB_EXTENT_TABLE_FORMAT.unpack_from(data, 0)
-        eb['extent_table_length'] = fields[0]
-        eb['extent_table_unknown0'] = fields[1]
-        eb['extent_table_unknown1'] = fields[2]
-        eb['extent_table_unknown2'] = fields[3]
-        eb['offset_first_extent_pointer'] = fields[4]
-        eb['num_extent_pointers'] = fields[5]
-        eb['offset_end_of_extent_pointers'] = fields[6]
-        eb['extent_table_unknown3'] = fields[7]
-        eb['_structure_size'] = eb['_structure_size'] + eb['extent_table_length']
-        pointers_format = Struct('<' + ('L' * eb['num_extent_pointers']))
-        dump.seek(offset + eb['extent_table_offset'] + eb['offset_first_extent_pointer'], 0)
-        data = dump.read(pointers_format.size)
-        fields = pointers_format.unpack_from(data, 0)
-        eb['extent_pointers'] = fields
-        eb['extents'] = []
-        for ptr in eb['extent_pointers']:
-            ptr_addr = offset + eb['extent_table_offset'] + ptr
-            ext = _read_extent(dump, ptr_addr)
-            eb['extents'].append(ext)
-            eb['_structure_size'] = eb['_structure_size'] + ext['_structure_size']
-    return eb
+            eb['_contains_extents'] = True
+            eb['extent_table_offset'] = structure_offset
+            EB_EXTENT_TABLE.read(dump, offset + structure_offset, eb)
+            eb['extent_pointers'] = _LAZY
+            eb['extents'] = _LAZY
+
+    def _decode(self, key):
+        eb = self._fields
+        offset = eb['_absolute_offset']
+        if key == 'pointers':
+            return read_array(self._dump, offset + eb['node_header_offset'] +
+                              eb['offset_first_pointer'], eb['num_pointers'])
+        if key == 'pointers_data':
+            base = offset + eb['node_header_offset']
+            return [ rattr.read_attribute(self._dump, base + ptr) for ptr in self['pointers'] ]
+        if key == 'extent_pointers':
+            return read_array(self._dump, offset + eb['extent_table_offset'] +
+                              eb['offset_first_extent_pointer'], eb['num_extent_pointers'])
+        if key == 'extents':
+            base = offset + eb['extent_table_offset']
+            return [ _read_extent(self._dump, base + ptr) for ptr in self['extent_pointers'] ]
+        if key == '_structure_size':
+            # the attributes and extents start with their size, they do not
+            # need to be decoded
+            size = EB_HEADER.size + eb['node_desc_length']
+            if eb['_contains_records']:
+                base = offset + eb['node_header_offset']
+                for ptr in self['pointers'] or ():
+                    size = size + rattr.ATTR_SIZE_FORMAT.unpack_from(
+                        pread(self._dump, base + ptr, rattr.ATTR_SIZE_FORMAT.size), 0)[0]
+                return size + eb['header_length']
+            base = offset + eb['extent_table_offset']
+            size = size + eb['extent_table_length']
+            for ptr in self['extent_pointers']:
+                size = size + EB_EXTENT_HEADER.read(self._dump, base + ptr)['size']
+            return size
+        raise KeyError(key)
+
+    def __getitem__(self, key):
+        value = self._fields[key]
+        if value is _LAZY:
+            value = self._fields[key] = self._decode(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._fields[key] = value
+
+    @property
+    def eb_number(self):
+        return self._fields['eb_number']
+
+    @property
+    def counter(self):
+        return self._fields['counter']
+
+    @property
+    def node_id(self):
+        return self._fields['node_id']
+
+    @property
+    def pointers(self):
+        return self._fields.get('pointers') and self['pointers']
+
+    @property
+    def pointers_data(self):
+        return self._fields.get('pointers_data') and self['pointers_data']
+
+    @property
+    def extents(self):
+        return self._fields.get('extents') and self['extents']
+
+    def attributes(self, projection=None):
+        """Return the attributes of the pointers (None if there are none),
+        decoded up to the fields of projection (see rattr.read_attribute).
+        Projected attributes are not kept, pointers_data is returned if it
+        was already decoded."""
+        value = self._fields.get('pointers_data')
+        if value is not _LAZY or projection is None:
+            return value and self['pointers_data']
+        base = self._fields['_absolute_offset'] + self._fields['node_header_offset']
+        return [ rattr.read_attribute(self._dump, base + ptr, projection)
+                 for ptr in self['pointers'] ]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self._fields)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def items(self):
+        return [ (key, self[key]) for key in self._fields ]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, EntryBlock):
+            other = other.to_dict()
+        if not isinstance(other, dict):
+            return NotImplemented
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+def read_entryblock(dump, offset, block_size=ENTRYBLOCK_SIZE):
+    return EntryBlock(dump, offset, block_size)
+
+EB_EXTENT_HEADER = Schema('extent header', [
+    field('size', 'L', 'size', HEX_DEC),
+    field('unknown0', 'L', 'unknown 0', HEX_DEC),
+    field('unknown1', 'H', 'unknown 1', HEX_DEC),
+    field('header_length', 'H', 'header length', HEX_DEC),
+    field('body_length', 'H', 'body length', HEX_DEC)])
+EB_EXTENT_BODY = Schema('extent body', [
+    field('eb_number', 'Q', 'entryblock id', HEX_DEC),
+    field('0x0000000808020000', 'Q', '0x0000000808020000', '{val:#018x}'),
+    field('crc', 'Q', 'crc(?)', '{val:#018x}')])
 
-EB_EXTENT_HEADER_FORMAT = Struct('<LLHHH')
-EB_EXTENT_BODY_FORMAT = Struct('<QQQ')
+EB_EXTENT_HEADER_FORMAT = EB_EXTENT_HEADER.struct
+EB_EXTENT_BODY_FORMAT = EB_EXTENT_BODY.struct
 
 def _read_extent(dump, offset):
-    dump.seek(offset)
-    data = dump.read(EB_EXTENT_HEADER_FORMAT.size)
-    fields = EB_EXTENT_HEADER_FORMAT.unpack_from(data, 0)
-    ext = {'_absolute_offset': offset,
-           'size': fields[0],
-           'unknown0': fields[1],
-           'unknown1': fields[2],
-           'header_length': fields[3],
-           'body_length': fields[4],
-           '_structure_size': fields[0]}
-    dump.seek(offset + ext['header_length'])
-    data = dump.read(EB_EXTENT_BODY_FORMAT.size)
-    fields = EB_EXTENT_BODY_FORMAT.unpack_from(data, 0)
-    ext['eb_number'] = fields[0]
-    ext['0x0000000808020000'] = fields[1]
-    ext['crc'] = fields[2]
-    return ext
+    ext = EB_EXTENT_HEADER.read(dump, offset, {'_absolute_offset': offset})
+    ext['_structure_size'] = ext['size']
+    return EB_EXTENT_BODY.read(dump, offset + ext['header_length'], ext)
 
 def dump_entryblock(eb):
     print('Entryblock: <{:#x}> ({size},{size:#x})'.format(eb['_absolute_offset'],
                                                           size=eb['_structure_size']))
-    print('- entryblock number: {:#x}'.format(eb['eb_number']))
-    print('- counter: {}'.format(eb['counter']))
-    print('- node id: {:#x}'.format(eb['node_id']))
-    print('- node descriptor length: {val:#x} ({val})'.format(val=eb['node_desc_length']))
-    if 'num_extents' in eb:
-        print('- number of extents: {}'.format(eb['num_extents']))
-    if 'num_records' in eb:
-        print('- number of records: {}'.format(eb['num_records']))
+    EB_HEADER.dump(eb, '- ')
+    EB_NODE_DESC.dump(eb, '- ')
     if eb['_contains_records']:
         print('- node header offset: {val:#x} ({val})'.format(val=eb['node_header_offset']))
-        print('- node header length: {val:#x} ({val})'.format(val=eb['header_length']))
-        print('- offset to next free record: {val:#x} ({val})'.format(val=eb['offset_free_record']))
-        print('- free space in node: {val:#x} ({val})'.format(val=eb['free_space']))
-        print('- node header unknown: {val:#x} ({val})'.format(val=eb['header_unknown']))
+        EB_NODE_HEADER.dump(eb, '- ', ('header_length', 'offset_free_record', 'free_space',
+                                       'header_unknown'))
         print('- offset to first pointer: {val:#x} ({val}) -> entryblock offset: {ebo:#x}'.format(
             val=eb['offset_first_pointer'],
             ebo=eb['offset_first_pointer']+eb['node_header_offset']))
-        print('- number of pointers in node: {}'.format(eb['num_pointers']))
+        EB_NODE_HEADER.dump(eb, '- ', ('num_pointers',))
         print('- offset to end node: {val:#x} ({val}) -> entryblock offset: {ebo:#x}'.format(
             val=eb['offset_end_node'],
             ebo=eb['offset_end_node']+eb['node_header_offset']))
@@ -164,16 +276,7 @@ def dump_entryblock(eb):
             print('- pointers data: None')
     elif eb['_contains_extents']:
         print('- extent table offset: {val:#x} ({val})'.format(val=eb['extent_table_offset']))
-        print('- extent table length: {val:#x} ({val})'.format(val=eb['extent_table_length']))
-        print('- extent table unknown 0: {val:#x} ({val})'.format(val=eb['extent_table_unknown0']))
-        print('- extent table unknown 1: {val:#x} ({val})'.format(val=eb['extent_table_unknown1']))
-        print('- extent table unknown 2: {val:#x} ({val})'.format(val=eb['extent_table_unknown2']))
-        print('- offset to first extent pointer: {val:#x} ({val})'.format(
-            val=eb['offset_first_extent_pointer']))
-        print('- number of extent pointers: {}'.format(eb['num_extent_pointers']))
-        print('- offset en of extent pointers: {val:#x} ({val})'.format(
-            val=eb['offset_end_of_extent_pointers']))
-        print('- extent table unknown 3: {val:#x} ({val})'.format(val=eb['extent_table_unknown3']))
+        EB_EXTENT_TABLE.dump(eb, '- ')
         print('- extent pointers:', end='')
         for ptr in eb['extent_pointers']:
             print(' {:#x}'.format(ptr), end='')
@@ -184,11 +287,5 @@ def dump_entryblock(eb):
             _dump_extent(ext, '    ')
 
 def _dump_extent(ext, prefix):
-    print('{}- size: {val:#x} ({val})'.format(prefix, val=ext['size']))
-    print('{}- unknown 0: {val:#x} ({val})'.format(prefix, val=ext['unknown0']))
-    print('{}- unknown 1: {val:#x} ({val})'.format(prefix, val=ext['unknown1']))
-    print('{}- header length: {val:#x} ({val})'.format(prefix, val=ext['header_length']))
-    print('{}- body length: {val:#x} ({val})'.format(prefix, val=ext['body_length']))
-    print('{}- entryblock id: {val:#x} ({val})'.format(prefix, val=ext['eb_number']))
-    print('{}- 0x0000000808020000: {:#018x}'.format(prefix, ext['0x0000000808020000']))
-    print('{}- crc(?): {:#018x}'.format(prefix, ext['crc']))
+    EB_EXTENT_HEADER.dump(ext, prefix + '- ')
+    EB_EXTENT_BODY.dump(ext, prefix + '- ')
@@ -1,63 +1,55 @@
 import sys
-from struct import Struct
 from util.hexdump import hexdump
+from util.schema import Schema, field
+from media.image import pread
 
 SECTOR_SIZE = 512
-REFS_VR_JUMPINSTRUCTION_OFFSET = 0x0
-REFS_VR_JUMPINSTRUCTION_SIZE = 3
-REFS_VR_FILESYSTEMNAME_OFFSET = 0x3
+
+def _decode_text(value):
+    return value.decode('utf-8')
+
+VOLUME_RECORD = Schema('volume record', [
+    field('jump_instruction', '3s', 'Jump instruction', '{val:#08x}',
+          lambda x: int.from_bytes(x, 'little')),
+    field('filesystem_name', '8s', 'Filesystem name', _decode_text),
+    field('reserved', '5s'),
+    field('struct_id', '4s', 'Struct identifier', _decode_text),
+    field('numbytes', 'H', 'Size of volume record'),
+    field('checksum', 'H', 'FSRS checksum', '{val:#06x}'),
+    field('backup', 'Q', 'Volume record backup LBA offset'),
+    field('bytes_per_sector', 'L', 'Bytes per sector'),
+    field('sectors_per_cluster', 'L', 'Sectors per cluster'),
+    field('version_major', 'B', 'Filesystem major version'),
+    field('version_minor', 'B', 'Filesystem minor version'),
+    field('unknown', '14s'),
+    field('serial_number', 'Q', 'Volume serial number')])
+
+REFS_VR_FILESYSTEMNAME_OFFSET = VOLUME_RECORD.offsets['filesystem_name']
 REFS_VR_FILESYSTEMNAME_SIZE = 8
-REFS_VR_RESV_OFFSET = 0x7
-REFS_VR_RESV_SIZE = 5
-REFS_VR_STRUCT_ID_OFFSET = 0x10
+REFS_VR_STRUCT_ID_OFFSET = VOLUME_RECORD.offsets['struct_id']
 REFS_VR_STRUCT_ID_SIZE = 4
-REFS_VR_NUMBYTES_OFFSET = 0x14
-REFS_VR_NUMBYTES_SIZE = 2
-REFS_VR_CHECKSUM_OFFSET = 0x16
-REFS_VR_CHECKSUM_SIZE = 2
-REFS_VR_BACKUP_OFFSET = 0x18
-REFS_VR_BACKUP_SIZE = 8
-REFS_VR_BYTES_PER_SECTOR_OFFSET = 0x20
-REFS_VR_BYTES_PER_SECTOR_SIZE = 4
-REFS_VR_SECTORS_PER_CLUSTER_OFFSET = 0x24
-REFS_VR_SECTORS_PER_CLUSTER_SIZE = 4
-REFS_VR_VERSION_MAJOR_OFFSET = 0x28
-REFS_VR_VERSION_MAJOR_SIZE = 1
-REFS_VR_VERSION_MINOR_OFFSET = 0x29
-REFS_VR_VERSION_MINOR_SIZE = 1
-REFS_VR_UNKNOWN_OFFSET = 0x2a
-REFS_VR_UNKNOWN_SIZE = 14
-REFS_VR_SN_OFFSET = 0x38
-REFS_VR_SN_SIZE = 8
-REFS_VR_SIZE = 64
-
-REFS_VR_JUMPINSTRUCTION_POS = 0
-REFS_VR_FILESYSTEMNAME_POS = 1
-REFS_VR_RESV_POS = 2
-REFS_VR_STRUCT_ID_POS = 3
-REFS_VR_NUMBYTES_POS = 4
-REFS_VR_CHECKSUM_POS = 5
-REFS_VR_BACKUP_POS = 6
-REFS_VR_BYTES_PER_SECTOR_POS = 7
-REFS_VR_SECTORS_PER_CLUSTER_POS = 8
-REFS_VR_VERSION_MAJOR_POS = 9
-REFS_VR_VERSION_MINOR_POS = 10
-REFS_VR_UNKNOWN_POS = 11
-REFS_VR_SN_POS = 12
+REFS_VR_SIZE = VOLUME_RECORD.size
 
 REFS_VR_FILESYSTEMNAME_SIGNATURE = 'ReFS\x00\x00\x00\x00'
 REFS_VR_STRUCT_ID_SIGNATURE = 'FSRS'
 
-REFS_VR_FORMAT = Struct('<3s8s5s4sHHQLLBB14sQ')
-_JUMPINSTRUCTION_FORMAT = Struct('BBB')
+REFS_VR_FORMAT = VOLUME_RECORD.struct
+# metadata blocks are 16 KiB in ReFS 1.x whatever the cluster size, they are
+# one cluster from ReFS 3.x on
+REFS_V1_BLOCK_SIZE = 16 * 1024
+REFS_V3_MAJOR_VERSION = 3
+# cluster sizes accepted from the volume record, the defaults are used for
+# the others
+REFS_MIN_CLUSTER_SIZE = 4 * 1024
+REFS_MAX_CLUSTER_SIZE = 2 * 1024 * 1024
+REFS_DEFAULT_CLUSTER_SIZE = 64 * 1024
 
 def is_refs_part(dump, lba):
     """Check the given LBA for the ReFS signature and
     filesystem strings to decide if it is an ReFS volume."""
-    dump.seek(lba * SECTOR_SIZE, 0)
-    header = dump.read(REFS_VR_SIZE)
-    signature = header[REFS_VR_FILESYSTEMNAME_OFFSET:REFS_VR_FILESYSTEMNAME_OFFSET + REFS_VR_FILESYSTEMNAME_SIZE].decode('ascii')
-    fs = header[0x10:0x14].decode('ascii')
+    header = pread(dump, lba * SECTOR_SIZE, REFS_VR_SIZE)
+    signature = bytes(header[REFS_VR_FILESYSTEMNAME_OFFSET:REFS_VR_FILESYSTEMNAME_OFFSET + REFS_VR_FILESYSTEMNAME_SIZE]).decode('ascii')
+    fs = bytes(header[REFS_VR_STRUCT_ID_OFFSET:REFS_VR_STRUCT_ID_OFFSET + REFS_VR_STRUCT_ID_SIZE]).decode('ascii')
     return (signature == REFS_VR_FILESYSTEMNAME_SIGNATURE and
             fs == REFS_VR_STRUCT_ID_SIGNATURE)
 
@@ -67,47 +59,49 @@ def _check_is_refs_part(dump, lba):
         sys.exit(1)
 
 def _dec_volume_record(dump, lba):
-    dump.seek(lba * SECTOR_SIZE, 0)
-    vr_raw = dump.read(REFS_VR_SIZE)
-    vr_entries = REFS_VR_FORMAT.unpack_from(vr_raw, 0)
-    ji_entries = _JUMPINSTRUCTION_FORMAT.unpack_from(vr_entries[REFS_VR_JUMPINSTRUCTION_OFFSET], 0)
-    ji = ji_entries[0] + (ji_entries[1] * 256) + (ji_entries[2] * 256 * 256)
-    vr = {'absolute_lba': lba,
-          'jump_instruction': ji,
-          'filesystem_name': vr_entries[REFS_VR_FILESYSTEMNAME_POS],
-          'reserved': vr_entries[REFS_VR_RESV_POS],
-          'struct_id': vr_entries[REFS_VR_STRUCT_ID_POS],
-          'numbytes': vr_entries[REFS_VR_NUMBYTES_POS],
-          'checksum': vr_entries[REFS_VR_CHECKSUM_POS],
-          'backup': vr_entries[REFS_VR_BACKUP_POS],
-          'bytes_per_sector': vr_entries[REFS_VR_BYTES_PER_SECTOR_POS],
-          'sectors_per_cluster': vr_entries[REFS_VR_SECTORS_PER_CLUSTER_POS],
-          'version_major': vr_entries[REFS_VR_VERSION_MAJOR_POS],
-          'version_minor': vr_entries[REFS_VR_VERSION_MINOR_POS],
-          'unknown': vr_entries[REFS_VR_UNKNOWN_POS],
-          'serial_number': vr_entries[REFS_VR_SN_POS]}
-    return vr
+    return VOLUME_RECORD.read(dump, lba * SECTOR_SIZE, {'absolute_lba': lba})
+
+def read_volume_record(dump, lba):
+    """Return the volume record at lba, or None if there is none."""
+    if not is_refs_part(dump, lba):
+        return None
+    return _dec_volume_record(dump, lba)
+
+def _is_power_of_two(x):
+    return x > 0 and x & (x - 1) == 0
+
+def geometry(dump, lba):
+    """Return the sector, cluster and metadata block sizes of the volume,
+    from its volume record. Sizes which make no sense (damaged record) are
+    replaced by the ones of ReFS 1.x."""
+    vr = _dec_volume_record(dump, lba)
+    sector_size = vr['bytes_per_sector']
+    if not _is_power_of_two(sector_size) or not SECTOR_SIZE <= sector_size <= REFS_MIN_CLUSTER_SIZE:
+        sector_size = SECTOR_SIZE
+    cluster_size = sector_size * vr['sectors_per_cluster']
+    if (not _is_power_of_two(cluster_size) or
+            not REFS_MIN_CLUSTER_SIZE <= cluster_size <= REFS_MAX_CLUSTER_SIZE):
+        cluster_size = REFS_DEFAULT_CLUSTER_SIZE
+    if vr['version_major'] >= REFS_V3_MAJOR_VERSION:
+        block_size = cluster_size
+    else:
+        block_size = REFS_V1_BLOCK_SIZE
+    return {'sector_size': sector_size,
+            'cluster_size': cluster_size,
+            'block_size': block_size,
+            'version': (vr['version_major'], vr['version_minor'])}
 
 def fsstat(dump, lba, last_lba):
     _check_is_refs_part(dump, lba)
     vr = _dec_volume_record(dump, lba)
     vr_backup = _dec_volume_record(dump, last_lba)
     fs = {'volume_record': vr,
-          'volume_record_backup': vr_backup}
+          'volume_record_backup': vr_backup,
+          'geometry': geometry(dump, lba)}
     return fs
 
 def _dump_volume_record(vr):
-    print('- Jump instruction: {:#08x}'.format(vr['jump_instruction']))
-    print('- Filesystem name: {}'.format(vr['filesystem_name'].decode('utf-8')))
-    print('- Struct identifier: {}'.format(vr['struct_id'].decode('utf-8')))
-    print('- Size of volume record: {}'.format(vr['numbytes']))
-    print('- FSRS checksum: {:#06x}'.format(vr['checksum']))
-    print('- Volume record backup LBA offset: {}'.format(vr['backup']))
-    print('- Bytes per sector: {}'.format(vr['bytes_per_sector']))
-    print('- Sectors per cluster: {}'.format(vr['sectors_per_cluster']))
-    print('- Filesystem major version: {}'.format(vr['version_major']))
-    print('- Filesystem minor version: {}'.format(vr['version_minor']))
-    print('- Volume serial number: {}'.format(vr['serial_number']))
+    VOLUME_RECORD.dump(vr, '- ')
 
 def _dump_fsstat_volume_record_main(fs):
     vr = fs['volume_record']
@@ -119,6 +113,14 @@ def _dump_fsstat_volume_record_backup(fs):
     print('Volume record backup (lba: {}):'.format(vr['absolute_lba']))
     _dump_volume_record(vr)
 
+def _dump_fsstat_geometry(fs):
+    geo = fs['geometry']
+    print('Geometry:')
+    print('- Sector size: {}'.format(geo['sector_size']))
+    print('- Cluster size: {}'.format(geo['cluster_size']))
+    print('- Metadata block size: {}'.format(geo['block_size']))
+
 def dump_fsstat(fs):
     _dump_fsstat_volume_record_main(fs)
     _dump_fsstat_volume_record_backup(fs)
+    _dump_fsstat_geometry(fs)
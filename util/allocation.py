@@ -0,0 +1,151 @@
+import part.refs.allocator as ralloc
+import part.refs.entry_block as reb
+import util.navigation as navigation
+from util.carving import SECTOR_SIZE, ENTRYBLOCK_SIZE, CLUSTER_SIZE
+
+# scan modes: all the partition, only its allocated or unallocated clusters
+SCAN_ALL = 'all'
+SCAN_ALLOCATED = 'allocated'
+SCAN_UNALLOCATED = 'unallocated'
+SCAN_MODES = (SCAN_ALL, SCAN_ALLOCATED, SCAN_UNALLOCATED)
+
+_POPCOUNT = bytes(bin(x).count('1') for x in range(256))
+
+def read_allocation_map(dump, lba_offset, lba_end, block_size = ENTRYBLOCK_SIZE,
+                        cluster_size = CLUSTER_SIZE):
+    """Decode the records of the allocator of the partition (reached through
+    the tree control) into an allocation map, one bit per cluster of the
+    partition (set if allocated). Clusters not described by any record are
+    taken as allocated.
+
+    The layout of the allocator records is a heuristic (see
+    part.refs.allocator), so the map is only built if all the records are
+    consistent (see check_records). Returns None if no allocator record was
+    found or if one of them is rejected."""
+    records = []
+    for block in navigation.tree_control_blocks(dump, lba_offset, lba_end, block_size):
+        if (block['nodeid'] != ralloc.ALLOCATOR_NODE_ID or
+                reb.has_extents(dump, block['offset'])):
+            continue
+        records.extend(ralloc.read_allocator(dump, block['offset'], block_size)['records'])
+    if not records:
+        return None
+    clusters = -(-(lba_end - lba_offset) * SECTOR_SIZE // cluster_size)
+    error = check_records(records, clusters)
+    if error is not None:
+        print('WARNING(util.allocation): allocator records rejected ({}), '
+              'the allocation map is not used'.format(error))
+        return None
+    bitmap = bytearray(b'\xff' * -(-clusters // 8))
+    for rec in records:
+        _apply_record(bitmap, clusters, rec)
+    return {'cluster_size': cluster_size,
+            'clusters': clusters,
+            'records': len(records),
+            'bitmap': bitmap}
+
+def _free_clusters(bitmap, count):
+    """Number of clear bits among the first count bits of bitmap."""
+    full = count // 8
+    free = full * 8 - sum(bitmap[:full].translate(_POPCOUNT))
+    for i in range(full * 8, count):
+        free = free + (not (bitmap[i // 8] >> (i % 8)) & 1)
+    return free
+
+def check_records(records, clusters):
+    """Check that the allocator records can be trusted: their ranges are
+    inside the partition (of clusters clusters) and do not overlap, their
+    bitmap covers their range and their free clusters count matches it.
+    Returns the reason the records are rejected, None if they are not."""
+    end = 0
+    for rec in sorted(records, key=lambda x: x['first_cluster']):
+        first = rec['first_cluster']
+        count = rec['num_clusters']
+        if first + count > clusters:
+            return 'clusters {:#x}-{:#x} out of the partition'.format(first, first + count)
+        if first < end:
+            return 'clusters {:#x}-{:#x} described twice'.format(first, end)
+        if len(rec['bitmap']) * 8 < count:
+            return 'bitmap of clusters {:#x}-{:#x} too short'.format(first, first + count)
+        if _free_clusters(rec['bitmap'], count) != rec['free_clusters?']:
+            return 'free clusters of clusters {:#x}-{:#x} not matching their bitmap'.format(
+                first, first + count)
+        end = first + count
+    return None
+
+def _apply_record(bitmap, clusters, rec):
+    first = rec['first_cluster']
+    count = min(rec['num_clusters'], len(rec['bitmap']) * 8, max(0, clusters - first))
+    if not count:
+        return
+    if first % 8 == 0:
+        # whole bytes are copied, the bits of the last one only partly
+        start = first // 8
+        full = count // 8
+        bitmap[start:start + full] = rec['bitmap'][:full]
+        first = first + full * 8
+        count = count - full * 8
+        src = full * 8
+    else:
+        src = 0
+    for i in range(count):
+        bit = (rec['bitmap'][(src + i) // 8] >> ((src + i) % 8)) & 1
+        c = first + i
+        if bit:
+            bitmap[c // 8] = bitmap[c // 8] | (1 << (c % 8))
+        else:
+            bitmap[c // 8] = bitmap[c // 8] & ~(1 << (c % 8))
+
+def is_allocated(amap, cluster):
+    return bool((amap['bitmap'][cluster // 8] >> (cluster % 8)) & 1)
+
+def allocated_clusters(amap):
+    full = amap['clusters'] // 8
+    count = sum(amap['bitmap'][:full].translate(_POPCOUNT))
+    for c in range(full * 8, amap['clusters']):
+        count = count + is_allocated(amap, c)
+    return count
+
+def cluster_runs(amap):
+    """Yield (first cluster, number of clusters, allocated) for the runs of
+    clusters of the same state."""
+    bitmap = amap['bitmap']
+    clusters = amap['clusters']
+    start = 0
+    state = None
+    c = 0
+    while c < clusters:
+        byte = bitmap[c // 8]
+        if c % 8 == 0 and c + 8 <= clusters and byte in (0, 0xff):
+            # whole byte of the same state
+            value = byte == 0xff
+            step = 8
+        else:
+            value = bool((byte >> (c % 8)) & 1)
+            step = 1
+        if value != state:
+            if state is not None:
+                yield start, c - start, state
+            start = c
+            state = value
+        c = c + step
+    if state is not None:
+        yield start, clusters - start, state
+
+def scan_ranges(amap, lba_offset, lba_end, mode = SCAN_ALL):
+    """Return the (start, end) byte ranges of the partition to scan in mode
+    (one of SCAN_MODES), consecutive runs being merged."""
+    offset = lba_offset * SECTOR_SIZE
+    end = lba_end * SECTOR_SIZE
+    if mode == SCAN_ALL or amap is None:
+        return [(offset, end)]
+    wanted = mode == SCAN_ALLOCATED
+    ranges = []
+    for first, count, allocated in cluster_runs(amap):
+        if allocated != wanted:
+            continue
+        start = offset + first * amap['cluster_size']
+        stop = min(end, start + count * amap['cluster_size'])
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import sys
+from array import array
+from struct import Struct
+from media.image import pread, split_segments
+from util.carving import SECTOR_SIZE, ENTRYBLOCK_SIZE
+from util.blocks import BlockIndex, BLOCK_FIELDS
+from util.sidecar import CACHE_DIR, sidecar_paths, load_sidecar, save_sidecar
+
+INDEX_MAGIC = b'PYREFSIX'
+INDEX_VERSION = 2
+INDEX_SUFFIX = '.pyrefs-index'
+# used when the index cannot be written next to the image (read-only evidence)
+INDEX_CACHE_DIR = CACHE_DIR
+# magic, version, image size, image mtime (ns), first lba, last lba, block
+# size, content hash, path length, number of blocks, hit lists flags
+INDEX_HEADER_FORMAT = Struct('<8sHQQQQL32sHQB')
+# the content hash covers INDEX_SAMPLES chunks spread over the partition
+INDEX_SAMPLES = 64
+INDEX_SAMPLE_SIZE = 4 * 1024
+# hit lists saved in the index, and their flag in the header
+INDEX_HIT_KEYS = (('fnas', 0x1), ('folderids', 0x2))
+
+def index_paths(path, lba_offset, lba_end):
+    """Return the candidate locations of the index of the given partition,
+    next to the image first and in INDEX_CACHE_DIR then."""
+    name = '{}.{}-{}{}'.format(os.path.basename(path), lba_offset, lba_end, INDEX_SUFFIX)
+    return sidecar_paths(path, name)
+
+def content_hash(dump, lba_offset, lba_end):
+    offset = lba_offset * SECTOR_SIZE
+    length = max(0, lba_end * SECTOR_SIZE - offset)
+    stride = max(INDEX_SAMPLE_SIZE, length // INDEX_SAMPLES)
+    h = hashlib.sha256()
+    for pos in range(offset, offset + length, stride):
+        h.update(pread(dump, pos, min(INDEX_SAMPLE_SIZE, offset + length - pos)))
+    return h.digest()
+
+def index_key(dump, path, lba_offset, lba_end, step=ENTRYBLOCK_SIZE):
+    # all the segments of split images are taken into account
+    stats = [ os.stat(x) for x in split_segments(path) ]
+    return {'path': os.path.abspath(path),
+            'size': sum(st.st_size for st in stats),
+            'mtime': max(st.st_mtime_ns for st in stats),
+            'lba_offset': lba_offset,
+            'lba_end': lba_end,
+            'step': step,
+            'hash': content_hash(dump, lba_offset, lba_end)}
+
+def _column(col):
+    if sys.byteorder != 'little':
+        col = array(col.typecode, col)
+        col.byteswap()
+    return col.tobytes()
+
+def _read_column(typecode, data, pos, count):
+    col = array(typecode)
+    if pos + count * col.itemsize > len(data):
+        raise ValueError('truncated index')
+    col.frombytes(data[pos:pos + count * col.itemsize])
+    if sys.byteorder != 'little':
+        col.byteswap()
+    return col, pos + count * col.itemsize
+
+def _encode(key, blocks):
+    if not isinstance(blocks, BlockIndex):
+        blocks = BlockIndex(blocks)
+    path = key['path'].encode('utf-8')
+    flags = 0
+    for name, flag in INDEX_HIT_KEYS:
+        if len(blocks) and blocks.has_hits(name):
+            flags = flags | flag
+    chunks = [INDEX_HEADER_FORMAT.pack(INDEX_MAGIC, INDEX_VERSION,
+                                       key['size'], key['mtime'],
+                                       key['lba_offset'], key['lba_end'],
+                                       key['step'], key['hash'],
+                                       len(path), len(blocks), flags),
+              path]
+    for name, _ in BLOCK_FIELDS:
+        chunks.append(_column(blocks.columns[name]))
+    for name, flag in INDEX_HIT_KEYS:
+        if flags & flag:
+            hits = [ blocks.get_hits(name, row) for row in range(len(blocks)) ]
+            # fixed size codes only, the index may be read on another platform
+            chunks.append(_column(array('Q', [ len(x) for x in hits ])))
+            chunks.append(_column(array('Q', [ y for x in hits for y in x ])))
+    return b''.join(chunks)
+
+def _decode(key, data):
+    """Return the BlockIndex stored in data, or None if data was not produced
+    for key (other image, modified image, other partition...). Raises
+    ValueError if data is damaged (truncated...)."""
+    if len(data) < INDEX_HEADER_FORMAT.size:
+        return None
+    (magic, version, size, mtime, lba_offset, lba_end, step, digest,
+     path_length, count, flags) = INDEX_HEADER_FORMAT.unpack_from(data, 0)
+    pos = INDEX_HEADER_FORMAT.size
+    path = data[pos:pos + path_length].decode('utf-8', 'replace')
+    pos = pos + path_length
+    if ((magic, version, size, mtime, lba_offset, lba_end, step, digest, path) !=
+        (INDEX_MAGIC, INDEX_VERSION, key['size'], key['mtime'], key['lba_offset'],
+         key['lba_end'], key['step'], key['hash'], key['path'])):
+        return None
+    columns = {}
+    for name, typecode in BLOCK_FIELDS:
+        columns[name], pos = _read_column(typecode, data, pos, count)
+    hits = {}
+    for name, flag in INDEX_HIT_KEYS:
+        if flags & flag:
+            lengths, pos = _read_column('Q', data, pos, count)
+            values, pos = _read_column('Q', data, pos, sum(lengths))
+            rows = {}
+            start = 0
+            for row, length in enumerate(lengths):
+                if length:
+                    rows[row] = values[start:start + length].tolist()
+                start = start + length
+            hits[name] = rows
+    if pos != len(data):
+        return None
+    return BlockIndex.from_columns(columns, hits)
+
+def load_index(dump, path, lba_offset, lba_end, step=ENTRYBLOCK_SIZE):
+    """Return the blocks saved by save_index for this partition, or None when
+    there is no index or when it is stale."""
+    key = index_key(dump, path, lba_offset, lba_end, step)
+    return load_sidecar(index_paths(path, lba_offset, lba_end), lambda data: _decode(key, data))
+
+def save_index(dump, path, blocks, lba_offset, lba_end, step=ENTRYBLOCK_SIZE):
+    """Save the blocks found by carving.find_blocks, and their fnas and
+    folderids hit lists if all the blocks have them. Returns the path of the
+    index or None if it could not be written."""
+    data = _encode(index_key(dump, path, lba_offset, lba_end, step), blocks)
+    return save_sidecar(index_paths(path, lba_offset, lba_end), data)
@@ -0,0 +1,215 @@
+from array import array
+
+# block columns and their array typecode, counter only keeps the low byte of
+# the entryblock counter (as read by carving.find_blocks)
+BLOCK_FIELDS = (('offset', 'Q'),
+                ('entryblock', 'Q'),
+                ('nodeid', 'Q'),
+                ('childid', 'Q'),
+                ('counter', 'B'))
+# attribute hit lists (see carving.ATTRIBUTE_SIGNATURES), None until looked
+# for; childids is only listed in the keys of the blocks it was looked for in
+BLOCK_HIT_KEYS = ('fnas', 'folderids', 'childids')
+_OPTIONAL_HIT_KEYS = ('childids',)
+
+class BlockIndex:
+    """Blocks found in a partition, stored in typed array columns instead of
+    one dictionary per block.
+
+    Iterating or indexing returns BlockRecord views which can be used as the
+    block dictionaries returned before by carving.find_blocks. Blocks can be
+    looked up by entryblock number and by node identifier in constant time,
+    through maps built when first needed."""
+
+    def __init__(self, blocks=()):
+        self.columns = {name: array(typecode) for name, typecode in BLOCK_FIELDS}
+        # key -> {row: hit list}, only non empty lists are kept
+        self._hits = {key: {} for key in BLOCK_HIT_KEYS}
+        # key -> one byte per row, set when the hits have been looked for
+        self._computed = {key: bytearray() for key in BLOCK_HIT_KEYS}
+        self._by_entryblock = None
+        self._by_nodeid = None
+        self.extend(blocks)
+
+    @classmethod
+    def from_columns(cls, columns, hits=None):
+        """Build an index from BLOCK_FIELDS arrays of the same length. hits
+        gives, for the keys looked for in all the blocks, their {row: hit
+        list} dictionary."""
+        blocks = cls()
+        for name, typecode in BLOCK_FIELDS:
+            blocks.columns[name] = array(typecode, columns[name])
+        count = len(blocks)
+        for key in BLOCK_HIT_KEYS:
+            if hits and key in hits:
+                blocks._computed[key] = bytearray(b'\x01' * count)
+                blocks._hits[key] = { row: list(x) for row, x in hits[key].items() if x }
+            else:
+                blocks._computed[key] = bytearray(count)
+        return blocks
+
+    def __len__(self):
+        return len(self.columns['offset'])
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield BlockRecord(self, row)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [ BlockRecord(self, i) for i in range(*row.indices(len(self))) ]
+        if row < 0:
+            row = row + len(self)
+        if not 0 <= row < len(self):
+            raise IndexError('block index out of range')
+        return BlockRecord(self, row)
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return 'BlockIndex({} blocks)'.format(len(self))
+
+    def append(self, block):
+        row = len(self)
+        for name, _ in BLOCK_FIELDS:
+            self.columns[name].append(block[name])
+        for key in BLOCK_HIT_KEYS:
+            self._computed[key].append(0)
+            hits = block.get(key)
+            if hits is not None:
+                self._set_hits(key, row, hits)
+        self._by_entryblock = None
+        self._by_nodeid = None
+
+    def extend(self, blocks):
+        if not isinstance(blocks, BlockIndex):
+            for block in blocks:
+                self.append(block)
+            return
+        if not len(blocks):
+            return
+        base = len(self)
+        for name, _ in BLOCK_FIELDS:
+            self.columns[name].extend(blocks.columns[name])
+        for key in BLOCK_HIT_KEYS:
+            self._computed[key].extend(blocks._computed[key])
+            for row, hits in blocks._hits[key].items():
+                self._hits[key][base + row] = hits
+        self._by_entryblock = None
+        self._by_nodeid = None
+
+    def has_hits(self, key):
+        """True if the key hit lists of all the blocks have been looked for."""
+        return all(self._computed[key])
+
+    def get_hits(self, key, row):
+        if not self._computed[key][row]:
+            return None
+        return self._hits[key].get(row, [])
+
+    def _set_hits(self, key, row, hits):
+        if hits is None:
+            self._computed[key][row] = 0
+            self._hits[key].pop(row, None)
+            return
+        self._computed[key][row] = 1
+        if hits:
+            self._hits[key][row] = list(hits)
+        else:
+            self._hits[key].pop(row, None)
+
+    def with_entryblock(self, entryblock):
+        """Return the blocks with the given entryblock number."""
+        if self._by_entryblock is None:
+            self._by_entryblock = _group_rows(self.columns['entryblock'])
+        return [ BlockRecord(self, row) for row in _rows(self._by_entryblock, entryblock) ]
+
+    def with_nodeid(self, nodeid):
+        """Return the blocks of the given node, in index order."""
+        if self._by_nodeid is None:
+            self._by_nodeid = _group_rows(self.columns['nodeid'])
+        return [ BlockRecord(self, row) for row in _rows(self._by_nodeid, nodeid) ]
+
+def _group_rows(column):
+    """Return the {value: first row} map of column, and the {value: rows}
+    map of the values found in more than one row. Most values (entryblock
+    numbers...) are unique, they only cost an int."""
+    first = dict(zip(reversed(column), range(len(column) - 1, -1, -1)))
+    repeated = {}
+    if len(first) < len(column):
+        for row, value in enumerate(column):
+            start = first[value]
+            if start != row:
+                rows = repeated.get(value)
+                if rows is None:
+                    rows = repeated[value] = [start]
+                rows.append(row)
+    return first, repeated
+
+def _rows(groups, value):
+    """Rows of value in the maps built by _group_rows, in index order."""
+    first, repeated = groups
+    rows = repeated.get(value)
+    if rows is not None:
+        return rows
+    row = first.get(value)
+    return () if row is None else (row,)
+
+class BlockRecord:
+    """Dictionary like view on one block of a BlockIndex. Only the hit lists
+    can be modified."""
+
+    __slots__ = ('index', 'row')
+
+    def __init__(self, index, row):
+        self.index = index
+        self.row = row
+
+    def __getitem__(self, key):
+        column = self.index.columns.get(key)
+        if column is not None:
+            return column[self.row]
+        if key in BLOCK_HIT_KEYS:
+            return self.index.get_hits(key, self.row)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in BLOCK_HIT_KEYS:
+            raise KeyError('{} cannot be modified in a block index'.format(key))
+        self.index._set_hits(key, self.row, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [ name for name, _ in BLOCK_FIELDS ]
+        for key in BLOCK_HIT_KEYS:
+            if key not in _OPTIONAL_HIT_KEYS or self.index._computed[key][self.row]:
+                keys.append(key)
+        return keys
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def items(self):
+        return [ (key, self[key]) for key in self.keys() ]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, BlockRecord):
+            other = other.to_dict()
+        if not isinstance(other, dict):
+            return NotImplemented
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return repr(self.to_dict())
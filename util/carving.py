@@ -1,72 +1,204 @@
 import argparse
+import re
 import sys
+from functools import lru_cache
 from struct import Struct
 import part.refs.entry_block as reb
 import part.refs.tree_control as rtc
 import part.refs.attribute as refs_attr
 import part.refs.allocator as alloc
 import part.refs.object_tree as rot
+from media.image import pread
+import util.parallel as parallel
+from util.blocks import BlockIndex
 from util.hexdump import hexdump
 from util.table import print_table
 
 SECTOR_SIZE = 512
 ENTRYBLOCK_SIZE = 16 * 1024
 CLUSTER_SIZE = 4 * ENTRYBLOCK_SIZE
+# size of the contiguous reads performed when scanning a partition
+SCAN_WINDOW_SIZE = 4 * 1024 * 1024
 counter_offset=0x8
 nodeid_offset=0x18
 childid_offset=0x20
 ENTRYBLOCK_FORMAT=Struct('<Q')
 NODEID_FORMAT=Struct('<Q')
+# entryblock number, counter (only its low byte), node id and child id
+BLOCK_HEADER_FORMAT=Struct('<QB15xQQ')
 
-def find_bytes(entry, block):
-    hits = []
-    for i in range(0, len(block) - (len(entry) - 1)):
-        match = True
-        for l in range(0, len(entry)):
-            match = entry[l] == block[i + l]
-            if not match:
-                break
-        if match:
-            hits.append(i)
+SIG_FILENAME = bytes([0x30, 0, 1, 0])
+SIG_FOLDER = bytes([0x30, 0, 2, 0])
+SIG_CHILD = bytes([0x20, 0, 0, 0x80])
+# block keys filled by blocks_with_attributes and the signature they look for
+ATTRIBUTE_SIGNATURES = {'fnas': SIG_FILENAME,
+                        'folderids': SIG_FOLDER,
+                        'childids': SIG_CHILD}
+# attribute headers start 0x10 bytes before their type signature
+ATTRIBUTE_SIGNATURE_OFFSET = 0x10
+FOLDER_IDENTIFIER_OFFSET = 0x4
+FOLDER_IDENTIFIER_FORMAT = Struct('<H')
+# above this number of distinct patterns a single regex pass beats one
+# bytes.find pass per pattern
+FIND_MAX_PATTERNS = 8
+
+def compile_patterns(patterns):
+    """Compile a {name: pattern} mapping into a matcher that returns the hits
+    of all the patterns from a single call to scan_patterns."""
+    by_pattern = {}
+    for name, pattern in patterns.items():
+        pattern = bytes(pattern)
+        if not pattern:
+            raise ValueError('empty pattern {!r}'.format(name))
+        by_pattern.setdefault(pattern, []).append(name)
+    matcher = {'names': list(patterns.keys()),
+               'patterns': by_pattern,
+               'regex': None,
+               'prefixes': None}
+    if len(by_pattern) > FIND_MAX_PATTERNS:
+        # the lookahead makes overlapping hits visible, and trying the longest
+        # alternatives first means that every other pattern found at the same
+        # position is a prefix of the one matched
+        alternatives = sorted(by_pattern, key=len, reverse=True)
+        matcher['regex'] = re.compile(b'(?=(' +
+                                      b'|'.join(re.escape(x) for x in alternatives) +
+                                      b'))', re.DOTALL)
+        matcher['prefixes'] = {p: [ name
+                                    for q in alternatives if p.startswith(q)
+                                    for name in by_pattern[q] ]
+                               for p in alternatives}
+    return matcher
+
+def scan_patterns(matcher, data, start=0, end=None):
+    """Return a {name: [offsets]} dictionary with the hits of every pattern of
+    the matcher in data[start:end], offsets are relative to start."""
+    if end is None:
+        end = len(data)
+    hits = {name: [] for name in matcher['names']}
+    if matcher['regex'] is None:
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+        find = data.find
+        for pattern, names in matcher['patterns'].items():
+            found = []
+            i = find(pattern, start, end)
+            while i != -1:
+                found.append(i - start)
+                i = find(pattern, i + 1, end)
+            for name in names:
+                hits[name].extend(found)
+    else:
+        prefixes = matcher['prefixes']
+        for m in matcher['regex'].finditer(data, start, end):
+            i = m.start() - start
+            for name in prefixes[m.group(1)]:
+                hits[name].append(i)
     return hits
 
-def find_blocks(dump, lba_offset, lba_end, step = ENTRYBLOCK_SIZE):
+@lru_cache(maxsize=64)
+def _single_pattern_matcher(pattern):
+    return compile_patterns({'pattern': pattern})
+
+def find_bytes(entry, block):
+    if not entry:
+        return list(range(len(block) + 1))
+    return scan_patterns(_single_pattern_matcher(bytes(entry)), block)['pattern']
+
+def read_windows(dump, offset, end, step=ENTRYBLOCK_SIZE, window=SCAN_WINDOW_SIZE):
+    """Yield (offset, data) pairs covering all the blocks of size step starting
+    in [offset, end), reading as many whole blocks as fit in window at once."""
+    nblocks = max(1, window // step)
+    for pos in range(offset, end, nblocks * step):
+        size = min(nblocks, -(-(end - pos) // step)) * step
+        yield pos, pread(dump, pos, size)
+
+def iter_blocks(dump, lba_offset, lba_end, step = ENTRYBLOCK_SIZE, window = SCAN_WINDOW_SIZE,
+                keys = ()):
+    """Yield the entryblocks between lba_offset and lba_end. The attribute
+    signatures of keys (see ATTRIBUTE_SIGNATURES) are looked for in the same
+    pass, each block being read only once."""
     offset = lba_offset * SECTOR_SIZE
-    end = lba_end * SECTOR_SIZE
-    blocks = []
-    for i in range(offset,end,step):
-        dump.seek(i, 0)
-        data = dump.read(8)
-        entryblock, = ENTRYBLOCK_FORMAT.unpack_from(data, 0)
-        if reb.is_entryblock(dump, i, offset):
-            dump.seek(i+nodeid_offset,0)
-            data = dump.read(8)
-            nodeid, = NODEID_FORMAT.unpack_from(data, 0)
-            dump.seek(i+childid_offset,0)
-            data = dump.read(8)
-            childid, = NODEID_FORMAT.unpack_from(data, 0)
-            dump.seek(i+counter_offset, 0)
-            counter = dump.read(1)[0]
-            steps = int((i - offset) / step)
-            block = {'offset': i, 'entryblock': entryblock,
-                     'counter': counter, 'nodeid': nodeid,
-                     'childid': childid, 'fnas': None,
-                     'folderids': None}
-            blocks.append(block)
-    return blocks
+    return _iter_blocks(dump, offset, lba_end * SECTOR_SIZE, offset, step, window, keys)
+
+def _iter_blocks(dump, offset, end, vbr_offset, step, window, keys=()):
+    matcher = _attribute_matcher(tuple(keys)) if keys else None
+    for pos, data in read_windows(dump, offset, end, step, window):
+        window_data = None
+        for rel in range(0, len(data) - BLOCK_HEADER_FORMAT.size + 1, step):
+            i = pos + rel
+            entryblock, counter, nodeid, childid = BLOCK_HEADER_FORMAT.unpack_from(data, rel)
+            if reb.is_entryblock_number(entryblock, i, vbr_offset, step):
+                block = {'offset': i, 'entryblock': entryblock,
+                         'counter': counter, 'nodeid': nodeid,
+                         'childid': childid, 'fnas': None,
+                         'folderids': None}
+                if matcher:
+                    if window_data is None:
+                        # converted once per window rather than once per block
+                        window_data = bytes(data)
+                    block.update(_window_attribute_hits(dump, pos, window_data, matcher,
+                                                        rel, min(rel + step, len(data))))
+                yield block
+
+def _find_blocks(dump, offset, end, vbr_offset, step, window, keys=()):
+    return BlockIndex(_iter_blocks(dump, offset, end, vbr_offset, step, window, keys))
 
-def find_data_blocks_with_pattern(dump, pattern, lba_offset, lba_end, step=ENTRYBLOCK_SIZE):
+def _scan_chunks(offset, end, step, jobs, min_size=0, ranges=None):
+    """Split the (start, end) byte ranges to scan (all of [offset, end) if
+    None, see util.allocation.scan_ranges) in chunks scanned in parallel."""
+    align = CLUSTER_SIZE if CLUSTER_SIZE % step == 0 else step
+    if ranges is None:
+        ranges = [(offset, end)]
+    return [ chunk for start, stop in ranges
+             for chunk in parallel.split_range(max(start, offset), min(stop, end),
+                                               jobs, align, min_size) ]
+
+def find_blocks(dump, lba_offset, lba_end, step = ENTRYBLOCK_SIZE, window = SCAN_WINDOW_SIZE,
+                jobs = 1, keys = (), ranges = None):
+    """Find the entryblocks between lba_offset and lba_end, using jobs processes
+    each one scanning a part of the range. As for iter_blocks, the hits of the
+    attribute signatures of keys are collected in the same pass. If given,
+    only the (start, end) byte ranges are scanned.
+    The blocks are returned in a util.blocks.BlockIndex."""
     offset = lba_offset * SECTOR_SIZE
     end = lba_end * SECTOR_SIZE
+    tasks = [ (start, stop, offset, step, window, tuple(keys))
+              for start, stop in _scan_chunks(offset, end, step, jobs, window, ranges) ]
+    blocks = BlockIndex()
+    for result in parallel.run(dump, _find_blocks, tasks, jobs):
+        blocks.extend(result)
+    return blocks
+
+def _find_data_blocks(dump, matcher, offset, end, lba_offset, step):
     block_offsets = []
     for i in range(offset,end,step):
-        dump.seek(i, 0)
-        data = dump.read(128)
-        addrs = find_bytes(pattern, data)
-        if addrs:
-            block_offsets.append({'block_offset': int((i - lba_offset)/step),
-                                  'addr': i,
-                                  'lba_offset': int((i - lba_offset)/SECTOR_SIZE)})
+        data = pread(dump, i, 128)
+        hits = scan_patterns(matcher, data)
+        for name in matcher['names']:
+            if hits[name]:
+                block_offsets.append({'pattern': name,
+                                      'block_offset': int((i - lba_offset)/step),
+                                      'addr': i,
+                                      'lba_offset': int((i - lba_offset)/SECTOR_SIZE)})
+    return block_offsets
+
+def find_data_blocks_with_patterns(dump, patterns, lba_offset, lba_end, step=ENTRYBLOCK_SIZE,
+                                   jobs=1, ranges=None):
+    matcher = compile_patterns(patterns)
+    offset = lba_offset * SECTOR_SIZE
+    end = lba_end * SECTOR_SIZE
+    tasks = [ (matcher, start, stop, lba_offset, step)
+              for start, stop in _scan_chunks(offset, end, step, jobs, SCAN_WINDOW_SIZE,
+                                              ranges) ]
+    results = parallel.run(dump, _find_data_blocks, tasks, jobs)
+    return [ block for blocks in results for block in blocks ]
+
+def find_data_blocks_with_pattern(dump, pattern, lba_offset, lba_end, step=ENTRYBLOCK_SIZE,
+                                  jobs=1):
+    block_offsets = find_data_blocks_with_patterns(dump, {'pattern': pattern},
+                                                   lba_offset, lba_end, step, jobs)
+    for block in block_offsets:
+        del block['pattern']
     return block_offsets
 
 def print_blocks(blocks):
@@ -82,50 +214,76 @@ def print_blocks(blocks):
     if blocks:
         print_table(columns, blocks)
 
-def blocks_with_filename_attributes(dump, blocks, block_size = ENTRYBLOCK_SIZE):
-    blocks_found = []
-    for block in blocks:
-        dump.seek(block['offset'])
-        data = dump.read(block_size)
-        fileids = find_bytes([0x30,0,1,0], data)
-        if fileids:
-            block['fnas'] = [ x + block['offset'] - 0x10 for x in fileids ]
-            blocks_found.append(block)
+@lru_cache(maxsize=16)
+def _attribute_matcher(keys):
+    return compile_patterns({k: ATTRIBUTE_SIGNATURES[k] for k in keys})
+
+def _attribute_hits(dump, offsets, keys, block_size):
+    """Return for every block offset a {key: [attribute offsets]} dictionary."""
+    matcher = _attribute_matcher(keys)
+    results = []
+    for block_offset in offsets:
+        data = pread(dump, block_offset, block_size)
+        results.append(_window_attribute_hits(dump, block_offset, data, matcher))
+    return results
+
+def _window_attribute_hits(dump, base_offset, data, matcher, start=0, end=None):
+    """Return the {key: [attribute offsets]} hits of matcher in data[start:end],
+    data being read from base_offset in the dump."""
+    hits = scan_patterns(matcher, data, start, end)
+    if 'folderids' in hits:
+        hits['folderids'] = _folder_hits(dump, base_offset + start, data, hits['folderids'],
+                                         start)
+    block_offset = base_offset + start - ATTRIBUTE_SIGNATURE_OFFSET
+    return {key: [ x + block_offset for x in found ] for key, found in hits.items()}
+
+def _folder_hits(dump, block_offset, data, hits, start=0):
+    folderids = []
+    # this loop tries to check that the pattern found is in a filename_folder
+    # attribute
+    # TODO: find a better way to determine if the pattern is in a filename_folder
+    # attribute or in a folder attribute
+    for fid in hits:
+        pos = fid - ATTRIBUTE_SIGNATURE_OFFSET + FOLDER_IDENTIFIER_OFFSET
+        if start + pos >= 0:
+            offset, = FOLDER_IDENTIFIER_FORMAT.unpack_from(data, start + pos)
         else:
-            block['fnas'] = []
-    return blocks_found
+            offset, = FOLDER_IDENTIFIER_FORMAT.unpack_from(
+                pread(dump, block_offset + pos, FOLDER_IDENTIFIER_FORMAT.size), 0)
+        if offset == ATTRIBUTE_SIGNATURE_OFFSET:
+            folderids.append(fid)
+    return folderids
+
+def _blocks_attribute_hits(dump, blocks, keys, block_size, jobs):
+    offsets = [ block['offset'] for block in blocks ]
+    tasks = [ (chunk, keys, block_size)
+              for chunk in parallel.split_list(offsets, jobs, 64) ]
+    results = parallel.run(dump, _attribute_hits, tasks, jobs)
+    return zip(blocks, [ hits for chunk in results for hits in chunk ])
+
+def blocks_with_filename_attributes(dump, blocks, block_size = ENTRYBLOCK_SIZE, jobs = 1):
+    return blocks_with_attributes(dump, blocks, ('fnas',), block_size, jobs)['fnas']
 
-def blocks_with_folder_attributes(dump, blocks, block_size = ENTRYBLOCK_SIZE):
+def blocks_with_folder_attributes(dump, blocks, block_size = ENTRYBLOCK_SIZE, jobs = 1):
+    return blocks_with_attributes(dump, blocks, ('folderids',), block_size, jobs)['folderids']
+
+def blocks_with_child_attributes(dump, blocks, block_size = ENTRYBLOCK_SIZE, jobs = 1):
     blocks_found = []
-    for block in blocks:
-        dump.seek(block['offset'], 0)
-        data = dump.read(block_size)
-        _folderids = find_bytes([0x30,0,2,0], data)
-        folderids = []
-        # this loop tries to check that the pattern found is in a filename_folder
-        # attribute
-        # TODO: find a better way to determine if the pattern is in a filename_folder
-        # attribute or in a folder attribute
-        for fid in _folderids:
-            dump.seek(fid + block['offset'] - 0x10 + 0x4, 0)
-            data = dump.read(2)
-            offset = data[0] + (data[1] * 256)
-            if offset == 0x10:
-                folderids.append(fid)
-        if folderids:
-            block['folderids'] = [ x + block['offset'] - 0x10 for x in folderids ]
+    for block, hits in _blocks_attribute_hits(dump, blocks, ('childids',), block_size, jobs):
+        if hits['childids']:
+            block['childids'] = hits['childids']
             blocks_found.append(block)
-        else:
-            block['folderids'] = []
     return blocks_found
 
-def blocks_with_child_attributes(dump, blocks, block_size = ENTRYBLOCK_SIZE):
-    blocks_found = []
-    for block in blocks:
-        dump.seek(block['offset'])
-        data = dump.read(block_size)
-        ids = find_bytes([0x20,0,0,0x80], data)
-        if ids:
-            block['childids'] = [ x + block['offset'] - 0x10 for x in ids ]
-            blocks_found.append(block)
+def blocks_with_attributes(dump, blocks, keys=tuple(ATTRIBUTE_SIGNATURES),
+                           block_size = ENTRYBLOCK_SIZE, jobs = 1):
+    """Read every block once and look for all the requested attribute
+    signatures (keys of ATTRIBUTE_SIGNATURES) at the same time, using jobs
+    processes. Returns a {key: blocks_found} dictionary."""
+    blocks_found = {k: [] for k in keys}
+    for block, hits in _blocks_attribute_hits(dump, blocks, tuple(keys), block_size, jobs):
+        for key in keys:
+            block[key] = hits[key]
+            if hits[key]:
+                blocks_found[key].append(block)
     return blocks_found
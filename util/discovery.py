@@ -0,0 +1,101 @@
+import re
+import part.refs.entry_block as reb
+import part.refs.vol as vol
+import util.parallel as parallel
+from media.image import as_image
+from util.carving import read_windows, SCAN_WINDOW_SIZE
+
+SECTOR_SIZE = vol.SECTOR_SIZE
+# filesystem name and structure identifier of the volume record, the match
+# starts REFS_VR_FILESYSTEMNAME_OFFSET bytes after the start of the sector
+VR_SIGNATURE = re.compile(re.escape(vol.REFS_VR_FILESYSTEMNAME_SIGNATURE.encode('ascii')) +
+                          b'.{' + str(vol.REFS_VR_STRUCT_ID_OFFSET -
+                                      vol.REFS_VR_FILESYSTEMNAME_OFFSET -
+                                      vol.REFS_VR_FILESYSTEMNAME_SIZE).encode('ascii') + b'}' +
+                          re.escape(vol.REFS_VR_STRUCT_ID_SIGNATURE.encode('ascii')),
+                          re.DOTALL)
+# the tree control is looked for to decide if a lonely volume record is the
+# backup of a volume whose first volume record is lost
+TREE_CONTROL_EB = 0x1e
+
+def _find_volume_records(dump, offset, end, window):
+    """Return the LBAs of the sectors between offset and end starting with
+    the volume record signature."""
+    lbas = []
+    for pos, data in read_windows(dump, offset, end, SECTOR_SIZE, window):
+        for match in VR_SIGNATURE.finditer(data):
+            start = match.start() - vol.REFS_VR_FILESYSTEMNAME_OFFSET
+            if start % SECTOR_SIZE == 0:
+                lbas.append((pos + start) // SECTOR_SIZE)
+    return lbas
+
+def find_volume_records(dump, jobs = 1, window = SCAN_WINDOW_SIZE):
+    """Search the whole dump for volume records, at sector granularity, using
+    jobs processes. Returns the sorted LBAs of the records found."""
+    size = as_image(dump).size
+    tasks = [ (start, stop, window)
+              for start, stop in parallel.split_range(0, size, jobs, SECTOR_SIZE, window) ]
+    return sorted(lba for lbas in parallel.run(dump, _find_volume_records, tasks, jobs)
+                  for lba in lbas)
+
+def _has_tree_control(dump, lba):
+    offset = lba * SECTOR_SIZE + TREE_CONTROL_EB * reb.ENTRYBLOCK_SIZE
+    return reb.is_entryblock(dump, offset, lba * SECTOR_SIZE)
+
+def find_volumes(dump, jobs = 1, window = SCAN_WINDOW_SIZE):
+    """Find the ReFS volumes of a dump without relying on its partition
+    table, from the volume records found by find_volume_records.
+
+    The last sector of a volume holds the backup of its volume record: a
+    record whose backup is found (same serial number) gives a confirmed
+    volume. Records without backup give a volume starting at their sector
+    (truncated image...), unless they are the backup of a volume whose first
+    record is lost, which is recognized by its tree control. The volumes are
+    returned as partitions (with the index, first_lba and last_lba keys of
+    the GPT partitions) sorted by first LBA."""
+    lbas = find_volume_records(dump, jobs, window)
+    records = { lba: vol.read_volume_record(dump, lba) for lba in lbas }
+    last_lba = as_image(dump).size // SECTOR_SIZE - 1
+    volumes = []
+    used = set()
+    for lba in lbas:
+        if lba in used:
+            continue
+        vr = records[lba]
+        num_sectors = vr['backup']
+        if num_sectors < 2:
+            continue
+        backup = records.get(lba + num_sectors - 1)
+        if backup is not None and backup['serial_number'] == vr['serial_number']:
+            used.add(lba + num_sectors - 1)
+            volumes.append(_volume(lba, lba + num_sectors - 1, vr, True, True))
+            continue
+        first = lba - num_sectors + 1
+        if first >= 0 and first not in records and _has_tree_control(dump, first):
+            volumes.append(_volume(first, lba, vr, False, True))
+        else:
+            volumes.append(_volume(lba, min(lba + num_sectors - 1, last_lba), vr, True, False))
+    volumes.sort(key=lambda x: x['first_lba'])
+    for index, volume in enumerate(volumes):
+        volume['index'] = index
+    return volumes
+
+def _volume(first_lba, last_lba, vr, primary, backup):
+    return {'index': None,
+            'first_lba': first_lba,
+            'last_lba': last_lba,
+            'serial_number': vr['serial_number'],
+            'version': (vr['version_major'], vr['version_minor']),
+            'primary_record': primary,
+            'backup_record': backup,
+            'discovered': True}
+
+def print_volume(volume, prefix=''):
+    print('{}Volume {} (found by its volume record):'.format(prefix, volume['index']))
+    print('{}  First LBA: {}'.format(prefix, volume['first_lba']))
+    print('{}  Last LBA: {}'.format(prefix, volume['last_lba']))
+    print('{}  Serial number: {:#018x}'.format(prefix, volume['serial_number']))
+    print('{}  Version: {}.{}'.format(prefix, *volume['version']))
+    print('{}  Volume record: {}'.format(prefix, 'found' if volume['primary_record'] else 'missing'))
+    print('{}  Backup volume record: {}'.format(prefix,
+                                                'found' if volume['backup_record'] else 'missing'))
@@ -1,48 +1,120 @@
 import part.refs.attribute as rattr
 import part.refs.entry_block as reb
 import util.carving as carving
+from media.image import read_block
+from util.blocks import BlockIndex
+
+# node of the root directory
+ROOT_NODEID = 0x600
+# fields of the attributes needed to read a directory, the metadata and the
+# dataruns of the files are not decoded
+DIRECTORY_FIELDS = frozenset(('filename', 'foldername', 'nodeid', 'pointers_data'))
+# fields of the filename attributes listed by file_dataruns
+FILE_DATARUN_FIELDS = frozenset(('filename', 'datarun'))
 
 def filetree(dump, v_offset, v_end_offset, nodeid, block_list = None, block_size = 16 * 1024):
     if not block_list:
         block_list = carving.find_blocks(dump, v_offset, v_end_offset, block_size)
-    tree = _filetree(dump, nodeid, block_list)
+    tree = _filetree(dump, nodeid, _index_blocks(block_list, block_size))
     print(tree)
     return tree
 
-def _filetree(dump, nodeid, complete_block_list):
-    node_block_list = [ reb.read_entryblock(dump, x['offset'])
-                        for x in complete_block_list
-                        if x['nodeid'] == nodeid ]
+def open_filetree(dump, v_offset, v_end_offset, nodeid = ROOT_NODEID, block_list = None,
+                  block_size = 16 * 1024):
+    """Return a lazy file tree rooted at nodeid. Directories are only read
+    when reached by dump_filetree, iter_filetree or resolve, and are not kept
+    once walked."""
+    if not block_list:
+        block_list = carving.find_blocks(dump, v_offset, v_end_offset, block_size)
+    return {'dump': dump,
+            'index': _index_blocks(block_list, block_size, cache=False),
+            'nodeid': nodeid}
+
+def _index_blocks(block_list, block_size, cache=True):
+    """Index the blocks found by carving.find_blocks by node identifier, the
+    nodes being parsed on demand by _node_blocks (and kept if cache), as
+    entryblocks of block_size bytes."""
+    if not isinstance(block_list, BlockIndex):
+        block_list = BlockIndex(block_list)
+    return {'blocks': block_list, 'block_size': block_size,
+            'parsed': {} if cache else None}
+
+def _node_blocks(dump, nodeid, index):
+    """Return the parsed entryblocks of the node, the {eb_number: entryblock}
+    dictionary of the node and the set of eb_numbers referenced by its
+    extents."""
+    parsed = index['parsed']
+    if parsed is not None and nodeid in parsed:
+        return parsed[nodeid]
+    blocks = [ reb.read_entryblock(dump, x['offset'], index['block_size'])
+               for x in index['blocks'].with_nodeid(nodeid) ]
+    by_number = {}
+    referenced = set()
+    for block in blocks:
+        by_number.setdefault(block['eb_number'], block)
+        if block['_contains_extents']:
+            referenced.update(ext['eb_number'] for ext in block['extents'])
+    if parsed is not None:
+        parsed[nodeid] = (blocks, by_number, referenced)
+    return blocks, by_number, referenced
+
+def _filetree(dump, nodeid, index):
+    tree = _read_directory(dump, nodeid, index)
+    for level, folder, node in _walk(tree, lambda f: _read_directory(dump, f['nodeid'], index)):
+        if folder is not None:
+            # same layout as the folders of the trees built before being lazy
+            folder['tree'] = node
+            del folder['nodeid']
+    return tree
+
+def _walk(tree, expand):
+    """Iterative pre-order walk of the directories of tree, yielding (level,
+    folder entry in the parent or None for tree, directory). Subdirectories
+    are obtained with expand(folder entry), directories already walked are
+    skipped (as are their subdirectories) to protect from loops."""
+    if not tree:
+        return
+    visited = set([tree['nodeid']])
+    yield 0, None, tree
+    stack = [iter(tree['folders'])]
+    while stack:
+        folder = next(stack[-1], None)
+        if folder is None:
+            stack.pop()
+            continue
+        node = expand(folder)
+        if node and node['nodeid'] in visited:
+            node = None
+        yield len(stack), folder, node
+        if node:
+            visited.add(node['nodeid'])
+            stack.append(iter(node['folders']))
+
+def _read_directory(dump, nodeid, index):
+    """Return the directory of the node, with its files and folders. Folders
+    are not read, their nodeid is given instead."""
+    node_block_list, by_number, referenced = _node_blocks(dump, nodeid, index)
     if not node_block_list:
         return None
     node_ext_block_list = [ x for x in node_block_list if x['_contains_extents'] ]
     node_rec_block_list = [ x for x in node_block_list if x['_contains_records'] ]
     rec_block_list = []
     if node_ext_block_list:
-        root_ext_block_list = []
-        for block in node_ext_block_list:
-            root = True
-            for _block in node_ext_block_list:
-                if block['eb_number'] in [ ext['eb_number'] for ext in _block['extents'] ]:
-                    root = False
-                    break
-            if root:
-                root_ext_block_list.append(block)
+        root_ext_block_list = [ x for x in node_ext_block_list
+                                if x['eb_number'] not in referenced ]
         max_counter = max([ x['counter'] for x in root_ext_block_list ])
         ext_block = [ x for x in root_ext_block_list if x['counter'] == max_counter ][0]
         rec_block_list.append(ext_block)
+        # replace the extent blocks by the blocks they point to, keeping the
+        # order, until only record blocks are left
         while [ x for x in rec_block_list if x['_contains_extents'] ]:
-            for i in range(len(rec_block_list)):
-                block = rec_block_list[i]
+            _flatten = []
+            for block in rec_block_list:
                 if block['_contains_extents']:
-                    blocks = []
-                    for blockid in [ b['eb_number'] for b in block['extents'] ]:
-                        blocks.append([ b for b in node_block_list if b['eb_number'] == blockid ][0])
-                    rec_block_list[i] = blocks
+                    _flatten.extend(by_number[ext['eb_number']] for ext in block['extents'])
                 else:
-                    rec_block_list[i] = [rec_block_list[i]]
-                _flatten = [ i for sub in rec_block_list for i in sub ]
-                rec_block_list = _flatten
+                    _flatten.append(block)
+            rec_block_list = _flatten
     else:
         if not node_rec_block_list:
             print('ERROR: didn\'t found any entryblock with extensions or records in any of the entryblocks of node {:#x} ({} entryblocks).'.format(nodeid, len(node_block_list)))
@@ -50,12 +122,14 @@ def _filetree(dump, nodeid, complete_block_list):
         max_counter = max([ x['counter'] for x in node_rec_block_list ])
         block = [ x for x in node_rec_block_list if x['counter'] == max_counter ][0]
         rec_block_list.append(block)
-    dm = _get_directory_metadata(rec_block_list)
+    # the attributes are decoded once for the three lookups
+    attributes = [ block.attributes(DIRECTORY_FIELDS) for block in rec_block_list ]
+    dm = _get_directory_metadata(rec_block_list, attributes)
     if not dm:
         return None
     rootname = _get_directory_metadata_name(dm)
-    files = _get_files(rec_block_list)
-    folders = _get_folders(rec_block_list, dump, complete_block_list)
+    files = _get_files(rec_block_list, attributes)
+    folders = _get_folders(rec_block_list, attributes)
     folder = {'name': rootname,
               'nodeid': rec_block_list[0]['node_id'],
               # 'entryblocks': block_list,
@@ -63,11 +137,11 @@ def _filetree(dump, nodeid, complete_block_list):
               'folders': folders}
     return folder
 
-def _get_directory_metadata(blocks):
-    for block in blocks:
+def _get_directory_metadata(blocks, attributes):
+    for block, attrs in zip(blocks, attributes):
         if 'pointers_data' in block.keys():
             ptrs = [ ptr
-                     for ptr in block['pointers_data']
+                     for ptr in attrs
                      if ptr['type'] == rattr.ATTR_TYPE_DIRECTORY_METADATA ]
             if ptrs:
                 return ptrs[0]
@@ -82,37 +156,117 @@ def _get_directory_metadata_name(attr):
              for ptr in attr['pointers_data']
              if ptr['type'] == rattr.DM_SUBATTR_TYPE_FOLDER ][0]
 
-def _get_files(blocks):
+def _get_files(blocks, attributes):
     files = []
-    for block in blocks:
+    for block, attrs in zip(blocks, attributes):
         bfiles = [ {'name': ptr['filename'],
                     'blockid': block['eb_number']}
-                   for ptr in block['pointers_data']
+                   for ptr in attrs
                    if ptr['type'] == rattr.ATTR_TYPE_FILENAME ]
         files.extend(bfiles)
     return files
 
-def _get_folders(blocks, dump, complete_block_list):
+def _get_folders(blocks, attributes):
     folders = []
-    for block in blocks:
+    for block, attrs in zip(blocks, attributes):
         bfolders = [ {'name': ptr['foldername'],
                       'blockid': block['eb_number'],
-                      'tree': _filetree(dump, ptr['nodeid'], complete_block_list)}
-                     for ptr in block['pointers_data']
+                      'nodeid': ptr['nodeid']}
+                     for ptr in attrs
                      if ptr['type'] == rattr.ATTR_TYPE_FILENAME_FOLDER ]
         folders.extend(bfolders)
     return folders
 
+def iter_filetree(tree):
+    """Yield (level, name, directory) for all the directories of a tree built
+    by filetree or opened by open_filetree, name being the folder name in its
+    parent directory ('.' for the root). Directories that could not be read
+    are yielded as None."""
+    if 'index' in tree:
+        dump = tree['dump']
+        index = tree['index']
+        expand = lambda f: _read_directory(dump, f['nodeid'], index)
+        tree = _read_directory(dump, tree['nodeid'], index)
+    else:
+        expand = lambda f: f['tree']
+    for level, folder, node in _walk(tree, expand):
+        yield level, '.' if folder is None else folder['name'].decode('utf-16le'), node
+
+def _name_matches(name, wanted):
+    # ReFS names are case insensitive
+    return name is not None and name.decode('utf-16le').casefold() == wanted.casefold()
+
+def resolve(tree, path):
+    """Return the directory or the file entry (name and blockid) found at
+    path ('/' or '\\' separated) in a tree opened by open_filetree, or None.
+    Only the directories on the path are read."""
+    dump = tree['dump']
+    index = tree['index']
+    node = _read_directory(dump, tree['nodeid'], index)
+    names = [ x for x in path.replace('\\', '/').split('/') if x ]
+    for i, name in enumerate(names):
+        if not node:
+            return None
+        folders = [ f for f in node['folders'] if _name_matches(f['name'], name) ]
+        if folders:
+            node = _read_directory(dump, folders[0]['nodeid'], index)
+            continue
+        files = [ f for f in node['files'] if _name_matches(f['name'], name) ]
+        if files and i == len(names) - 1:
+            return files[0]
+        return None
+    return node
+
 def dump_filetree(tree, level=0, name='.'):
+    """Print the directories and files of a tree built by filetree or opened
+    by open_filetree, lines are printed while the tree is walked."""
     if not tree:
         return
-    print('D {} {} ({}) {:#x}'.format(level * '.',
-        name,
-        tree['name'].decode('utf-16le') if tree['name'] else '<unknown>',
-        tree['nodeid']))
-    for f in tree['files']:
-        print('F {} {} {:#x}'.format((level + 1) * '.',
-            f['name'].decode('utf-16le') if f['name'] else '<unknown>',
-            f['blockid']))
-    for f in tree['folders']:
-        dump_filetree(f['tree'], level + 1, f['name'].decode('utf-16le'))
+    dump_filetree_entries(iter_filetree(tree), level, name)
+
+def dump_filetree_entries(entries, level=0, name='.'):
+    """Print the (level, name, directory) entries yielded by iter_filetree."""
+    for _level, _name, node in entries:
+        if not node:
+            continue
+        if _level == 0:
+            _name = name
+        _level = _level + level
+        print('D {} {} ({}) {:#x}'.format(_level * '.',
+            _name,
+            node['name'].decode('utf-16le') if node['name'] else '<unknown>',
+            node['nodeid']))
+        for f in node['files']:
+            print('F {} {} {:#x}'.format((_level + 1) * '.',
+                f['name'].decode('utf-16le') if f['name'] else '<unknown>',
+                f['blockid']))
+
+def file_dataruns(dump, blocks, block_size = 16 * 1024):
+    """Yield the files of the blocks with filename attributes (the fnas hits
+    of carving.find_blocks) and their dataruns, as dictionaries with the
+    offset, entryblock, nodeid and counter of the block, the filename, and
+    the dataruns as {'size': logical size, 'runs': [(blockid, blocks)]}."""
+    for block in blocks:
+        if not block['fnas']:
+            continue
+        # one read per block, the attributes are decoded from memory
+        block_data = read_block(dump, block['offset'], block_size)
+        for fid in block['fnas']:
+            attr = rattr.read_attribute(block_data, fid, FILE_DATARUN_FIELDS)
+            dataruns = []
+            if attr['datarun'] and attr['datarun']['pointers_data']:
+                for ptr in attr['datarun']['pointers_data']:
+                    if ptr['pointers_data']:
+                        dataruns.append({'size': ptr['logical_size'],
+                                         'runs': [ (x['blockid'], x['num_blocks'])
+                                                   for x in ptr['pointers_data'] ]})
+            try:
+                filename = attr['filename'].decode('utf-16le')
+            except:
+                filename = attr['filename']
+            yield {'offset': block['offset'],
+                   'entryblock': block['entryblock'],
+                   'nodeid': block['nodeid'],
+                   'counter': block['counter'],
+                   'filename': filename,
+                   'dataruns': dataruns}
@@ -0,0 +1,31 @@
+import json
+from array import array
+
+class JsonlWriter:
+    """Write records as JSON Lines on stream, one line per record as soon as
+    it is produced. The kind of record is given in the 'record' key, bytes
+    are written as hexadecimal strings."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._encode = json.JSONEncoder(separators=(',', ':'), default=_default).encode
+
+    def write(self, record_type, record):
+        line = {'record': record_type}
+        line.update(record)
+        self.stream.write(self._encode(line))
+        self.stream.write('\n')
+
+    def flush(self):
+        self.stream.flush()
+
+def _default(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, array):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    return repr(value)
@@ -0,0 +1,120 @@
+import part.refs.entry_block as reb
+import part.refs.object_tree as rot
+import part.refs.tree_control as rtc
+import part.refs.vol as vol
+from media.image import pread, read_block
+from util.blocks import BlockIndex
+from util.carving import BLOCK_HEADER_FORMAT, SECTOR_SIZE, ENTRYBLOCK_SIZE, blocks_with_attributes
+
+# entryblock of the tree control, the entry point of the volume metadata
+TREE_CONTROL_EB = 0x1e
+# node identifiers of the tree control extension and of the object tree
+TREE_CONTROL_EXT_NODE_ID = 0x1
+OBJECT_TREE_NODE_ID = 0x2
+
+def _read_block(dump, vbr_offset, end, eb_number, block_size):
+    """Return the block dictionary (as built by carving.find_blocks) and the
+    entryblock read at once (see media.image.read_block), or (None, None) if
+    the block is out of the partition or does not carry its number."""
+    offset = vbr_offset + eb_number * block_size
+    if offset + block_size > end:
+        return None, None
+    data = read_block(dump, offset, block_size)
+    header = pread(data, offset, BLOCK_HEADER_FORMAT.size)
+    if len(header) < BLOCK_HEADER_FORMAT.size:
+        return None, None
+    entryblock, counter, nodeid, childid = BLOCK_HEADER_FORMAT.unpack_from(header, 0)
+    if entryblock != eb_number:
+        return None, None
+    return ({'offset': offset, 'entryblock': entryblock,
+             'counter': counter, 'nodeid': nodeid,
+             'childid': childid, 'fnas': None,
+             'folderids': None}, data)
+
+def _node_blocks(dump, vbr_offset, end, eb_number, block_size, seen):
+    """Yield the blocks of the node rooted at eb_number: the root and, when it
+    holds extents, the blocks they point to (recursively). Blocks in seen are
+    skipped, and the yielded ones added to it."""
+    todo = [eb_number]
+    while todo:
+        number = todo.pop()
+        if number in seen:
+            continue
+        seen.add(number)
+        block, data = _read_block(dump, vbr_offset, end, number, block_size)
+        if block is None:
+            continue
+        yield block
+        if reb.has_extents(data, block['offset']):
+            eb = reb.read_entryblock(data, block['offset'], block_size)
+            # popped in the extents order
+            todo.extend(reversed([ ext['eb_number'] for ext in eb['extents'] ]))
+
+def _tree_control_blocks(dump, vbr_offset, end, block_size, seen):
+    tc_block, data = _read_block(dump, vbr_offset, end, TREE_CONTROL_EB, block_size)
+    if tc_block is None:
+        return
+    seen.add(TREE_CONTROL_EB)
+    yield tc_block
+    tc = rtc.read_tree_control(data, tc_block['offset'], block_size)
+    for ext_eb in tc['extent_pointers']:
+        ext_block, data = _read_block(dump, vbr_offset, end, ext_eb, block_size)
+        if ext_block is None or ext_block['nodeid'] != TREE_CONTROL_EXT_NODE_ID:
+            continue
+        seen.add(ext_eb)
+        yield ext_block
+        tc_e = rtc.read_tree_control_ext(data, ext_block['offset'], block_size)
+        for rec in tc_e['records']:
+            for block in _node_blocks(dump, vbr_offset, end, rec['eb_number'], block_size, seen):
+                yield block
+
+def tree_control_blocks(dump, lba_offset, lba_end, block_size = ENTRYBLOCK_SIZE):
+    """Return the blocks of the tree control, of its extensions and of the
+    nodes their records point to (object tree, allocator...), or an empty list
+    if the partition is not ReFS."""
+    if not vol.is_refs_part(dump, lba_offset):
+        return []
+    return list(_tree_control_blocks(dump, lba_offset * SECTOR_SIZE, lba_end * SECTOR_SIZE,
+                                     block_size, set()))
+
+def read_node_map(dump, lba_offset, lba_end, block_size = ENTRYBLOCK_SIZE):
+    """Return the {node id: entryblock number of the node root} map of the
+    object tree, found by following the tree control of the partition, and
+    the blocks read to build it. The map is empty when the partition is not
+    ReFS or when its tree control could not be followed."""
+    nodes = {}
+    blocks = tree_control_blocks(dump, lba_offset, lba_end, block_size)
+    for block in blocks:
+        if block['nodeid'] != OBJECT_TREE_NODE_ID:
+            continue
+        data = read_block(dump, block['offset'], block_size)
+        if reb.has_extents(data, block['offset']):
+            continue
+        ot = rot.read_object_tree(data, block['offset'], block_size)
+        for rec in ot['records']:
+            nodes.setdefault(rec['nodeid'], rec['eb_num'])
+    return nodes, blocks
+
+def find_blocks(dump, lba_offset, lba_end, block_size = ENTRYBLOCK_SIZE, keys = ()):
+    """Find the entryblocks of the partition from its metadata instead of
+    scanning it: the tree control leads to the object tree, whose records
+    give the root entryblock of every node, the blocks of the nodes being
+    reached through the extents of their root.
+
+    Only the blocks in use are found, the stale copies found by
+    carving.find_blocks are not. As for carving.find_blocks, the attribute
+    signatures of keys are looked for and the blocks are returned in a
+    util.blocks.BlockIndex, sorted by entryblock. None is returned if the
+    object tree could not be reached."""
+    nodes, blocks = read_node_map(dump, lba_offset, lba_end, block_size)
+    if not nodes:
+        return None
+    vbr_offset = lba_offset * SECTOR_SIZE
+    end = lba_end * SECTOR_SIZE
+    seen = set(x['entryblock'] for x in blocks)
+    for nodeid in sorted(nodes):
+        blocks.extend(_node_blocks(dump, vbr_offset, end, nodes[nodeid], block_size, seen))
+    blocks = BlockIndex(sorted(blocks, key=lambda x: x['entryblock']))
+    if keys:
+        blocks_with_attributes(dump, blocks, keys, block_size)
+    return blocks
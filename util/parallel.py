@@ -0,0 +1,76 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import media.image as image
+import media.iostats as iostats
+
+# number of chunks given to each worker, more chunks balance better the work
+# when some parts of the partition are slower to scan than others
+CHUNKS_PER_JOB = 4
+
+_worker_dump = None
+
+def cpu_count():
+    return os.cpu_count() or 1
+
+def split_range(offset, end, jobs, align, min_size=0):
+    """Split [offset, end) into consecutive (start, end) chunks whose starts
+    are aligned on align bytes from offset, at most jobs * CHUNKS_PER_JOB of
+    them and none smaller than min_size (except the last one)."""
+    if end <= offset:
+        return []
+    nunits = -(-(end - offset) // align)
+    nchunks = max(1, min(jobs * CHUNKS_PER_JOB, nunits))
+    units = max(-(-nunits // nchunks), -(-min_size // align), 1)
+    chunks = []
+    for start in range(offset, end, units * align):
+        chunks.append((start, min(end, start + units * align)))
+    return chunks
+
+def split_list(items, jobs, min_size=1):
+    """Split items into consecutive slices, see split_range."""
+    return [ items[start:stop]
+             for start, stop in split_range(0, len(items), jobs, 1, min_size) ]
+
+def _dump_source(dump):
+    path = getattr(dump, 'path', None) or getattr(dump, 'name', None)
+    backend = getattr(dump, 'backend', None)
+    if backend not in image.BACKENDS:
+        backend = image.DEFAULT_BACKEND
+    return path, backend
+
+def _init_worker(path, backend, accounted):
+    global _worker_dump
+    _worker_dump = image.open_image(path, backend)
+    if accounted:
+        _worker_dump = iostats.AccountedImage(_worker_dump)
+
+def _run_task(task):
+    func, args = task
+    if not isinstance(_worker_dump, iostats.AccountedImage):
+        return func(_worker_dump, *args), None
+    _worker_dump.reset_stats()
+    result = func(_worker_dump, *args)
+    return result, _worker_dump.stats()
+
+def run(dump, func, tasks, jobs=1):
+    """Return [ func(dump, *args) for args in tasks ].
+
+    With more than one job the tasks are run in a pool of jobs processes,
+    each one opening its own handle on the dump, func has to be a module level
+    function. Results are returned in the order of tasks, the reads of the
+    workers are added to the iostats.AccountedImage of dump if any. Dumps
+    which are not reopenable (see media.image.DumpImage) use only one job."""
+    path, backend = _dump_source(dump)
+    if (jobs <= 1 or len(tasks) <= 1 or not path or
+            not getattr(dump, 'reopenable', True)):
+        return [ func(dump, *args) for args in tasks ]
+    accounting = iostats.find_accounting(dump)
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks)),
+                             initializer=_init_worker,
+                             initargs=(path, backend, accounting is not None)) as executor:
+        results = []
+        for result, stats in executor.map(_run_task, [ (func, args) for args in tasks ]):
+            if stats is not None:
+                accounting.add_stats(stats)
+            results.append(result)
+        return results
@@ -0,0 +1,46 @@
+import util.carving as carving
+import util.parallel as parallel
+from util.filetree import open_filetree, iter_filetree, file_dataruns, ROOT_NODEID
+
+# Analysis of all the partitions of a dump at once, each partition in its own
+# worker. Partitions are given as (partition, block size, blocks) tasks, the
+# blocks being the ones already found in the partition or None, and the
+# results are returned as {partition index: result}.
+
+def _blocks(dump, part, block_size, blocks, keys=()):
+    if blocks is None:
+        return carving.find_blocks(dump, part['first_lba'], part['last_lba'], block_size,
+                                   keys=keys)
+    missing = [ k for k in keys if not blocks.has_hits(k) ]
+    if missing:
+        carving.blocks_with_attributes(dump, blocks, missing, block_size)
+    return blocks
+
+def _filetree(dump, part, block_size, blocks, nodeid):
+    tree = open_filetree(dump, part['first_lba'], part['last_lba'], nodeid,
+                         _blocks(dump, part, block_size, blocks), block_size)
+    # the lazy tree holds the dump, it is walked in the worker
+    return list(iter_filetree(tree))
+
+def _dataruns(dump, part, block_size, blocks):
+    blocks = _blocks(dump, part, block_size, blocks, ('fnas',))
+    return list(file_dataruns(dump, blocks, block_size))
+
+def _run(dump, func, tasks, args=()):
+    results = parallel.run(dump, func, [ task + tuple(args) for task in tasks ], len(tasks))
+    return { task[0]['index']: result for task, result in zip(tasks, results) }
+
+def find_blocks(dump, tasks, keys=()):
+    """Find the blocks of every partition (see carving.find_blocks), and the
+    hits of the attribute signatures of keys. Returns {index: BlockIndex}."""
+    return _run(dump, _blocks, tasks, (tuple(keys),))
+
+def filetrees(dump, tasks, nodeid = ROOT_NODEID):
+    """Walk the file tree of every partition from nodeid. Returns {index:
+    list of the (level, name, directory) entries of iter_filetree}."""
+    return _run(dump, _filetree, tasks, (nodeid,))
+
+def dataruns(dump, tasks):
+    """List the files of every partition and their dataruns (see
+    filetree.file_dataruns). Returns {index: list of files}."""
+    return _run(dump, _dataruns, tasks)
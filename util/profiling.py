@@ -0,0 +1,114 @@
+import cProfile
+import os
+import pstats
+
+# directory of the pyrefs sources, functions defined below it are grouped by
+# module (util.carving, part.refs.attribute...)
+SOURCES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUILTIN_MODULE = '<built-in>'
+OTHER_MODULE = '<other>'
+# collapsed stacks deeper than this are cut, and the ones taking less than
+# COLLAPSED_MIN_TIME seconds are dropped
+COLLAPSED_MAX_DEPTH = 128
+COLLAPSED_MIN_TIME = 1e-6
+
+def profile_call(func, *args):
+    """Run func(*args) under cProfile, return its result and the pstats.Stats
+    of the run."""
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(func, *args)
+    finally:
+        stats = pstats.Stats(profiler)
+    return result, stats
+
+def module_name(filename):
+    """Dotted name of the pyrefs module defined in filename, BUILTIN_MODULE for
+    the built-in functions and OTHER_MODULE for the rest (standard library...)."""
+    if filename == '~' or filename.startswith('<'):
+        return BUILTIN_MODULE
+    path = os.path.abspath(filename)
+    if not path.startswith(SOURCES_DIR + os.sep):
+        return OTHER_MODULE
+    name = os.path.splitext(os.path.relpath(path, SOURCES_DIR))[0]
+    return name.replace(os.sep, '.')
+
+def function_label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name
+    return '{}:{}'.format(name, line)
+
+def top_functions(stats, limit=20):
+    """Functions sorted by decreasing cumulative time, as dictionaries."""
+    functions = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        functions.append({'module': module_name(func[0]),
+                          'function': function_label(func),
+                          'calls': nc,
+                          'tottime': tt,
+                          'cumtime': ct})
+    functions.sort(key=lambda x: x['cumtime'], reverse=True)
+    return functions[:limit] if limit else functions
+
+def modules(stats):
+    """Time spent in the functions of each module (their own time, not the one
+    of the functions they call), sorted by decreasing time."""
+    by_module = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        name = module_name(func[0])
+        module = by_module.get(name)
+        if module is None:
+            module = by_module[name] = {'module': name, 'calls': 0, 'tottime': 0.0}
+        module['calls'] = module['calls'] + nc
+        module['tottime'] = module['tottime'] + tt
+    total = sum(x['tottime'] for x in by_module.values())
+    for module in by_module.values():
+        module['percent'] = module['tottime'] / total if total else 0.0
+    return sorted(by_module.values(), key=lambda x: x['tottime'], reverse=True)
+
+def collapsed_stacks(stats):
+    """Return {stack: seconds} with the ';' separated stacks of the run.
+
+    cProfile only keeps caller -> callee edges, the time of a function is
+    split between its call stacks in proportion of the time of the calls
+    coming from each caller."""
+    callees = {}
+    roots = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    stacks = {}
+    # iterative depth first walk of (function, time, stack of labels, functions on the stack)
+    todo = [ (func, stats.stats[func][3], (), frozenset()) for func in roots ]
+    while todo:
+        func, time, stack, on_stack = todo.pop()
+        cc, nc, tt, ct, callers = stats.stats[func]
+        label = '{}`{}'.format(module_name(func[0]), function_label(func))
+        stack = stack + (label,)
+        share = time / ct if ct else 0.0
+        self_time = tt * share
+        if self_time >= COLLAPSED_MIN_TIME:
+            key = ';'.join(stack)
+            stacks[key] = stacks.get(key, 0.0) + self_time
+        if len(stack) >= COLLAPSED_MAX_DEPTH:
+            continue
+        for callee, edge_time in callees.get(func, ()):
+            # recursive calls are already counted in the time of the caller
+            if callee in on_stack or callee == func:
+                continue
+            if edge_time * share >= COLLAPSED_MIN_TIME:
+                todo.append((callee, edge_time * share, stack, on_stack | {func}))
+    return stacks
+
+def write_collapsed(stats, path):
+    """Write the collapsed stacks (one 'stack microseconds' line each) read by
+    flamegraph.pl, speedscope and similar tools."""
+    stacks = collapsed_stacks(stats)
+    with open(path, 'w') as f:
+        for stack in sorted(stacks):
+            value = int(round(stacks[stack] * 1e6))
+            if value:
+                print('{} {}'.format(stack, value), file=f)
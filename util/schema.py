@@ -0,0 +1,114 @@
+from collections import namedtuple
+from struct import Struct, calcsize, unpack_from
+from media.image import pread
+
+# one field of a structure: its name (None for the bytes which are not
+# decoded), its struct format (one value), and for the dump_* printers its
+# label (None if not printed) and how its value is shown: a format string of
+# val, or a function returning the string to show. convert is applied to the
+# raw value when decoding, e.g. to turn bytes into a GUID string
+Field = namedtuple('Field', ('name', 'format', 'label', 'display', 'convert'))
+
+def field(name, fmt, label=None, display='{val}', convert=None):
+    return Field(name, fmt, label, display, convert)
+
+def skip(fmt):
+    """Bytes of the structure which are not decoded (reserved, unknown)."""
+    return Field(None, fmt, None, None, None)
+
+# display of the sizes and offsets
+HEX_DEC = '{val:#x} ({val})'
+HEX = '{val:#x}'
+
+# source of the decoders compiled for each schema, v being the values of the
+# structure and {record} the building of the record from them
+_DECODERS = """
+def decode(data, pos=0, record=None):
+    v = unpack_from(data, pos)
+{record}
+def read(dump, offset, record=None):
+    v = unpack_from(pread(dump, offset, size), 0)
+{record}
+"""
+
+class Schema:
+    """Structure declared once as a list of fields (see field and skip), in
+    their on disk order. The fields are compiled into a single Struct and
+    into the decoders of the structure, the same declaration driving the
+    printing of the records:
+    - decode(data, pos=0, record=None): decode the structure at pos in data
+      into record (a new dictionary if None), which is returned;
+    - read(dump, offset, record=None): same, reading the structure at offset
+      of dump.
+
+    Records are dictionaries, built with a single unpack_from: the readers
+    add the values they compute to them, and the callers keep using them as
+    before."""
+
+    __slots__ = ('name', 'fields', 'struct', 'size', 'offsets', 'decode', 'read', '_lines',
+                 '_by_name')
+
+    def __init__(self, name, fields, byte_order='<'):
+        self.name = name
+        self.fields = tuple(fields)
+        self.struct = Struct(byte_order + ''.join(f.format for f in self.fields))
+        self.size = self.struct.size
+        self.offsets = {}
+        # (name, line template, display function) of the printed fields
+        self._lines = []
+        self._by_name = {}
+        namespace = {'unpack_from': self.struct.unpack_from, 'pread': pread, 'size': self.size}
+        values = []
+        offset = 0
+        for position, f in enumerate(self.fields):
+            fmt = Struct(byte_order + f.format)
+            if len(fmt.unpack(bytes(fmt.size))) != 1:
+                raise ValueError('{}: field {} must hold one value ({})'.format(
+                    name, f.name, f.format))
+            if f.name is not None:
+                value = 'v[{}]'.format(position)
+                if f.convert is not None:
+                    namespace['convert{}'.format(position)] = f.convert
+                    value = 'convert{}({})'.format(position, value)
+                values.append((repr(f.name), value))
+                self.offsets[f.name] = offset
+                self._by_name[f.name] = self._line(f)
+                if f.label is not None:
+                    self._lines.append(self._by_name[f.name])
+            offset = offset + fmt.size
+        record = ['    if record is None:',
+                  '        return {{{}}}'.format(', '.join('{}: {}'.format(*x) for x in values))]
+        record.extend('    record[{}] = {}'.format(*x) for x in values)
+        record.append('    return record')
+        exec(_DECODERS.format(record='\n'.join(record)), namespace)
+        self.decode = namespace['decode']
+        self.read = namespace['read']
+
+    @staticmethod
+    def _line(f):
+        if f.label is None:
+            return None
+        label = f.label.replace('{', '{{').replace('}', '}}')
+        if callable(f.display):
+            return (f.name, '{prefix}' + label + ': {val}', f.display)
+        return (f.name, '{prefix}' + label + ': ' + f.display, None)
+
+    def dump(self, record, prefix='', names=None):
+        """Print the labelled fields of record (only the given names, in
+        their order, if names), one '<prefix><label>: <value>' line each.
+        The fields missing from record (not decoded) are not printed."""
+        lines = self._lines if names is None else [ self._by_name[x] for x in names ]
+        for line in lines:
+            if line is None or line[0] not in record:
+                continue
+            name, template, display = line
+            value = record[name]
+            if display is not None:
+                value = display(value)
+            print(template.format(prefix=prefix, val=value))
+
+def read_array(dump, offset, count, code='L', byte_order='<'):
+    """Read count values of the struct format code at offset (pointer
+    tables...) with one unpack_from."""
+    fmt = '{}{}{}'.format(byte_order, count, code)
+    return unpack_from(fmt, pread(dump, offset, calcsize(fmt)), 0)
@@ -0,0 +1,49 @@
+import hashlib
+import os
+
+# used when the sidecar files cannot be written next to the dump (read-only
+# evidence)
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pyrefs')
+
+def sidecar_paths(path, name):
+    """Return the candidate locations of the file name kept for the dump at
+    path (index...): next to the dump first and in CACHE_DIR then, prefixed
+    by a hash of the dump path."""
+    path = os.path.abspath(path)
+    cache_name = '{}-{}'.format(hashlib.sha1(path.encode('utf-8')).hexdigest()[:16], name)
+    return [os.path.join(os.path.dirname(path), name),
+            os.path.join(CACHE_DIR, cache_name)]
+
+def load_sidecar(paths, decode):
+    """Return decode(data) for the first of paths which can be read and is
+    not stale, or None. decode returns None for stale data and raises
+    ValueError for damaged data, which is stale as well."""
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        try:
+            value = decode(data)
+        except ValueError:
+            continue
+        if value is not None:
+            return value
+    return None
+
+def save_sidecar(paths, data):
+    """Write data to the first of paths which can be written, through a
+    temporary file so that readers never see it partially written. Returns
+    the path written or None."""
+    for path in paths:
+        tmp_path = path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            return path
+        except OSError:
+            continue
+    return None
@@ -0,0 +1,461 @@
+"""Synthetic ReFS 1.1 images generator.
+
+The images contain an MBR protecting a GPT with a single basic data
+partition holding the ReFS volume: volume record and its backup, tree control,
+tree control extension, object tree, allocator and a directory tree whose
+nodes hold directory metadata, filename (with dataruns), child and filename
+folder attributes. Only the structures read by the part.refs modules are written, the
+layouts being the ones of those readers."""
+import random
+import uuid
+from struct import Struct
+import media.mbr as mbr
+import media.gpt as gpt
+import part.refs.vol as rvol
+import part.refs.entry_block as reb
+import part.refs.tree_control as rtc
+import part.refs.object_tree as rot
+import part.refs.allocator as ralloc
+import part.refs.attribute as rattr
+
+SECTOR_SIZE = 512
+ENTRYBLOCK_SIZE = reb.ENTRYBLOCK_SIZE
+SECTORS_PER_CLUSTER = 128
+CLUSTER_BLOCKS = SECTORS_PER_CLUSTER * SECTOR_SIZE // ENTRYBLOCK_SIZE
+# clusters described by each allocator record
+AL_RECORD_CLUSTERS = 0x2000
+PART_FIRST_LBA = 2048
+GPT_NUM_PARTS = 128
+GPT_PART_SIZE = 128
+# sectors used by the GPT (header and partition entries) at the end of the media
+GPT_BACKUP_SECTORS = 34
+
+TREE_CONTROL_EB = 0x1e
+FIRST_FREE_EB = 0x20
+TREE_CONTROL_EXT_NODE_ID = 0x1
+OBJECT_TREE_NODE_ID = 0x2
+ROOT_NODE_ID = 0x600
+EXTENT_CONSTANT = 0x0000000808020000
+
+# 2018-09-16 as a FILETIME, in the range accepted by util.time.bytes2time
+SYNTH_TIME = 131815872000000000
+
+# the structures are the ones of the readers, only the attribute header is
+# extended with the attribute type that follows it
+ATTR_HEADER_FORMAT = Struct(rattr.ATTR_HEADER_FORMAT.format + 'L')
+EB_CHILDID_FORMAT = Struct('<Q8s')
+NODE_DESC_LENGTH = 0x38
+NODE_HEADER_OFFSET = reb.EB_HEADER_FORMAT.size + NODE_DESC_LENGTH
+NODE_HEADER_LENGTH = 0x20
+EXTENT_HEADER_LENGTH = 0x10
+TC_EXT_RECORD_LENGTH = 0x10
+
+def _align(value, alignment=8):
+    return (value + alignment - 1) & ~(alignment - 1)
+
+def _pad(data, alignment=8):
+    return data + bytes(_align(len(data), alignment) - len(data))
+
+def parse_size(s):
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+    s = s.strip().lower().rstrip('b')
+    if s and s[-1] in units:
+        return int(float(s[:-1]) * units[s[-1]])
+    return int(s, 0)
+
+# ----- attributes -----
+
+def _datarun_entry(logical_size, runs):
+    entries = []
+    for blockid, num_blocks in runs:
+        entries.append(rattr.ATTR_FN_DATARUN_ENTRY_BODY_LIST_ENTRY_FORMAT.pack(
+            rattr.ATTR_FN_DATARUN_ENTRY_BODY_LIST_ENTRY_FORMAT.size, bytes(20),
+            num_blocks, blockid))
+    ptrs_offset = _align(rattr.ATTR_FN_DATARUN_ENTRY_BODY_LIST_FORMAT.size)
+    first_entry = _align(ptrs_offset + 4 * len(runs))
+    pointers = [ first_entry + i * rattr.ATTR_FN_DATARUN_ENTRY_BODY_LIST_ENTRY_FORMAT.size
+                 for i in range(len(runs)) ]
+    list_size = first_entry + sum(len(e) for e in entries)
+    body_list = _pad(rattr.ATTR_FN_DATARUN_ENTRY_BODY_LIST_FORMAT.pack(
+        list_size, list_size, 0, bytes(4), ptrs_offset, len(runs), list_size))
+    body_list = _pad(body_list + Struct('<' + 'L' * len(runs)).pack(*pointers))
+    body_list = body_list + b''.join(entries)
+    physical_size = sum(n for _, n in runs) * ENTRYBLOCK_SIZE
+    header_size = _align(rattr.ATTR_FN_DATARUN_ENTRY_HEADER_FORMAT.size)
+    body = _pad(rattr.ATTR_FN_DATARUN_ENTRY_BODY_FORMAT.pack(
+        _align(rattr.ATTR_FN_DATARUN_ENTRY_BODY_FORMAT.size), bytes(48),
+        physical_size, logical_size))
+    size = header_size + len(body) + len(body_list)
+    header = _pad(rattr.ATTR_FN_DATARUN_ENTRY_HEADER_FORMAT.pack(
+        size, 0, 0, 0, header_size, len(body), len(body), 0, 0x80))
+    return header + body + body_list
+
+def _datarun(logical_size, runs):
+    entry = _datarun_entry(logical_size, runs)
+    first_pointer = _align(rattr.ATTR_FN_DATARUN_HEADER_FORMAT.size)
+    entry_offset = _align(first_pointer + 4)
+    size = entry_offset + len(entry)
+    header = _pad(rattr.ATTR_FN_DATARUN_HEADER_FORMAT.pack(
+        size, size, 0, 0, first_pointer, 1, size))
+    return _pad(header + Struct('<L').pack(entry_offset)) + entry
+
+def filename_attribute(name, parentid, childid, logical_size, runs):
+    fn = name.encode('utf-16le')
+    meta_offset = _align(0x14 + len(fn))
+    physical_size = sum(n for _, n in runs) * ENTRYBLOCK_SIZE
+    meta = rattr.ATTR_FN_METADATA_FORMAT.pack(
+        rattr.ATTR_FN_METADATA_FORMAT.size, 0x28, bytes(34),
+        SYNTH_TIME, SYNTH_TIME, SYNTH_TIME, SYNTH_TIME, 0x20, bytes(7),
+        parentid, childid, 0, logical_size, physical_size)
+    datarun = _datarun(logical_size, runs) if physical_size else b''
+    size = meta_offset + len(meta) + len(datarun)
+    header = ATTR_HEADER_FORMAT.pack(size, 0x10, 4 + len(fn), 0, meta_offset,
+                                     size - meta_offset, 0, rattr.ATTR_TYPE_FILENAME)
+    return _pad(_pad(header + fn) + meta + datarun)
+
+def filename_folder_attribute(name, nodeid):
+    fn = name.encode('utf-16le')
+    header_length = _align(0x14 + len(fn))
+    body = rattr.ATTR_FILENAME_FOLDER_BODY_FORMAT.pack(
+        nodeid, bytes(8), SYNTH_TIME, SYNTH_TIME, SYNTH_TIME, SYNTH_TIME)
+    size = header_length + len(body)
+    header = ATTR_HEADER_FORMAT.pack(size, 0x10, 4 + len(fn), 0, header_length,
+                                     len(body), 0, rattr.ATTR_TYPE_FILENAME_FOLDER)
+    return _pad(_pad(header + fn) + body)
+
+def child_attribute(name, parentid, childid):
+    fn = name.encode('utf-16le')
+    size = _align(rattr.ATTR_CHILD_HEADER_FORMAT.size + len(fn))
+    header = rattr.ATTR_CHILD_HEADER_FORMAT.pack(size, 0x10, 4, bytes(2), 0x18,
+                                    size - 0x18, bytes(2), rattr.ATTR_TYPE_CHILD,
+                                    bytes(4), parentid, bytes(4), childid,
+                                    bytes(8), 0xc, len(fn))
+    return _pad(header + fn)
+
+def _dm_subattribute(subtype, body):
+    header_length = _align(rattr.DM_SUBATTR_SI30_HEADER_FORMAT.size)
+    size = _align(header_length + len(body))
+    header = rattr.DM_SUBATTR_SI30_HEADER_FORMAT.pack(size, 0, 0x10, 0, header_length,
+                                           len(body), len(body), 0, subtype,
+                                           '$I30'.encode('utf-16le'))
+    return _pad(_pad(header) + body)
+
+def directory_metadata_attribute(name, nodeid, parentid):
+    fn = name.encode('utf-16le')
+    body = rattr.ATTR_DIR_METADATA_BODY_FORMAT.pack(
+        rattr.ATTR_DIR_METADATA_BODY_FORMAT.size, 0x28, bytes(34),
+        SYNTH_TIME, SYNTH_TIME, SYNTH_TIME, SYNTH_TIME, bytes(8), nodeid)
+    si30 = _dm_subattribute(rattr.DM_SUBATTR_TYPE_SI30, b'')
+    folder_body = rattr.DM_SUBATTR_FOLDER_BODY_FORMAT.pack(
+        0, 0, 0, 0, parentid, nodeid, SYNTH_TIME, SYNTH_TIME, SYNTH_TIME,
+        SYNTH_TIME, bytes(24), len(name))
+    folder_body = folder_body + bytes(0x5e - len(folder_body)) + fn
+    folder = _dm_subattribute(rattr.DM_SUBATTR_TYPE_FOLDER, folder_body)
+    first_pointer = _align(rattr.ATTR_DIR_METADATA_PSEC_FORMAT.size)
+    rec_offset = _align(first_pointer + 8)
+    psec = _pad(rattr.ATTR_DIR_METADATA_PSEC_FORMAT.pack(
+        rec_offset, bytes(12), first_pointer, 2, rec_offset + len(si30) + len(folder)))
+    psec = _pad(psec + Struct('<LL').pack(rec_offset, rec_offset + len(si30)))
+    header_length = 0x18
+    size = header_length + len(body) + len(psec) + len(si30) + len(folder)
+    header = ATTR_HEADER_FORMAT.pack(size, 0x10, 4, 0, header_length,
+                                     size - header_length, 0,
+                                     rattr.ATTR_TYPE_DIRECTORY_METADATA)
+    return _pad(header) + body + psec + si30 + folder
+
+# ----- entryblocks -----
+
+def _eb_header(eb, counter, node_id, child_id=0):
+    return reb.EB_HEADER_FORMAT.pack(eb, counter, bytes(8), node_id,
+                                     EB_CHILDID_FORMAT.pack(child_id, bytes(8)))
+
+def _extent(eb):
+    header = reb.EB_EXTENT_HEADER_FORMAT.pack(
+        EXTENT_HEADER_LENGTH + reb.EB_EXTENT_BODY_FORMAT.size, 0, 0, 0x10, 0x18)
+    return (header.ljust(EXTENT_HEADER_LENGTH, b'\x00') +
+            reb.EB_EXTENT_BODY_FORMAT.pack(eb, EXTENT_CONSTANT, 0))
+
+NODE_CAPACITY = ENTRYBLOCK_SIZE - NODE_HEADER_OFFSET - NODE_HEADER_LENGTH - 0x100
+
+def node_block(eb, counter, node_id, records, child_id=0):
+    body = b''
+    pointers = []
+    for rec in records:
+        pointers.append(NODE_HEADER_LENGTH + len(body))
+        body = body + rec
+    first_pointer = NODE_HEADER_LENGTH + len(body)
+    ptrs = Struct('<' + 'L' * len(pointers)).pack(*pointers)
+    end = first_pointer + len(ptrs)
+    desc = reb.EB_NODE_DESC_FORMAT.pack(NODE_DESC_LENGTH, bytes(20), 0, bytes(6),
+                                    len(records))
+    node_header = reb.EB_NODE_HEADER_FORMAT.pack(
+        NODE_HEADER_LENGTH, first_pointer, ENTRYBLOCK_SIZE - NODE_HEADER_OFFSET - end,
+        0, first_pointer, len(pointers), end)
+    block = (_eb_header(eb, counter, node_id, child_id) + desc.ljust(NODE_DESC_LENGTH, b"\x00") +
+             node_header + body + ptrs)
+    if len(block) > ENTRYBLOCK_SIZE:
+        raise ValueError('node {:#x} records do not fit in one entryblock'.format(node_id))
+    return block + bytes(ENTRYBLOCK_SIZE - len(block))
+
+def extent_block(eb, counter, node_id, ext_ebs):
+    table_length = reb.EB_EXTENT_TABLE_FORMAT.size
+    ptrs_size = _align(4 * len(ext_ebs))
+    extent_size = EXTENT_HEADER_LENGTH + reb.EB_EXTENT_BODY_FORMAT.size
+    pointers = [ table_length + ptrs_size + i * extent_size
+                 for i in range(len(ext_ebs)) ]
+    extents = b''.join(_extent(x) for x in ext_ebs)
+    table = reb.EB_EXTENT_TABLE_FORMAT.pack(table_length, 0, 0, 0, table_length,
+                                        len(ext_ebs), table_length + ptrs_size, 0)
+    desc = reb.EB_NODE_DESC_FORMAT.pack(NODE_DESC_LENGTH, bytes(20), len(ext_ebs),
+                                    bytes(6), 0)
+    block = (_eb_header(eb, counter, node_id) + desc.ljust(NODE_DESC_LENGTH, b"\x00") + table +
+             _pad(Struct('<' + 'L' * len(pointers)).pack(*pointers)) + extents)
+    return block + bytes(ENTRYBLOCK_SIZE - len(block))
+
+def tree_control_block(eb, ext_ebs):
+    offset_extents = rtc.TC_HEADER_FORMAT.size
+    ptrs = Struct('<' + 'Q' * len(ext_ebs)).pack(*ext_ebs)
+    header = rtc.TC_HEADER_FORMAT.pack(eb, bytes(72), offset_extents, len(ext_ebs),
+                                   offset_extents + len(ptrs), 0)
+    block = header + ptrs
+    return block + bytes(ENTRYBLOCK_SIZE - len(block))
+
+def tree_control_ext_block(eb, counter, rec_ebs):
+    header = rtc.TC_EXT_HEADER_FORMAT.pack(eb, counter, bytes(8), TREE_CONTROL_EXT_NODE_ID,
+                                       bytes(28), TC_EXT_RECORD_LENGTH, bytes(24),
+                                       len(rec_ebs))
+    offsets = [ rtc.TC_EXT_RECORD_OFFSET + i * TC_EXT_RECORD_LENGTH for i in range(len(rec_ebs)) ]
+    block = bytearray(ENTRYBLOCK_SIZE)
+    block[0:len(header)] = header
+    ptrs = Struct('<' + 'L' * len(offsets)).pack(*offsets)
+    block[len(header):len(header) + len(ptrs)] = ptrs
+    for off, x in zip(offsets, rec_ebs):
+        block[off:off + 8] = Struct('<Q').pack(x)
+    return bytes(block)
+
+def object_tree_record(nodeid, eb):
+    return rot.OT_HEADER_3_FORMAT.pack(rot.OT_HEADER_3_FORMAT.size, bytes(20), nodeid, eb, bytes(8), nodeid)
+
+def allocator_record(first_cluster, allocated):
+    """Record of the clusters from first_cluster, allocated giving the state
+    of each one."""
+    bitmap = bytearray(-(-len(allocated) // 8))
+    for i, x in enumerate(allocated):
+        if x:
+            bitmap[i // 8] = bitmap[i // 8] | (1 << (i % 8))
+    key = ralloc.AL_RECORD_KEY_FORMAT.pack(first_cluster, len(allocated))
+    value = ralloc.AL_RECORD_VALUE_FORMAT.pack(len(allocated) - sum(allocated),
+                                               len(bitmap)) + bitmap
+    key_offset = rattr.ATTR_HEADER_FORMAT.size
+    value_offset = _align(key_offset + len(key))
+    size = value_offset + len(value)
+    header = rattr.ATTR_HEADER_FORMAT.pack(size, key_offset, len(key), 0, value_offset,
+                                           len(value), 0)
+    return _pad(_pad(header + key) + value)
+
+# ----- image -----
+
+class _Allocator:
+
+    def __init__(self, first, last, rng, fragmentation):
+        self.next = first
+        self.last = last
+        self.rng = rng
+        self.fragmentation = fragmentation
+        self.data_next = None
+
+    def align(self, blocks):
+        self.next = -(-self.next // blocks) * blocks
+
+    def block(self):
+        if self.next > self.last:
+            raise ValueError('synthetic volume too small for the requested layout')
+        eb = self.next
+        self.next = self.next + 1
+        return eb
+
+    def runs(self, num_blocks):
+        nruns = max(1, min(self.fragmentation, num_blocks))
+        sizes = [ num_blocks // nruns ] * nruns
+        for i in range(num_blocks % nruns):
+            sizes[i] = sizes[i] + 1
+        runs = []
+        for n in sizes:
+            if nruns > 1:
+                # leave a gap so that the runs are not contiguous
+                self.next = self.next + self.rng.randint(1, 4)
+            start = self.next
+            self.next = self.next + n
+            if self.next > self.last:
+                raise ValueError('synthetic volume too small for the requested layout')
+            runs.append((start, n))
+        return runs
+
+def _split_records(records):
+    chunks = [[]]
+    used = 0
+    for rec in records:
+        if used + len(rec) + 4 > NODE_CAPACITY and chunks[-1]:
+            chunks.append([])
+            used = 0
+        chunks[-1].append(rec)
+        used = used + len(rec) + 4
+    return chunks
+
+def _write_block(f, part_offset, eb, block):
+    f.seek(part_offset + eb * ENTRYBLOCK_SIZE)
+    f.write(block)
+
+def _node_size(records):
+    # number of entryblocks written by _write_node
+    n = len(_split_records(records))
+    return n + 1 if n > 1 else n
+
+def _write_node(f, part_offset, alloc, counter, nodeid, records, reserved=None):
+    """Write the node records in as many entryblocks as needed (behind an
+    extent block if more than one) and return the entryblock of the node.
+    The entryblocks are taken from reserved if given (see _node_size)."""
+    block = (lambda: reserved.pop(0)) if reserved is not None else alloc.block
+    ebs = []
+    for chunk in _split_records(records):
+        eb = block()
+        _write_block(f, part_offset, eb, node_block(eb, counter, nodeid, chunk))
+        ebs.append(eb)
+    if len(ebs) > 1:
+        eb = block()
+        _write_block(f, part_offset, eb, extent_block(eb, counter, nodeid, ebs))
+        ebs = [eb]
+    return ebs[0]
+
+def generate(path, size, directories=10, files_per_directory=10,
+             fragmentation=1, stale_copies=0, max_file_size=64 * 1024,
+             seed=0, fill=True):
+    """Write a synthetic image of size bytes to path.
+
+    directories are spread randomly in the tree under the root folder, each
+    one holding files_per_directory files of 1 to max_file_size bytes split in
+    up to fragmentation non contiguous dataruns. Each directory node also gets
+    stale_copies older copies (lower counter, missing its last records) as
+    left by copy on write, in clusters marked free by the allocator. With
+    fill the data blocks of the files start with a tag giving the file name
+    and block number.
+
+    The image is a sparse file, blocks are written as they are allocated.
+    Returns the layout of the image (partition, node entryblocks...)."""
+    rng = random.Random(seed)
+    total_sectors = size // SECTOR_SIZE
+    first_lba = PART_FIRST_LBA
+    last_lba = total_sectors - GPT_BACKUP_SECTORS
+    if last_lba <= first_lba:
+        raise ValueError('synthetic volume too small for the requested layout')
+    part_offset = first_lba * SECTOR_SIZE
+    num_blocks = ((last_lba - first_lba) * SECTOR_SIZE) // ENTRYBLOCK_SIZE
+    alloc = _Allocator(FIRST_FREE_EB, num_blocks - 1, rng, fragmentation)
+
+    # directory tree: node ids and parents
+    dirs = [ {'nodeid': ROOT_NODE_ID, 'parent': ROOT_NODE_ID, 'name': '',
+              'subdirs': [], 'files': []} ]
+    for i in range(1, directories):
+        parent = dirs[rng.randrange(len(dirs))]
+        d = {'nodeid': ROOT_NODE_ID + i, 'parent': parent['nodeid'],
+             'name': 'dir{:05d}'.format(i), 'subdirs': [], 'files': []}
+        parent['subdirs'].append(d)
+        dirs.append(d)
+
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        childid = 0x100000
+        for d in dirs:
+            for j in range(files_per_directory):
+                logical_size = rng.randint(1, max_file_size)
+                nblocks = (logical_size + ENTRYBLOCK_SIZE - 1) // ENTRYBLOCK_SIZE
+                runs = alloc.runs(nblocks)
+                name = 'file{:05d}_{:04d}.txt'.format(d['nodeid'] - ROOT_NODE_ID, j)
+                d['files'].append({'name': name, 'childid': childid,
+                                   'size': logical_size, 'runs': runs})
+                childid = childid + 1
+                if fill:
+                    tag = 'PYREFS {} node {:#x} '.format(name, d['nodeid']).encode('ascii')
+                    for start, n in runs:
+                        for b in range(start, start + n):
+                            _write_block(f, part_offset, b,
+                                         tag + 'block {:#x}'.format(b).encode('ascii'))
+
+        # directory nodes, the stale copies first
+        nodes = {}
+        free = []
+        for d in dirs:
+            records = [ directory_metadata_attribute(d['name'], d['nodeid'], d['parent']) ]
+            for x in d['files']:
+                records.append(filename_attribute(x['name'], d['nodeid'], x['childid'],
+                                                  x['size'], x['runs']))
+                records.append(child_attribute(x['name'], d['nodeid'], x['childid']))
+            for x in d['subdirs']:
+                records.append(filename_folder_attribute(x['name'], x['nodeid']))
+            if stale_copies:
+                alloc.align(CLUSTER_BLOCKS)
+                start = alloc.next
+            for version in range(stale_copies, 0, -1):
+                _write_node(f, part_offset, alloc, 10 + stale_copies - version,
+                            d['nodeid'], records[:max(1, len(records) - version)])
+            if stale_copies:
+                alloc.align(CLUSTER_BLOCKS)
+                free.append((start // CLUSTER_BLOCKS, alloc.next // CLUSTER_BLOCKS))
+            nodes[d['nodeid']] = _write_node(f, part_offset, alloc, 10 + stale_copies,
+                                             d['nodeid'], records)
+
+        # object tree, allocator, tree control extension and tree control, the
+        # blocks of the allocator being reserved before its bitmap is built
+        ot_records = [ object_tree_record(n, eb) for n, eb in sorted(nodes.items()) ]
+        ot_eb = _write_node(f, part_offset, alloc, 1, OBJECT_TREE_NODE_ID, ot_records)
+        num_clusters = -(-num_blocks // CLUSTER_BLOCKS)
+        firsts = range(0, num_clusters, AL_RECORD_CLUSTERS)
+        al_size = _node_size([ allocator_record(x, [0] * min(AL_RECORD_CLUSTERS, num_clusters - x))
+                               for x in firsts ])
+        al_reserved = [ alloc.block() for i in range(al_size) ]
+        tce_eb = alloc.block()
+        used = -(-alloc.next // CLUSTER_BLOCKS)
+        freed = set(c for start, stop in free for c in range(start, stop))
+        allocated = [ c < used and c not in freed for c in range(num_clusters) ]
+        al_records = [ allocator_record(x, allocated[x:x + AL_RECORD_CLUSTERS]) for x in firsts ]
+        al_eb = _write_node(f, part_offset, alloc, 1, ralloc.ALLOCATOR_NODE_ID, al_records,
+                            al_reserved)
+        _write_block(f, part_offset, tce_eb, tree_control_ext_block(tce_eb, 1, [ot_eb, al_eb]))
+        _write_block(f, part_offset, TREE_CONTROL_EB,
+                     tree_control_block(TREE_CONTROL_EB, [tce_eb]))
+
+        _write_partition_table(f, total_sectors, first_lba, last_lba, rng)
+        vr = _volume_record(last_lba - first_lba + 1, rng)
+        f.seek(first_lba * SECTOR_SIZE)
+        f.write(vr)
+        f.seek(last_lba * SECTOR_SIZE)
+        f.write(vr)
+    return {'first_lba': first_lba, 'last_lba': last_lba, 'nodes': nodes,
+            'directories': dirs, 'object_tree': ot_eb, 'allocator': al_eb,
+            'free_clusters': free, 'tree_control_extension': tce_eb}
+
+def _volume_record(num_sectors, rng):
+    return rvol.REFS_VR_FORMAT.pack(b'\xeb\x52\x90', b'ReFS\x00\x00\x00\x00', bytes(5), b'FSRS',
+                          rvol.REFS_VR_FORMAT.size, 0, num_sectors, SECTOR_SIZE,
+                          SECTORS_PER_CLUSTER, 1, 1, bytes(14), rng.getrandbits(64))
+
+def _write_partition_table(f, total_sectors, first_lba, last_lba, rng):
+    sector = bytearray(SECTOR_SIZE)
+    mbr.MBR_PART_FORMAT.pack_into(sector, mbr.MBR_PART_TABLE_OFFSET, 0, bytes(3),
+                                  mbr.MBR_PARTTYPE_GPT, bytes(3), 1,
+                                  min(total_sectors - 1, 0xffffffff))
+    mbr.MBR_TERMINATOR_FORMAT.pack_into(sector, mbr.MBR_TERMINATOR_OFFSET, mbr.MBR_TERMINATOR)
+    f.seek(0)
+    f.write(sector)
+    part = gpt.GPT_PART_FORMAT.pack(uuid.UUID(gpt.GUID_PART_TYPE_W_BASIC_DATA_PART).bytes_le,
+                                uuid.UUID(int=rng.getrandbits(128)).bytes_le, first_lba, last_lba, 0,
+                                'Synthetic ReFS'.encode('utf-16le').ljust(72, b'\x00'))
+    header = gpt.GPT_HEADER_FORMAT.pack(b'EFI PART', 0x10000, 92, 0, 0, 1,
+                                    total_sectors - 1, GPT_BACKUP_SECTORS,
+                                    total_sectors - GPT_BACKUP_SECTORS,
+                                    uuid.UUID(int=rng.getrandbits(128)).bytes_le, 2, GPT_NUM_PARTS,
+                                    GPT_PART_SIZE, 0)
+    f.seek(SECTOR_SIZE)
+    f.write(header)
+    f.seek(2 * SECTOR_SIZE)
+    f.write(part)
@@ -3,6 +3,7 @@ import argparse
 import media.mbr as mbr
 import media.gpt as gpt
 import part.refs.vol as refs
+import util.discovery as discovery
 
 parser = argparse.ArgumentParser(description='Read from provided dump.')
 parser.add_argument('dump', action='store',
@@ -11,8 +12,15 @@ args = parser.parse_args()
 mbr_data = mbr.readMBR(args.dump)
 # we make the supposition that if it is a GPT media then only one
 # partition is declared in the MBR
-if not (len(mbr_data) == 1 and mbr_data[0][1]['ptype'] == mbr.MBR_PARTTYPE_GPT):
+if not (mbr_data and len(mbr_data) == 1 and mbr_data[0][1]['ptype'] == mbr.MBR_PARTTYPE_GPT):
     print(mbr_data)
+    # no partition table to rely on, look for the ReFS volume records
+    for volume in discovery.find_volumes(args.dump):
+        discovery.print_volume(volume)
+        if not volume['primary_record']:
+            continue
+        refs_fsstat = refs.fsstat(args.dump, volume['first_lba'], volume['last_lba'])
+        refs.dump_fsstat(refs_fsstat)
     sys.exit()
 
 gpt_data = gpt.readGPT(args.dump, mbr_data[0][1]['start'])